@@ -1,9 +1,11 @@
 import sys
 sys.path.append("..")
 
-from flask import Flask, request, send_file, jsonify
-from codebase.fetch_audio import get_reciters, get_surahs
-from codebase.pipeline import generate_video, GENERATED_FILENAME
+from flask import Flask, request, send_file, jsonify, Response
+from codebase.fetch_audio import get_reciters, get_surahs, warm_metadata_cache
+from codebase.pipeline import generate_video, read_job, GENERATED_FILENAME
+from codebase.footage import LocalLibraryFootageSource
+from codebase.metrics import registry as metrics_registry
 from codebase.status import Status as InternalStatus
 from codebase.status import StatusReader as InternalStatusReader
 import uuid, os, logging, logging.config
@@ -21,12 +23,19 @@ class APIStatus(str, Enum):
 
 VERSION= "v1"
 TEMP_DIR_NAME = "api_temporary"
+FOOTAGE_LIBRARY_DIR_NAME = "footage_library"
 logging.config.fileConfig('logging.conf')
 
 TEMP_DIR = os.path.join(os.getcwd(), TEMP_DIR_NAME )
 if(not os.path.exists(TEMP_DIR)):
     os.mkdir(TEMP_DIR)
 
+warm_metadata_cache(refresh_in_background=True)
+
+# Jobs take their videos from the local footage library when there is one
+FOOTAGE_LIBRARY_DIR = os.path.join(os.getcwd(), FOOTAGE_LIBRARY_DIR_NAME)
+footage_source = LocalLibraryFootageSource(FOOTAGE_LIBRARY_DIR) if os.path.exists(FOOTAGE_LIBRARY_DIR) else None
+
 
 @app.get(f"/{VERSION}/reciters")
 def get_reciters_request():
@@ -52,7 +61,8 @@ def post_generate_request():
         _ = os.mkdir(job_dir_path)
 
         thread = Thread(target=generate_video,
-                        args=(reciter_id, surah_id, start_aya, end_aya, job_dir_path))
+                        args=(reciter_id, surah_id, start_aya, end_aya, job_dir_path),
+                        kwargs={"footage_source": footage_source})
         thread.start()
 
         return jsonify({"status": APIStatus.SUCCESS, "job_id": job_name})
@@ -66,6 +76,38 @@ def post_generate_request():
         return jsonify({"status": APIStatus.FAILED, "message": "Job creation failed"})
 
 
+@app.post(f"/{VERSION}/retry")
+def post_retry_request():
+
+    try:
+        job_id = request.form["job_id"]
+        job_dir = os.path.join(TEMP_DIR, job_id)
+        job = read_job(job_dir)
+        if job is None:
+            return jsonify({"status": APIStatus.FAILED, "message": "Unknown job"})
+
+        status_reader = InternalStatusReader(job_dir)
+        job_status = status_reader.get_status()
+        status_reader.close()
+        if job_status["status"] not in [InternalStatus.NAMED_FAILURE, InternalStatus.UNAMED_FAILURE]:
+            return jsonify({"status": APIStatus.FAILED, "message": "Only failed jobs can be retried"})
+
+        # rerun with the stored parameters (hd, render mode...), the stages the job completed are resumed from their checkpoints
+        thread = Thread(target=generate_video,
+                        kwargs={**job, "directory": job_dir, "footage_source": footage_source, "resume": True})
+        thread.start()
+
+        return jsonify({"status": APIStatus.SUCCESS, "job_id": job_id})
+
+    except KeyError as e:
+        logging.error(f"Error {type(e)} args: {e.args}")
+        return jsonify({"status": APIStatus.FAILED, "message": "Wrong or missing body param"})
+
+    except Exception as e:
+        logging.error(f"Error {type(e)} args: {e.args}")
+        return jsonify({"status": APIStatus.FAILED, "message": "Job retry failed"})
+
+
 @app.get(f"/{VERSION}/job")
 # Expects ?id=...
 def get_job_status_request():
@@ -87,7 +129,8 @@ def get_job_status_request():
             resource_url = f"/{VERSION}/download?id={job_id}"
             return jsonify({"status": APIStatus.DONE, "resource": resource_url})
         else:
-            return jsonify({"status": APIStatus.RUNNIG, "progress": job_status["progress"], "stage": job_status["status"].value})
+            return jsonify({"status": APIStatus.RUNNIG, "progress": job_status["progress"], "stage": job_status["status"].value,
+                            "eta": job_status.get("eta")})
         
     except KeyError as e:
         logging.error(f"API Error {type(e)} args: {e.args}")
@@ -97,6 +140,11 @@ def get_job_status_request():
         logging.error(f"API Error {type(e)} args: {e.args}")
         return jsonify({"status": APIStatus.FAILED, "message": "Job status retrieval failed"})
     
+@app.get(f"/{VERSION}/metrics")
+def get_metrics_request():
+    # the stage and job metrics of the jobs run since the API started, in the Prometheus text format
+    return Response(metrics_registry.prometheus_text(), mimetype="text/plain; version=0.0.4")
+
 @app.get(f'/{VERSION}/download')
 # Expects ?id=...
 def download_video():
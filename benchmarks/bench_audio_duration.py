@@ -0,0 +1,32 @@
+# A script to benchmark header based mp3 durations against a full pydub decode
+import sys
+sys.path.append("..")
+
+import argparse, glob, os, time
+from codebase.audio_duration import mp3_duration, decoded_duration
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark mp3 duration computation and check both methods agree.')
+    parser.add_argument('path', help='An mp3 file or a directory of mp3 files, e.g. a kept generator_temporary/mp3')
+    parser.add_argument('--tolerance', type=float, default=0.05, help='The maximum allowed difference in seconds')
+
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(os.path.join(args.path, "*.mp3"))) if os.path.isdir(args.path) else [args.path]
+    headers_time, decode_time, failures = 0, 0, 0
+    for filename in files:
+        sttime = time.time()
+        headers = mp3_duration(filename)
+        headers_time += time.time() - sttime
+
+        sttime = time.time()
+        decoded = decoded_duration(filename)
+        decode_time += time.time() - sttime
+
+        agree = abs(headers - decoded) <= args.tolerance
+        failures += 0 if agree else 1
+        print(f"{os.path.basename(filename)}: headers {headers:.3f} s, decoded {decoded:.3f} s {'' if agree else 'MISMATCH'}")
+
+    print(f"\n{len(files)} files: headers {headers_time:.3f} s, pydub {decode_time:.3f} s")
+    if headers_time > 0: print(f"Speedup x{decode_time/headers_time:.1f}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,62 @@
+# A script to benchmark the caption rendering: one drawtext filter per caption against one ASS subtitle file
+import sys
+sys.path.append("..")
+
+import argparse, os, subprocess, tempfile, time
+from codebase.subtitles import write_ass, ass_filter, text_layout, FONT_FILE
+from media import make_captions
+
+def has_filter(name):
+    filters = subprocess.run(['ffmpeg', '-hide_banner', '-filters'], capture_output=True, text=True).stdout
+    return any(line.split()[1:2] == [name] for line in filters.splitlines())
+
+def drawtext_graph(captions, width, height, hd):
+    """ The per caption drawtext filters, as ffmpeg_compose used to build them. """
+    caption = text_layout(width, height, hd)["caption"]
+    drawtexts = []
+    for timed_text in captions:
+        drawtexts += [(
+            f"drawtext=text='{timed_text.text}':x=(w-text_w)/2:y=(h-text_h)/2+{caption['y'] - height // 2}:"
+            f"fontsize={caption['fontsize']}:fontfile={FONT_FILE}:fontcolor=white:"
+            f"enable='between(t,{timed_text.start_time},{timed_text.end_time})'"
+        )]
+    return f"[0:v]{','.join(drawtexts)}[outf]"
+
+def render(directory, name, graph, width, height, duration):
+    """ Render the graph over a plain background, returns the elapsed time. """
+    script = os.path.join(directory, name + ".filtergraph")
+    with open(script, "w", encoding="utf-8") as file:
+        file.write(graph)
+    sttime = time.time()
+    subprocess.run(['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+                    '-f', 'lavfi', '-i', f'color=c=blue:s={width}x{height}:r=30:d={duration}',
+                    '-filter_complex_script', script, '-map', '[outf]',
+                    '-preset', 'ultrafast', os.path.join(directory, name + ".mp4")], check=True)
+    return time.time() - sttime
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the drawtext and ASS caption renderers.')
+    parser.add_argument('--counts', default='10,100,1000', help='Comma separated numbers of captions')
+    parser.add_argument('--duration', type=float, default=20, help='The duration of the video in seconds')
+    parser.add_argument('--hd', action='store_true', default=False, help='Render in HD instead of SD')
+
+    args = parser.parse_args()
+
+    width, height = (1080, 1920) if args.hd else (360, 640)
+    with_drawtext = has_filter("drawtext")
+    if not with_drawtext:
+        print("ffmpeg has no drawtext filter, timing the ASS renderer only")
+
+    print(f"{args.duration} s at {width}x{height}")
+    with tempfile.TemporaryDirectory() as directory:
+        for count in [int(count) for count in args.counts.split(",")]:
+            captions = make_captions(count, args.duration)
+            subtitles_file = write_ass(captions, width, height, args.hd, os.path.join(directory, f"captions_{count}.ass"))
+            ass_time = render(directory, f"ass_{count}", f"[0:v]{ass_filter(subtitles_file)}[outf]",
+                              width, height, args.duration)
+            line = f"{count} captions: ass {ass_time:.2f} s"
+            if with_drawtext:
+                graph = drawtext_graph(captions, width, height, args.hd)
+                drawtext_time = render(directory, f"drawtext_{count}", graph, width, height, args.duration)
+                line += f", drawtext {drawtext_time:.2f} s (graph of {len(graph)} bytes)"
+            print(line)
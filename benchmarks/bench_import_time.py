@@ -0,0 +1,72 @@
+# A script to measure the import time of the entry points with python -X importtime, failing above a threshold
+import sys
+sys.path.append("..")
+
+import argparse, os, shutil, subprocess, tempfile
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# (directory, module, threshold in ms) of each entry point. The threshold covers the modules imported
+# by the entry point, not its own body, e.g. the metadata cache warm up of the API.
+ENTRY_POINTS = [
+    ("cmd", "main", 100),
+    ("api", "app", 400),
+]
+
+def import_times(directory, module):
+    """
+    Import a module in a new interpreter with -X importtime. It runs in a temporary directory,
+    so the files an entry point creates in its working directory (e.g. logs) are left out of the tree.
+
+    Returns:
+        dict: For the module and each module it imports, its (self, cumulative) import time in microseconds.
+    """
+    with tempfile.TemporaryDirectory() as working_directory:
+        if os.path.exists(os.path.join(directory, "logging.conf")):
+            shutil.copy(os.path.join(directory, "logging.conf"), working_directory)
+        code = f"import sys; sys.path[:0] = [{directory!r}, {ROOT_DIR!r}]; import {module}"
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                                cwd=working_directory, capture_output=True, text=True, check=True)
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_time, cumulative, name = line[len("import time:"):].split("|")
+        depth = len(name) - len(name.lstrip())
+        entries += [(depth, name.strip(), int(self_time), int(cumulative))]
+
+    # modules are listed after the modules they import, deeper in the tree
+    index = max([i for i, entry in enumerate(entries) if entry[1] == module])
+    depth = entries[index][0]
+    times = {module: entries[index][2:]}
+    for entry_depth, name, self_time, cumulative in reversed(entries[:index]):
+        if entry_depth <= depth:
+            break
+        times[name] = (self_time, cumulative)
+    return times
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measure the import time of the entry points.')
+    parser.add_argument('--runs', type=int, default=5, help='Imports per entry point, the fastest one is kept')
+    parser.add_argument('--top', type=int, default=5, help='The number of slowest modules listed per entry point')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiply the thresholds, for slower machines')
+
+    args = parser.parse_args()
+
+    failed = False
+    for directory, module, threshold in ENTRY_POINTS:
+        runs = [import_times(os.path.join(ROOT_DIR, directory), module) for _ in range(args.runs)]
+        times = min(runs, key=lambda times: times[module][1])
+        self_time, cumulative = times[module]
+        imports_time = (cumulative - self_time) / 1000
+        limit = threshold * args.scale
+
+        status = "OK" if imports_time <= limit else "REGRESSION"
+        failed = failed or imports_time > limit
+        print(f"{directory}/{module}.py: imports {imports_time:.1f} ms (threshold {limit:.0f} ms), "
+              f"body {self_time / 1000:.1f} ms {status}")
+        slowest = sorted([(c, name) for name, (s, c) in times.items() if name != module], reverse=True)
+        for cumulative_time, name in slowest[:args.top]:
+            print(f"    {name}: {cumulative_time / 1000:.1f} ms")
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,62 @@
+# A script to benchmark the two pass render (crop files then compose) against the fused render (crop while composing)
+# and the normalized render (crop and normalize files, then compose them read by the concat demuxer)
+import sys
+sys.path.append("..")
+
+import argparse, os, shutil, tempfile, time
+from codebase.ffmpeg_utils import crop_video, center_crop, ffmpeg_compose, normalize_video
+from media import make_clips, make_audio_track, make_captions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the two pass, fused and normalized render modes.')
+    parser.add_argument('--clips', type=int, default=4, help='The number of clips')
+    parser.add_argument('--duration', type=float, default=10, help='The duration of each clip in seconds')
+    parser.add_argument('--source', default='1920x1080', help='The resolution of the clips')
+    parser.add_argument('--hd', action='store_true', default=False, help='Render in HD instead of SD')
+
+    args = parser.parse_args()
+
+    source_width, source_height = [int(v) for v in args.source.split("x")]
+    width, height = (1080, 1920) if args.hd else (360, 640)
+    total_duration = args.clips * args.duration
+
+    with tempfile.TemporaryDirectory() as directory:
+        clips = make_clips(os.path.join(directory, "clips"), args.clips, args.duration, source_width, source_height)
+        audio_file = make_audio_track(directory, total_duration)
+        captions = make_captions(args.clips * 3, total_duration)
+
+        # two pass: crop each clip to a file, then compose
+        two_pass_clips = []
+        for clip in clips:
+            two_pass_clips += [shutil.copy(clip, clip.replace(".mp4", "_two_pass.mp4"))]
+        sttime = time.time()
+        for clip in two_pass_clips:
+            crop_video(clip, source_width, source_height, width, height)
+        crop_time = time.time() - sttime
+        ffmpeg_compose(two_pass_clips, width, height, audio_file, captions, "title", "subtitle",
+                       os.path.join(directory, "two_pass.mp4"), args.hd)
+        two_pass_time = time.time() - sttime
+
+        # fused: crop inside the compose filter graph
+        sttime = time.time()
+        crops = [center_crop(source_width, source_height, width, height) for _ in clips]
+        ffmpeg_compose(clips, width, height, audio_file, captions, "title", "subtitle",
+                       os.path.join(directory, "fused.mp4"), args.hd, crops=crops)
+        fused_time = time.time() - sttime
+
+        # normalized: crop and normalize each clip to a file, then compose them without the concat filter
+        normalized_clips = []
+        for clip in clips:
+            normalized_clips += [shutil.copy(clip, clip.replace(".mp4", "_normalized.mp4"))]
+        sttime = time.time()
+        for clip in normalized_clips:
+            normalize_video(clip, source_width, source_height, width, height)
+        normalize_time = time.time() - sttime
+        ffmpeg_compose(normalized_clips, width, height, audio_file, captions, "title", "subtitle",
+                       os.path.join(directory, "normalized.mp4"), args.hd, concat_demuxer=True)
+        normalized_time = time.time() - sttime
+
+    print(f"{args.clips} clips of {args.duration} s, {args.source} to {width}x{height}")
+    print(f"two pass: {two_pass_time:.2f} s (crop {crop_time:.2f} s)")
+    print(f"fused: {fused_time:.2f} s")
+    print(f"normalized: {normalized_time:.2f} s (normalize {normalize_time:.2f} s, compose {normalized_time - normalize_time:.2f} s)")
@@ -0,0 +1,37 @@
+# A script to benchmark the single pass compose against the segmented compose rendering segments in parallel
+import sys
+sys.path.append("..")
+
+import argparse, os, tempfile, time
+from codebase.composer import compose_video, plan_segments
+from codebase.timeline import Timeline
+from media import make_clips, make_audio_track
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the single pass and segmented compose.')
+    parser.add_argument('--clips', type=int, default=6, help='The number of clips')
+    parser.add_argument('--clip_duration', type=float, default=20, help='The duration of each clip in seconds')
+    parser.add_argument('--ayat', type=int, default=20, help='The number of ayat, evenly timed')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='The number of segments rendered at once')
+    parser.add_argument('--hd', action='store_true', default=False, help='Render in HD instead of SD')
+
+    args = parser.parse_args()
+
+    width, height = (1080, 1920) if args.hd else (360, 640)
+    duration = args.clips * args.clip_duration - 1
+
+    with tempfile.TemporaryDirectory() as directory:
+        clips = make_clips(os.path.join(directory, "clips"), args.clips, args.clip_duration, width, height)
+        audio_file = make_audio_track(directory, duration)
+        timeline = Timeline.from_ayat([f"ayah {i} of the benchmark text" for i in range(args.ayat)],
+                                      [duration / args.ayat] * args.ayat)
+
+        segments = plan_segments(timeline.ayat_end_times(), duration, args.workers)
+        print(f"{duration:.1f} s at {width}x{height}, {len(segments)} segments with {args.workers} workers")
+
+        for workers in [1, args.workers]:
+            sttime = time.time()
+            compose_video(clips, audio_file, timeline, "title", "subtitle",
+                          os.path.join(directory, f"composed_{workers}.mp4"), width, height, args.hd,
+                          clip_durations=[args.clip_duration] * args.clips, workers=workers)
+            print(f"{workers} workers: {time.time() - sttime:.2f} s")
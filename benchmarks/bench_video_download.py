@@ -0,0 +1,69 @@
+# A script to benchmark segmented video downloads against a local HTTP stand-in server
+import sys
+sys.path.append("..")
+
+import argparse, os, re, time, tempfile, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from codebase.utils import download_file, download_file_segmented, ConnectionBudget
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """ Serves the server content with HTTP Range support, throttled per connection. """
+
+    def send_content_headers(self):
+        content = self.server.content
+        start, end = 0, len(content) - 1
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else end
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(content)}")
+        else:
+            self.send_response(200)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        return start, end
+
+    def do_HEAD(self):
+        self.send_content_headers()
+
+    def do_GET(self):
+        start, end = self.send_content_headers()
+        chunk_size = 64*1024
+        for position in range(start, end + 1, chunk_size):
+            self.wfile.write(self.server.content[position: min(end + 1, position + chunk_size)])
+            time.sleep(chunk_size / self.server.bytes_per_second)
+
+    def log_message(self, *args):
+        pass
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark single and segmented downloads against a local server.')
+    parser.add_argument('--size', type=int, default=64, help='The size of the served file in MB')
+    parser.add_argument('--bandwidth', type=float, default=20, help='The bandwidth of each connection in MB/s')
+    parser.add_argument('--connections', type=int, default=8, help='The connections budget')
+
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    server.content = os.urandom(args.size * 1024 * 1024)
+    server.bytes_per_second = args.bandwidth * 1024 * 1024
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/video.mp4"
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as directory:
+        for name, download in [("single", lambda filename: download_file(url, filename)),
+                               ("segmented", lambda filename: download_file_segmented(url, filename, ConnectionBudget(args.connections),
+                                                                                     segments=args.connections))]:
+            filename = os.path.join(directory, f"{name}.mp4")
+            sttime = time.time()
+            succsess = download(filename)
+            duration = time.time() - sttime
+            intact = succsess and open(filename, "rb").read() == server.content
+            failures += 0 if intact else 1
+            print(f"{name}: {duration:.2f} s {'' if intact else 'CORRUPTED'}")
+
+    server.shutdown()
+    sys.exit(1 if failures else 0)
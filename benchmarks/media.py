@@ -0,0 +1,29 @@
+# Synthetic media used by the benchmarks, generated with ffmpeg
+import os, subprocess
+from codebase.timeline import TimedText
+
+def make_clips(directory, count, duration, width, height, fps=30):
+    """ Generate count test pattern clips of duration seconds, returns their filenames. """
+    os.makedirs(directory, exist_ok=True)
+    files = []
+    for i in range(count):
+        filename = os.path.join(directory, f"clip_{i}.mp4")
+        subprocess.run(['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+                        '-f', 'lavfi', '-i', f'testsrc2=s={width}x{height}:r={fps}:d={duration}',
+                        '-pix_fmt', 'yuv420p', '-preset', 'ultrafast', filename], check=True)
+        files += [filename]
+    return files
+
+def make_audio_track(directory, duration):
+    """ Generate an AAC track of duration seconds, returns its filename. """
+    os.makedirs(directory, exist_ok=True)
+    filename = os.path.join(directory, "track.m4a")
+    subprocess.run(['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+                    '-f', 'lavfi', '-i', f'sine=f=440:d={duration}',
+                    '-c:a', 'aac', filename], check=True)
+    return filename
+
+def make_captions(count, duration):
+    """ Generate count evenly timed captions covering duration seconds. """
+    step = duration / count
+    return [TimedText(i * step, (i + 1) * step, f"caption {i}") for i in range(count)]
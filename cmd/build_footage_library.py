@@ -0,0 +1,23 @@
+# A script to fill a local footage library with cropped and normalized pexels.com clips
+import sys
+sys.path.append("..")
+
+import argparse
+import logging
+import logging.config
+from codebase.footage import PexelsFootageSource, add_to_library, DEFAULT_KEYWORD
+from codebase.pipeline import Resolution
+
+if __name__ == "__main__":
+    logging.config.fileConfig('logging.conf')
+    parser = argparse.ArgumentParser(description='A script to fill a local footage library for the --library option.')
+    parser.add_argument('--directory', required=True, help='The library directory')
+    parser.add_argument('--keyword', default=DEFAULT_KEYWORD, help='The keyword of the pexels clips')
+    parser.add_argument('--duration', type=float, default=600, help='The total duration of clips to add in seconds')
+    parser.add_argument('--hd', action= 'store_true', default=False, help='Add high definition clips default false')
+
+    args = parser.parse_args()
+
+    size = Resolution.HD.value if args.hd else Resolution.SD.value
+    added = add_to_library(args.directory, PexelsFootageSource(args.keyword, normalize=True), args.duration, size)
+    print(f"Added {added} clips to {args.directory}")
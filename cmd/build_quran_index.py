@@ -0,0 +1,19 @@
+# A script to rebuild the bundled quran text index from the Islamic Network API
+import sys
+sys.path.append("..")
+
+import argparse
+import logging
+import logging.config
+from codebase import quran_index
+
+if __name__ == "__main__":
+    logging.config.fileConfig('logging.conf')
+    parser = argparse.ArgumentParser(description='A script to rebuild the bundled quran text index.')
+    parser.add_argument('--output', default=quran_index.INDEX_FILE, help='The index file to write, defaults to the bundled index')
+    parser.add_argument('--edition', default=quran_index.EDITION, help='The quran text edition to index')
+
+    args = parser.parse_args()
+
+    quran_index.build_index(args.output, args.edition)
+    print(f"Index written to {args.output}")
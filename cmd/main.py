@@ -4,12 +4,16 @@ sys.path.append("..")
 import argparse
 from codebase import fetch_audio
 from codebase import pipeline
+from codebase.footage import LocalLibraryFootageSource
 import logging
 import logging.config
 import os
 
-def generate_video(reciter, surah, start, end, hd, clean_resources, verbose, monitor_performance):
-    pipeline.generate_video(reciter, surah, start, end, os.getcwd() , hd, clean_resources, verbose, monitor_performance= monitor_performance)
+def generate_video(reciter, surah, start, end, hd, clean_resources, verbose, monitor_performance, library, render_mode, render_workers, resume):
+    footage_source = LocalLibraryFootageSource(library) if library else None
+    pipeline.generate_video(reciter, surah, start, end, os.getcwd() , hd, clean_resources, verbose, monitor_performance= monitor_performance,
+                            footage_source= footage_source, render_mode= pipeline.RenderMode(render_mode),
+                            render_workers= render_workers, resume= resume)
 
 def reciters_list():
     reciters = fetch_audio.get_reciters()
@@ -32,10 +36,21 @@ def main():
     parser.add_argument('--hd', action= 'store_true', default=False, help='Require high definition videos default false')
     parser.add_argument('--silent', action='store_true', default=False, help='Surpress output')
     parser.add_argument('--keep_resources', action='store_true', default=False, help='Keep downloaded temporary files')
-    parser.add_argument('--monitor_perf', action='store_true', default=False, help='Write a text file that includes operations times')
+    parser.add_argument('--monitor_perf', action='store_true', default=False, help='Append the time, CPU, memory, downloads and cache hits of each stage to metrics.jsonl')
+    parser.add_argument('--render_mode', choices=[m.value for m in pipeline.RenderMode], default=pipeline.RenderMode.TWO_PASS.value,
+                        help='Crop videos in their own pass (two_pass, fills the clips cache), while composing (fused), '
+                             'or crop and normalize them in their own pass to join them without re-encoding (normalized)')
+    parser.add_argument('--render_workers', type=int, default=1,
+                        help='Compose the video in segments cut at ayat ends, rendering this many at once (0 for all CPU cores) default 1')
+    parser.add_argument('--library', help='A local footage library directory to take the videos from instead of pexels.com')
+    parser.add_argument('--resume', action='store_true', default=False,
+                        help='Resume a failed job with the same parameters in this directory, skipping its completed stages')
 
     args = parser.parse_args()
 
+    if args.mode != 'help':
+        fetch_audio.warm_metadata_cache()
+
     if args.mode == 'help':
         parser.print_help()
 
@@ -49,7 +64,7 @@ def main():
         if args.reciter is None or args.surah is None or args.start is None or args.end is None:
             print("Error: 'generate_video' mode requires --reciter --surah --start and --end parameters. Run 'help' for more details.")
         else:
-            generate_video(args.reciter, args.surah, args.start, args.end, args.hd, not args.keep_resources, not args.silent, args.monitor_perf)
+            generate_video(args.reciter, args.surah, args.start, args.end, args.hd, not args.keep_resources, not args.silent, args.monitor_perf, args.library, args.render_mode, args.render_workers, args.resume)
 
 if __name__ == "__main__":
     logging.config.fileConfig('logging.conf')
@@ -0,0 +1,207 @@
+import os, mmap, struct, logging
+
+# Bitrates in kbps indexed by [version is MPEG1][layer][bitrate index]
+BITRATES = {
+    True: {
+        1: [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+        2: [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+        3: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    },
+    False: {
+        1: [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+        2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+        3: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    },
+}
+
+# Sample rates indexed by version bits (0: MPEG2.5, 2: MPEG2, 3: MPEG1) and sample rate index
+SAMPLE_RATES = {
+    0: [11025, 12000, 8000],
+    2: [22050, 24000, 16000],
+    3: [44100, 48000, 32000],
+}
+
+# Layer bits to layer number
+LAYERS = {1: 3, 2: 2, 3: 1}
+
+class FrameHeader:
+    """ A parsed MPEG audio frame header. """
+
+    __slots__ = ["mpeg1", "layer", "bitrate", "sample_rate", "padding", "mono", "samples", "length"]
+
+    def __init__(self, mpeg1, layer, bitrate, sample_rate, padding, mono):
+        self.mpeg1 = mpeg1
+        self.layer = layer
+        self.bitrate = bitrate
+        self.sample_rate = sample_rate
+        self.padding = padding
+        self.mono = mono
+        if layer == 1:
+            self.samples = 384
+            self.length = (12 * bitrate * 1000 // sample_rate + padding) * 4
+        else:
+            self.samples = 1152 if (layer == 2 or mpeg1) else 576
+            self.length = self.samples // 8 * bitrate * 1000 // sample_rate + padding
+
+def parse_frame_header(data, position):
+    """
+    Parse the four bytes frame header at a position.
+
+    Returns:
+        FrameHeader: The parsed header, or None if the bytes aren't a valid header.
+    """
+    if position + 4 > len(data):
+        return None
+    b0, b1, b2, b3 = data[position], data[position+1], data[position+2], data[position+3]
+    if b0 != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+
+    version_bits = (b1 >> 3) & 0x3
+    layer_bits = (b1 >> 1) & 0x3
+    bitrate_index = b2 >> 4
+    sample_rate_index = (b2 >> 2) & 0x3
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    mpeg1 = version_bits == 3
+    layer = LAYERS[layer_bits]
+    return FrameHeader(mpeg1=mpeg1,
+                       layer=layer,
+                       bitrate=BITRATES[mpeg1][layer][bitrate_index],
+                       sample_rate=SAMPLE_RATES[version_bits][sample_rate_index],
+                       padding=(b2 >> 1) & 0x1,
+                       mono=(b3 >> 6) == 3)
+
+def skip_id3v2(data):
+    """ Get the position right after an ID3v2 tag, 0 if the data doesn't start with one. """
+    if len(data) < 10 or data[0:3] != b"ID3":
+        return 0
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+def find_first_frame(data, position):
+    """ Find the first frame header followed by another valid header, to avoid false syncs. """
+    end = len(data) - 4
+    while position < end:
+        position = data.find(b"\xff", position, end)
+        if position == -1:
+            return None, None
+        header = parse_frame_header(data, position)
+        if header and header.length > 0:
+            next_header = parse_frame_header(data, position + header.length)
+            if next_header or position + header.length >= len(data):
+                return position, header
+        position += 1
+    return None, None
+
+def read_vbr_tag(data, position, header):
+    """
+    Read the number of frames and the encoder delay and padding from a Xing/Info (and LAME) or VBRI tag.
+
+    Returns:
+        (int, int, int): Number of frames, encoder delay and padding in samples, or None if there is no tag.
+    """
+    if header.mpeg1:
+        side_info = 17 if header.mono else 32
+    else:
+        side_info = 9 if header.mono else 17
+
+    xing = position + 4 + side_info
+    tag = data[xing: xing+4]
+    if tag in (b"Xing", b"Info"):
+        flags = struct.unpack_from(">I", data, xing + 4)[0]
+        if not flags & 0x1:
+            return None
+        frames = struct.unpack_from(">I", data, xing + 8)[0]
+
+        # The LAME extension follows the xing fields (frames, bytes, toc and quality)
+        lame = xing + 8 + (4 if flags & 0x1 else 0) + (4 if flags & 0x2 else 0) + \
+               (100 if flags & 0x4 else 0) + (4 if flags & 0x8 else 0)
+        delay, padding = 0, 0
+        if data[lame: lame+4] in (b"LAME", b"Lavf", b"Lavc") and lame + 24 <= len(data):
+            b0, b1, b2 = data[lame+21], data[lame+22], data[lame+23]
+            delay = (b0 << 4) | (b1 >> 4)
+            padding = ((b1 & 0x0F) << 8) | b2
+        return frames, delay, padding
+
+    vbri = position + 4 + 32
+    if data[vbri: vbri+4] == b"VBRI":
+        frames = struct.unpack_from(">I", data, vbri + 14)[0]
+        return frames, 0, 0
+
+    return None
+
+def count_frames(data, position):
+    """ Walk through the frame headers from a position and count the frames and samples. """
+    frames = 0
+    samples = 0
+    end = len(data)
+    while position + 4 <= end:
+        header = parse_frame_header(data, position)
+        if header is None or header.length <= 0:
+            if data[position: position+3] == b"TAG":
+                break
+            position, header = find_first_frame(data, position + 1)
+            if header is None:
+                break
+        frames += 1
+        samples += header.samples
+        position += header.length
+    return frames, samples
+
+def headers_duration(data):
+    """
+    Compute an mp3 duration in seconds from its frame headers and VBR tags.
+
+    Returns:
+        float: The duration, or None if no frame header is found.
+    """
+    position, header = find_first_frame(data, skip_id3v2(data))
+    if header is None:
+        return None
+
+    tag = read_vbr_tag(data, position, header)
+    if tag is not None:
+        frames, delay, padding = tag
+        samples = frames * header.samples - delay - padding
+        return max(0, samples) / header.sample_rate
+
+    frames, samples = count_frames(data, position)
+    if frames == 0:
+        return None
+    return samples / header.sample_rate
+
+def decoded_duration(filename):
+    """ Compute an mp3 duration in seconds by fully decoding it, slow but sample accurate. """
+    import warnings
+    warnings.filterwarnings("ignore", category=RuntimeWarning, module="pydub")
+    from pydub import AudioSegment
+    audio = AudioSegment.from_mp3(filename)
+    return len(audio) / 1000.0
+
+def mp3_duration(filename):
+    """
+    Compute the duration of an mp3 file from its frame headers and Xing/VBRI/LAME tags,
+    decoding the file only when no header can be found.
+
+    Parameters:
+        filename (str): The mp3 file path.
+
+    Returns:
+        float: The duration in seconds.
+
+    Example:
+        mp3_duration("./temp/mp3/recitation_0.mp3")
+        Result: 6.164
+    """
+    duration = None
+    if os.path.getsize(filename) > 0:
+        with open(filename, "rb") as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                duration = headers_duration(data)
+
+    if duration is None:
+        logging.info(f"No mp3 headers found in {os.path.basename(filename)}, decoding it")
+        duration = decoded_duration(filename)
+    return duration
@@ -0,0 +1,372 @@
+import os, json, time, logging, threading, shutil
+from collections import OrderedDict
+from codebase import metrics
+from codebase.utils import PARTIAL_SUFFIX
+
+CACHE_DIR = os.environ.get("AUTO_GENERATOR_CACHE",
+                           os.path.join(os.path.expanduser("~"), ".cache", "auto_generator"))
+
+class MetadataCache:
+    """
+    A versioned metadata cache with a time to live, kept both in memory and on disk.
+
+    Stale entries are still served while a refresh is attempted, so a slow or failing
+    upstream never blocks a caller that already has data.
+
+    Parameters:
+        name (str): Name of the cache, used as the on-disk filename.
+        loader (callable): A function with no arguments returning JSON serializable data.
+        version (int, optional): Format version. Entries written with another version are ignored.
+        ttl (float, optional): Time to live of an entry in seconds. Default is one day.
+        directory (str, optional): Directory holding the cache file. Default is CACHE_DIR.
+
+    Example:
+        surahs_cache = MetadataCache("surahs", fetch_surahs, version=1, ttl=3600)
+        surahs_cache.get()
+        Result: [{'id': 1, 'name': 'سُورَةُ ٱلْفَاتِحَةِ', ...}, ...]
+    """
+
+    def __init__(self, name, loader, version=1, ttl=24*3600, directory=CACHE_DIR):
+        self.name = name
+        self.loader = loader
+        self.version = version
+        self.ttl = ttl
+        self.file_path = os.path.join(directory, f"{name}.json")
+        self.data = None
+        self.fetched_at = 0
+        self.lock = threading.Lock()
+        self.refreshing = False
+
+    def is_stale(self):
+        return time.time() - self.fetched_at > self.ttl
+
+    def load_from_disk(self):
+        try:
+            with open(self.file_path, "r", encoding="utf-8") as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return False
+
+        if entry.get("version") != self.version:
+            logging.info(f"Ignoring {self.name} cache of version {entry.get('version')}")
+            return False
+
+        self.data = entry["data"]
+        self.fetched_at = entry["fetched_at"]
+        logging.info(f"Loaded {self.name} cache from {self.file_path}")
+        return True
+
+    def save_to_disk(self):
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+        temp_path = f"{self.file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump({"version": self.version, "fetched_at": self.fetched_at, "data": self.data},
+                      file, ensure_ascii=False)
+        os.replace(temp_path, self.file_path)
+
+    def refresh(self):
+        """
+        Reload the data through the loader. Keeps the current data if the loader fails.
+
+        Returns:
+            bool: True if the data was refreshed.
+        """
+        try:
+            data = self.loader()
+        except Exception as e:
+            logging.error(f"Error: Unable to refresh {self.name} cache. error: {e}")
+            return False
+
+        self.store(data)
+        logging.info(f"Refreshed {self.name} cache")
+        return True
+
+    def store(self, data):
+        with self.lock:
+            self.data = data
+            self.fetched_at = time.time()
+            try:
+                self.save_to_disk()
+            except OSError as e:
+                logging.error(f"Error: Unable to write {self.name} cache. error: {e}")
+
+    def refresh_in_background(self):
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                self.refreshing = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def get(self):
+        """
+        Get the cached data, loading it from disk or through the loader on a miss.
+
+        Raises:
+            Exception: If there is no cached data and the loader fails.
+        """
+        if self.data is None:
+            with self.lock:
+                if self.data is None:
+                    self.load_from_disk()
+
+        if self.data is None:
+            self.store(self.loader())
+
+        elif self.is_stale():
+            self.refresh_in_background()
+
+        return self.data
+
+def start_refresher(caches, interval=3600):
+    """
+    Start a daemon thread that periodically refreshes the stale caches.
+
+    Parameters:
+        caches (list): A list of MetadataCache objects.
+        interval (float, optional): Seconds between checks. Default is one hour.
+    """
+    def run():
+        while True:
+            time.sleep(interval)
+            for cache in caches:
+                if cache.is_stale():
+                    cache.refresh()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+def link_file(source, destination):
+    """
+    Hardlink a file to a destination, falling back to a copy when linking isn't possible
+    (e.g. across file systems).
+    """
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+class FileCache:
+    """
+    A file cache shared between jobs, addressed by key, with size bounded LRU eviction.
+
+    Entries are linked into job directories instead of being copied, and each entry can hold
+    a small metadata file next to it. Concurrent requests for the same missing entry within the
+    process share one in-flight producer, other processes at worst produce it twice.
+
+    The size and LRU order of the entries are scanned from disk once per process and kept up to date
+    as entries are used and added. Entries added by other processes are only counted at the next scan.
+
+    Parameters:
+        name (str): Name of the cache, used as its directory name.
+        max_bytes (int): The size above which least recently used entries are evicted.
+        directory (str, optional): Parent directory of the cache. Default is CACHE_DIR.
+
+    Example:
+        audio_cache = FileCache("audio", 2*1024**3)
+        audio_cache.fetch(("192", "ar.alafasy", "1.mp3"), lambda path: download_file(link, path), "./temp/mp3/recitation_0.mp3")
+        Result: True
+    """
+
+    METADATA_SUFFIX = ".json"
+    TEMP_SUFFIX = ".tmp"
+    # Temporary and partial files older than this, in seconds, were left by a killed process
+    STALE_AGE = 24*3600
+
+    def __init__(self, name, max_bytes, directory=CACHE_DIR):
+        self.name = name
+        self.root = os.path.join(directory, name)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.hits = 0
+        self.misses = 0
+        # entry sizes by path, least recently used first, scanned on first use
+        self.entries = None
+        self.total_size = 0
+
+    def path_for(self, key):
+        return os.path.join(self.root, *[str(part) for part in key])
+
+    def get(self, key):
+        """ Get the path of a cached entry, or None on a miss. """
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        with self.lock:
+            if self.entries is not None and path in self.entries:
+                self.entries.move_to_end(path)
+        return path
+
+    def count(self, hit):
+        """ Count a hit or a miss, also in the metrics of the running stage. """
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        metrics.add_cache(self.name, hit)
+
+    def get_metadata(self, key):
+        try:
+            with open(self.path_for(key) + self.METADATA_SUFFIX, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def set_metadata(self, key, metadata):
+        path = self.path_for(key) + self.METADATA_SUFFIX
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}{self.TEMP_SUFFIX}"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as file:
+                json.dump(metadata, file)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logging.error(f"Error: Unable to write {self.name} cache metadata. error: {e}")
+
+    def fetch(self, key, producer, destination):
+        """
+        Link a cached entry into destination, producing it first on a miss.
+
+        Parameters:
+            key (tuple): The entry key, each part becomes a path component.
+            producer (callable): Called with a temporary path to write the entry to, returns True on success.
+            destination (str): Where to link the entry.
+
+        Returns:
+            bool: False if the entry couldn't be produced.
+        """
+        path = self.get(key)
+        if path is not None:
+            self.count(hit=True)
+            link_file(path, destination)
+            return True
+
+        with self.lock:
+            event = self.in_flight.get(key)
+            leader = event is None
+            if leader:
+                self.in_flight[key] = threading.Event()
+
+        if not leader:
+            event.wait()
+            path = self.get(key)
+            if path is None:
+                return producer(destination)
+            self.count(hit=True)
+            link_file(path, destination)
+            return True
+
+        self.count(hit=False)
+        path = self.path_for(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}{self.TEMP_SUFFIX}"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if not producer(temp_path):
+                return False
+            os.replace(temp_path, path)
+            link_file(path, destination)
+        finally:
+            # the partial file a failed download keeps to resume is never resumed under this temporary name
+            for leftover in [temp_path, temp_path + PARTIAL_SUFFIX]:
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+            with self.lock:
+                self.in_flight.pop(key).set()
+
+        self.add_entry(path)
+        return True
+
+    def put(self, key, source):
+        """ Add a file to the cache by linking it, replacing any existing entry. """
+        path = self.path_for(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}{self.TEMP_SUFFIX}"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            link_file(source, temp_path)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logging.error(f"Error: Unable to add {source} to {self.name} cache. error: {e}")
+            return
+        self.add_entry(path)
+
+    def is_entry(self, filename):
+        return not filename.endswith((self.METADATA_SUFFIX, self.TEMP_SUFFIX, PARTIAL_SUFFIX))
+
+    def scan_entries(self):
+        """
+        Scan the entries from disk, least recently used first, removing stale temporary and partial files.
+        Must be called with the lock held.
+        """
+        entries = []
+        now = time.time()
+        for parent, _, files in os.walk(self.root):
+            for filename in files:
+                path = os.path.join(parent, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if filename.endswith((self.TEMP_SUFFIX, PARTIAL_SUFFIX)):
+                    if now - stat.st_mtime > self.STALE_AGE:
+                        self.remove_stale(path)
+                    continue
+                if not self.is_entry(filename):
+                    continue
+                entries += [(stat.st_mtime, path, stat.st_size)]
+        self.entries = OrderedDict([(path, size) for _, path, size in sorted(entries)])
+        self.total_size = sum(self.entries.values())
+
+    def remove_stale(self, path):
+        try:
+            os.remove(path)
+            logging.info(f"Removed stale {path} from {self.name} cache")
+        except OSError as e:
+            logging.error(f"Error: Unable to remove stale {path}. error: {e}")
+
+    def add_entry(self, path):
+        """ Count an entry written to path as the most recently used one, then evict if needed. """
+        try:
+            size = os.stat(path).st_size
+        except OSError:
+            return
+        with self.lock:
+            if self.entries is None:
+                self.scan_entries()
+            self.total_size += size - self.entries.pop(path, 0)
+            self.entries[path] = size
+            self.evict_entries()
+
+    def evict(self):
+        """ Remove least recently used entries until the cache fits in max_bytes. """
+        with self.lock:
+            if self.entries is None:
+                self.scan_entries()
+            self.evict_entries()
+
+    def evict_entries(self):
+        """ See evict. Must be called with the lock held. """
+        while self.total_size > self.max_bytes and self.entries:
+            path, size = self.entries.popitem(last=False)
+            self.total_size -= size
+            try:
+                os.remove(path)
+                if os.path.exists(path + self.METADATA_SUFFIX):
+                    os.remove(path + self.METADATA_SUFFIX)
+            except FileNotFoundError:
+                # evicted by another process
+                continue
+            except OSError as e:
+                logging.error(f"Error: Unable to evict {path}. error: {e}")
+                continue
+            logging.info(f"Evicted {path} from {self.name} cache")
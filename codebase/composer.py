@@ -1,45 +1,188 @@
-import os, math
+import os, json, hashlib, logging, threading, time
+from concurrent.futures import ThreadPoolExecutor
 from codebase.ffmpeg_utils import *
+from codebase.subtitles import write_ass
+from codebase.cache import FileCache
 
-def preprocess_text(text_file, words_per_view=5):
-    output = []
-    for line in open(text_file, "r", encoding= "utf-8"):
-        start, end, text = line.split(":")
-        start, end = float(start), float(end)
-        duration = end - start
-        words = text.split(" ")
-        duration_per_word = duration / len(words)
-        n_chunks = math.ceil(len(words)/words_per_view)
-        cumulative_duration = start
-        for i in range(0, n_chunks):
-            chunk_words = words[(i)*words_per_view:(i+1)*words_per_view]
-            chunk_duration = len(chunk_words) * duration_per_word
-            text = ' '.join(chunk_words)
-            output.append({"start_time": cumulative_duration,
-                            "end_time": cumulative_duration + chunk_duration,
-                            "text": text})
-            cumulative_duration = cumulative_duration + chunk_duration
-    return output
-
-def compose_video(video_dir, audio_dir, text_file, title, subtitle, output_file, width, height, hd):
-
-    video_files = [os.path.join(video_dir, f) for f in os.listdir(video_dir)]
-    audio_files = [os.path.join(audio_dir, f) for f in os.listdir(audio_dir)]
-
-    # generate timed captions
-    captions_with_time = preprocess_text(text_file)
-
-    # compose audio, video, and text
-    ffmpeg_compose(video_files= video_files,
-                   width= width,
-                   height= height,
-                   audio_files= audio_files,
-                   captions_with_time= captions_with_time,
-                   title = title,
-                   subtitle = subtitle,
-                   output_filename=output_file,
-                   hd = hd)
-    
-    # cut concatenated video to audio duration
-    complete_duration = captions_with_time[-1]["end_time"] + 0.1
-    ffmpeg_cut(output_file, 0, complete_duration)
\ No newline at end of file
+OVERLAY_CACHE_MAX_BYTES = 256*1024**2
+overlay_cache = FileCache("overlays", OVERLAY_CACHE_MAX_BYTES)
+# Bumped when the overlay rendering changes, so cached overlays aren't reused
+OVERLAY_VERSION = 2
+
+# Constant frame rate of segmented renders, segments are cut on frames so they join seamlessly
+SEGMENT_FRAME_RATE = 30
+# Segments shorter than this aren't worth their own ffmpeg process
+SEGMENT_MIN_DURATION = 10
+
+def plan_segments(boundaries, duration, count, frame_rate=SEGMENT_FRAME_RATE, min_duration=SEGMENT_MIN_DURATION):
+    """
+    Split a timeline into at most count segments of similar durations, cut at the boundaries
+    (e.g. ayat ends) closest to even splits, rounded to frames.
+
+    Returns:
+        list: The (start, end) times of each segment.
+
+    Example:
+        plan_segments([5.2, 11.8, 20.1, 27.5], 27.6, 2)
+        Result: [(0, 11.8), (11.8, 27.6)]
+    """
+    count = max(1, min(count, int(duration // min_duration)))
+    cuts = [0]
+    for k in range(1, count):
+        target = duration * k / count
+        cut = min(boundaries, key=lambda t: abs(t - target)) if boundaries else target
+        cut = round(cut * frame_rate) / frame_rate
+        if cuts[-1] + min_duration <= cut <= duration - min_duration:
+            cuts += [cut]
+    return list(zip(cuts, cuts[1:] + [duration]))
+
+def segment_inputs(clip_durations, start, end):
+    """
+    Find the clips covering a segment of the concatenated clips timeline.
+
+    Returns:
+        list: (clip index, offset inside the clip, seconds used) of each clip in the segment.
+
+    Example:
+        segment_inputs([10, 20, 30], 5, 25)
+        Result: [(0, 5, 5), (1, 0, 15)]
+    """
+    inputs = []
+    clip_start = 0
+    for i, clip_duration in enumerate(clip_durations):
+        clip_end = clip_start + clip_duration
+        if clip_end > start and clip_start < end:
+            inputs += [(i, max(start, clip_start) - clip_start, min(end, clip_end) - max(start, clip_start))]
+        clip_start = clip_end
+    return inputs
+
+def compose_segments(video_files, audio_file, timeline, output_file, width, height, hd,
+                     overlay_file, crops, clip_durations, duration, workers, progress_callback=None):
+    """
+    Compose a video in segments cut at the ayat ends of the timeline (see plan_segments), rendering up to workers segments
+    at the same time, each in its own ffmpeg process. The video only segments are then joined without
+    re-encoding and the audio track is muxed in.
+
+    The progress reports of the segments are combined into reports over the whole video, the last one
+    holds the average encode fps and speed of the whole render.
+    """
+    crops = crops or [None] * len(video_files)
+    segments = plan_segments(timeline.ayat_end_times(), duration, workers)
+    base_filename = os.path.splitext(output_file)[0]
+
+    reports = [None] * len(segments)
+    reports_lock = threading.Lock()
+    sttime = time.time()
+
+    def report_progress(i, report):
+        with reports_lock:
+            reports[i] = report
+            started = [r for r in reports if r is not None]
+            running = [r for r in started if not r["done"]]
+            done = len(started) == len(segments) and not running
+            frame = sum([r["frame"] for r in started])
+            if done:
+                elapsed = max(time.time() - sttime, 1e-6)
+                fps, speed = frame / elapsed, duration / elapsed
+            else:
+                fps = sum([r["fps"] for r in running])
+                speed = sum([r["speed"] or 0 for r in running]) or None
+            progress_callback(progress_report(sum([r["out_time"] for r in started]), frame, fps, speed, duration, done))
+
+    segment_files = [f"{base_filename}.segment_{i}.mp4" for i in range(len(segments))]
+
+    def render(i, start, end):
+        inputs = segment_inputs(clip_durations, start, end)
+        segment_file = segment_files[i]
+        # stop half a frame early so the segment holds exactly its frames, the last one is cut with the audio
+        frames = round((end - start) * SEGMENT_FRAME_RATE)
+        segment_duration = (frames - 0.5) / SEGMENT_FRAME_RATE if i < len(segments) - 1 else end - start
+        ffmpeg_compose(video_files= [video_files[j] for j, _, _ in inputs],
+                       width= width,
+                       height= height,
+                       audio_file= None,
+                       captions_with_time= timeline.captions_between(start, end),
+                       title= None,
+                       subtitle= None,
+                       output_filename= segment_file,
+                       hd= hd,
+                       crops= [crops[j] for j, _, _ in inputs],
+                       clip_durations= [used for _, _, used in inputs],
+                       duration= segment_duration,
+                       overlay_file= overlay_file,
+                       clip_offsets= [offset for _, offset, _ in inputs],
+                       frame_rate= SEGMENT_FRAME_RATE,
+                       progress_callback= (lambda report: report_progress(i, report)) if progress_callback else None)
+
+    logging.info(f"Composing {len(segments)} segments: {segments}")
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(render, i, start, end) for i, (start, end) in enumerate(segments)]
+            try:
+                for future in futures:
+                    future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+
+        ffmpeg_concat_segments(segment_files, audio_file, duration, output_file)
+    finally:
+        # the segments rendered, even partly, before a failed segment or concat too
+        for segment_file in segment_files:
+            if os.path.exists(segment_file):
+                os.remove(segment_file)
+
+def overlay_cache_key(title, subtitle, width, height, hd):
+    texts = json.dumps([title, subtitle, hd, DIMMING_OPACITY, OVERLAY_VERSION], ensure_ascii=False)
+    return (f"{width}x{height}", hashlib.sha1(texts.encode("utf-8")).hexdigest()[:16] + ".png")
+
+def static_overlay(title, subtitle, width, height, hd, destination):
+    """
+    Link the static overlay image (dimming layer, title and subtitle) of a video into destination,
+    rendering it once per (title, subtitle, resolution) and caching it.
+    """
+    def render(path):
+        subtitles_file = write_ass([], width, height, hd, path + ".ass", title=title, subtitle=subtitle, duration=1)
+        try:
+            ffmpeg_static_overlay(subtitles_file, width, height, path)
+        finally:
+            os.remove(subtitles_file)
+        return True
+
+    overlay_cache.fetch(overlay_cache_key(title, subtitle, width, height, hd), render, destination)
+    return destination
+
+def compose_video(video_files, audio_file, timeline, title, subtitle, output_file, width, height, hd, crops=None, clip_durations=None, workers=1,
+                  progress_callback=None, concat_demuxer=False):
+
+    # render the static layer once, it is applied with a single overlay
+    overlay_file = static_overlay(title, subtitle, width, height, hd, os.path.splitext(output_file)[0] + ".overlay.png")
+
+    complete_duration = timeline.duration + 0.1
+
+    try:
+        # compose segments in parallel, cut at the ayat ends
+        if workers > 1 and clip_durations:
+            compose_segments(video_files, audio_file, timeline, output_file,
+                             width, height, hd, overlay_file, crops, clip_durations, complete_duration, workers,
+                             progress_callback)
+            return
+
+        # compose audio, video, and text at the audio duration in one pass
+        ffmpeg_compose(video_files= video_files,
+                       width= width,
+                       height= height,
+                       audio_file= audio_file,
+                       captions_with_time= timeline.chunks,
+                       title = title,
+                       subtitle = subtitle,
+                       output_filename=output_file,
+                       hd = hd,
+                       crops = crops,
+                       clip_durations = clip_durations,
+                       duration = complete_duration,
+                       overlay_file = overlay_file,
+                       progress_callback = progress_callback,
+                       concat_demuxer = concat_demuxer)
+    finally:
+        os.remove(overlay_file)
@@ -1,14 +1,80 @@
-import requests, json, os, logging, time
-from codebase.utils import download_file, request_json
+import json, os, logging, time
+from codebase.utils import download_file, download_files, request_json
 from codebase.exceptions import NamedError
+from codebase.cache import MetadataCache, FileCache, start_refresher
+from codebase import quran_index
+from codebase.audio_duration import mp3_duration
+from codebase.ffmpeg_utils import ffmpeg_concat_audio
 
-import warnings
-warnings.filterwarnings("ignore", category=RuntimeWarning, module="pydub")
-from pydub import AudioSegment
+def fetch_reciters():
+  """
+    Fetch all arabic reciters from the Islamic Network API, bypassing the metadata cache.
+
+    Returns:
+        A list of dictionaries containing the following keys: ['id', 'name', 'code'].
+
+    Raises:
+        Exception: If the API doesn't return the list of reciters.
+  """
+  content = request_json("https://api.alquran.cloud/v1/edition/format/audio")
+  if(not content):
+    raise Exception("Problem fetching reciters")
+  reciters = []
+  id=1
+  for reciter in content["data"]:
+      if reciter["language"] == "ar":
+        reciters+= [{"id": id, "name": reciter["name"], "code": reciter["identifier"]}]
+        id+=1
+  return reciters
+
+def fetch_surahs():
+  """
+    Fetch all surahs from the Islamic Network API, bypassing the metadata cache.
+
+    Returns:
+        A list of dictionaries containing the following keys: ['id', 'name', 'aya_base', 'n_aya'].
+
+    Raises:
+        Exception: If the API doesn't return the quran meta data.
+  """
+  content = request_json("https://api.alquran.cloud/v1/meta")
+  if(not content):
+    raise Exception("Problem fetching surahs")
+  surahs = []
+  id=1
+  aya_base= 0
+  for surah in content["data"]["surahs"]["references"]:
+    surahs+= [{"id": id, "name": surah["name"], "aya_base": aya_base, "n_aya": surah["numberOfAyahs"]}]
+    aya_base+= surah["numberOfAyahs"]
+    id+=1
+  return surahs
+
+METADATA_TTL = 7*24*3600
+reciters_cache = MetadataCache("reciters", fetch_reciters, version=1, ttl=METADATA_TTL)
+surahs_cache = MetadataCache("surahs", fetch_surahs, version=1, ttl=METADATA_TTL)
+
+def warm_metadata_cache(refresh_in_background=False):
+  """
+    Load reciters and surahs metadata into memory once, ideally at process start.
+
+    Parameters:
+        refresh_in_background (bool, optional): If True, start a daemon thread that keeps
+                                                the metadata fresh. Default is False.
+
+    Example:
+        warm_metadata_cache(refresh_in_background=True)
+  """
+  for cache in [reciters_cache, surahs_cache]:
+    try:
+      cache.get()
+    except Exception as e:
+      logging.error(f"Error: Unable to warm {cache.name} cache. error: {e}")
+  if refresh_in_background:
+    start_refresher([reciters_cache, surahs_cache])
 
 def get_reciters(with_code=True):
   """
-    Fetch all reciters' names and ids from the Islamic Network API.
+    Get all reciters' names and ids, served from the metadata cache.
 
     Returns:
         A list of dictionaries containing the following keys: ['id', 'name', 'code'].
@@ -20,21 +86,14 @@ def get_reciters(with_code=True):
         Result: [{'id': 1, 'name': 'عبد الباسط عبد الصمد المرتل', 'code': 'ar.abdulbasitmurattal'},
                  {'id': 2, 'name': 'عبد الله بصفر', 'code': 'ar.abdullahbasfar'}, ...]
   """
-  content = request_json("https://api.alquran.cloud/v1/edition/format/audio")
-  reciters = []
-  id=1
-  for reciter in content["data"]:
-      if reciter["language"] == "ar":
-        if with_code:
-          reciters+= [{"id": id, "name": reciter["name"], "code": reciter["identifier"]}]
-        else:
-          reciters+= [{"id": id, "name": reciter["name"]}]
-        id+=1
-  return reciters
+  reciters = reciters_cache.get()
+  if with_code:
+    return [dict(reciter) for reciter in reciters]
+  return [{"id": reciter["id"], "name": reciter["name"]} for reciter in reciters]
 
 def get_surahs(with_base=True):
   """
-    Fetch all surah names and ids from the Islamic Network API.
+    Get all surah names and ids, served from the metadata cache.
 
     Returns:
         A list of dictionaries containing the following keys: ['id', 'name', 'aya_base', 'n_aya'].
@@ -50,18 +109,33 @@ def get_surahs(with_base=True):
         Result: [{'id': 1, 'name': 'سُورَةُ ٱلْفَاتِحَةِ', 'aya_base': 0, 'n_aya': 7},
                  {'id': 2, 'name': 'سُورَةُ البَقَرَةِ', 'aya_base': 7, 'n_aya': 286}, ...]
     """
-  content = request_json("https://api.alquran.cloud/v1/meta")
-  surahs = []
-  id=1
-  aya_base= 0
-  for surah in content["data"]["surahs"]["references"]:
-    if with_base:
-      surahs+= [{"id": id, "name": surah["name"], "aya_base": aya_base, "n_aya": surah["numberOfAyahs"]}]
-    else:
-      surahs+= [{"id": id, "name": surah["name"], "n_aya": surah["numberOfAyahs"]}]
-    aya_base+= surah["numberOfAyahs"]
-    id+=1
-  return surahs
+  surahs = surahs_cache.get()
+  if with_base:
+    return [dict(surah) for surah in surahs]
+  return [{"id": surah["id"], "name": surah["name"], "n_aya": surah["n_aya"]} for surah in surahs]
+
+AUDIO_BITRATE = 192
+
+def get_ayah_text(aya, index=None):
+  """
+    Get the text of an ayah from the quran index, or from the Islamic Network API if no index is available.
+
+    Parameters:
+        aya (int): The number of the ayah out of all Quran verses.
+        index (QuranIndex, optional): The quran index to look the text up in.
+
+    Raises:
+        NamedError: If the text can't be fetched.
+  """
+  if index is not None:
+    return index.ayah_text(aya)
+
+  text_response = request_json(f"https://api.alquran.cloud/v1/ayah/{str(aya)}")
+  if(not text_response):
+    error_message = f"Error in fetching text of aya number {str(aya)}"
+    logging.error(error_message)
+    raise NamedError(error_message)
+  return text_response["data"]["text"]
 
 def get_recitations(reciter_number, surah_number, start, end):
   """
@@ -110,7 +184,7 @@ def get_recitations(reciter_number, surah_number, start, end):
     logging.error(error_message)
     raise NamedError(error_message)
 
-  reciter = [reciter for reciter in get_reciters() if reciter["id"] == reciter_number][0]
+  reciter = [reciter for reciter in reciters if reciter["id"] == reciter_number][0]
 
   # validate aya numbers
   surah = [surah for surah in surahs if surah["id"]==surah_number][0]
@@ -138,65 +212,81 @@ def get_recitations(reciter_number, surah_number, start, end):
 
 
   # fetch ayat
+  index = quran_index.get_index()
   recitations = []
   for i, aya in enumerate(required_ayat):
-    audio_link = "https://cdn.islamic.network/quran/audio/192/" + str(reciter["code"]) + "/" + str(aya) + ".mp3"
+    audio_link = f"https://cdn.islamic.network/quran/audio/{AUDIO_BITRATE}/" + str(reciter["code"]) + "/" + str(aya) + ".mp3"
     logging.info(f"Getting recitation {audio_link}")
-    text_response = request_json(f"https://api.alquran.cloud/v1/ayah/{str(aya)}")
-    
-    if(not text_response):
-      error_message = f"Error in fetching text of aya number {str(aya)}"
-      logging.error(error_message)
-      raise NamedError(error_message)
-    
-    text = text_response["data"]["text"]
+    text = get_ayah_text(aya, index)
     if(i==0 and remove_bismillah):
       text = text.replace("بِسۡمِ ٱللَّهِ ٱلرَّحۡمَـٰنِ ٱلرَّحِیمِ", "")
     recitations+= [{"text": text.strip(), "audio_link": audio_link}]
 
   return {'surah': surah['name'], 'reciter': reciter["name"] ,'recitations': recitations, }
 
-def download_recitations(recitations, destination, verbose=True):
+AUDIO_DOWNLOAD_CONCURRENCY = 8
+AUDIO_CACHE_MAX_BYTES = 2*1024**3
+audio_cache = FileCache("audio", AUDIO_CACHE_MAX_BYTES)
+
+def recitation_cache_key(recitation_link):
+  """
+  Get the audio cache key of a recitation link: (bitrate, reciter code, ayah file).
+
+  Example:
+      recitation_cache_key("https://cdn.islamic.network/quran/audio/192/ar.alafasy/262.mp3")
+      Result: ('192', 'ar.alafasy', '262.mp3')
   """
-  Download audios of several recitations to a certain destination using curl.
+  return tuple(recitation_link.rstrip("/").split("/")[-3:])
+
+def download_cached_recitation(recitation_link, filename):
+  """ Link a recitation from the shared audio cache, downloading it on a miss. """
+  return audio_cache.fetch(recitation_cache_key(recitation_link),
+                           lambda path: download_file(recitation_link, path), filename)
+
+def download_recitations(recitations, destination, verbose=True, max_workers=AUDIO_DOWNLOAD_CONCURRENCY, timings=None):
+  """
+  Download audios of several recitations concurrently to a certain destination.
+  Recitations are linked from the shared audio cache when available.
 
   Parameters:
-      videos (list): Array of links for download.
+      recitations (list): Array of links for download.
       destination (str): The designated destination.
-      debug (bool, optional): A parameter to debug the output. If True, provides more verbose output.
-                            If False (default), output is minimal.
+      verbose (bool, optional): If True (default), print the download time of each file.
+      max_workers (int, optional): The maximum number of simultaneous downloads.
+      timings (list, optional): If given, extended with the download time in seconds of each file.
 
   Returns:
-      An array of the downloaded filenames.
+      An array of the downloaded filenames, in the order of the links.
+
+  Raises:
+      NamedError: As soon as one of the recitations can't be downloaded.
 
   Example:
       download_recitations([link1, link2, ...], "./temp/mp3/")
       Result: ["./temp/mp3/recitation_0.mp3", "./temp/mp3/recitation_1.mp3", ...]
   """
 
-  
-  audios = []
-
   if(not os.path.exists(destination)):
     os.mkdir(destination)
 
-  for i, recitation_link in enumerate(recitations):
-    file_path = os.path.join(destination, "recitation_" + str(i) + ".mp3")
-    logging.info(f"Downloading recitation {recitation_link}")
-    if verbose: print(f"- File {os.path.basename(file_path)}", end=" ")
-    sttime = time.time()
-    succsess = download_file(recitation_link, file_path)
-    if verbose: print(f"{time.time()-sttime:.2f} s")
-    if not succsess:
-      error_message = f"No recitation available change reciter"
-      logging.error(error_message)
-      raise NamedError(error_message)
-    audios+= [file_path]
+  audios = [os.path.join(destination, "recitation_" + str(i) + ".mp3") for i in range(len(recitations))]
+  logging.info(f"Downloading recitations {str(recitations)}")
+  succsess, files_timings = download_files(recitations, audios, max_workers, verbose,
+                                           download=download_cached_recitation)
+  if not succsess:
+    error_message = f"No recitation available change reciter"
+    logging.error(error_message)
+    raise NamedError(error_message)
+
+  if timings is not None:
+    timings.extend(files_timings)
   return audios
 
-def recitations_durations(audio_file_names):
+def recitations_durations(audio_file_names, recitations_links=None):
   """ A function to retrieve audio durations of a list of mp3 files
   :param audio_file_names: Array of complete filenamess
+  :param recitations_links: Optional array of the links the files were downloaded from.
+                            Durations are then read from and stored to the shared audio cache.
   :return: An array of durations
   .. note:: 
   Example usage:
@@ -204,45 +294,79 @@ def recitations_durations(audio_file_names):
   Result: [12.333, 4, 6, ...]
   """
   durations = []
-  for filename in audio_file_names:
-    if os.path.exists(filename):
-      audio = AudioSegment.from_mp3(filename)
-      duration_in_seconds = len(audio) / 1000.0
+  for i, filename in enumerate(audio_file_names):
+    key = recitation_cache_key(recitations_links[i]) if recitations_links else None
+    metadata = audio_cache.get_metadata(key) if key else None
+    if metadata and "duration" in metadata:
+      duration_in_seconds = metadata["duration"]
+      logging.info(f"Cached {os.path.basename(filename)} duration: {str(duration_in_seconds)}")
+      durations += [duration_in_seconds]
+    elif os.path.exists(filename):
+      duration_in_seconds = mp3_duration(filename)
       logging.info(f"Computing {os.path.basename(filename)} duration: {str(duration_in_seconds)}")
+      if key: audio_cache.set_metadata(key, {"duration": duration_in_seconds})
       durations += [duration_in_seconds]
     else:
       print("File doesn't exist")
       exit()
   return durations
 
-def generate_ayat_caption_file(ayat_texts, ayat_durations, destination):
+# Recitation pace in seconds per character of ayah text, diacritics included, slightly fast so
+# footage selected from an estimate rarely exceeds the recitation
+ESTIMATED_SECONDS_PER_CHARACTER = 0.12
+
+def estimate_recitations_duration(recitations):
   """
-  Write ayat text to a text file alongside the timestamp. Similar to subtitles files.
+  Estimate the total duration of recitations before they are downloaded, to select footage early.
+  Durations already in the shared audio cache are exact, the others are estimated from the text length.
 
   Parameters:
-      ayat_texts (list): Array of ayat Arabic text.
-      ayat_durations (list): Array of ayat recitation durations.
-      destination (str): Captions filename and path.
+      recitations (list): Recitation dictionaries with keys 'text' and 'audio_link', see get_recitations.
 
   Returns:
-      Nothing. Writes a file to the specified destination.
+      The estimated duration in seconds.
 
   Example:
-      generate_ayat_caption_file(["بسم الله الرحمن الرحيم", ...], [3.44, ...], "./temp/captions.txt")
-      Result: (Nothing)
+      estimate_recitations_duration([{'text': 'بِسۡمِ ٱللَّهِ ٱلرَّحۡمَـٰنِ ٱلرَّحِیمِ', 'audio_link': ...}])
+      Result: 4.56
   """
+  duration = 0
+  for recitation in recitations:
+    metadata = audio_cache.get_metadata(recitation_cache_key(recitation["audio_link"]))
+    if metadata and "duration" in metadata:
+      duration += metadata["duration"]
+    else:
+      duration += len(recitation["text"]) * ESTIMATED_SECONDS_PER_CHARACTER
+  return duration
 
-  endocding="utf-8"
-  seperator=":"
-  
-  if(not len(ayat_durations) == len(ayat_texts)):
-    raise Exception("Both ayat texts and durations arrays should be of the same size")
-  
-  file = open(destination, "w", encoding= endocding)
-  cummulative_duration= 0
-  logging.info("Generating ayat captions file")
-  for i in range(0, len(ayat_durations)):
-    file.write(f"{cummulative_duration}{seperator}{cummulative_duration+ayat_durations[i]}{seperator}{ayat_texts[i]}\n")
-    cummulative_duration+=ayat_durations[i]
-  file.close()
-  return
\ No newline at end of file
+def assemble_recitations(audio_file_names, durations, destination):
+  """
+  Concatenate the recitations into a single AAC track, once, so the composition only has one audio input.
+  The track is reused when it was already assembled from the same files, e.g. on a re-render.
+
+  Parameters:
+      audio_file_names (list): Array of recitations filenames, in order.
+      durations (list): Array of recitations durations, see recitations_durations.
+      destination (str): Track filename and path (.m4a).
+
+  Returns:
+      The track filename, destination.
+
+  Example:
+      assemble_recitations(["./temp/mp3/recitation_0.mp3", ...], [6.164, 4.022], "./temp/recitation.m4a")
+      Result: './temp/recitation.m4a'
+  """
+  manifest = {"files": [[os.path.basename(f), os.path.getsize(f)] for f in audio_file_names],
+              "durations": list(durations)}
+  manifest_filename = destination + ".json"
+  if os.path.exists(destination) and os.path.exists(manifest_filename):
+    with open(manifest_filename, "r", encoding="utf-8") as file:
+      if json.load(file) == manifest:
+        logging.info(f"Reusing assembled recitations {destination}")
+        return destination
+
+  logging.info(f"Assembling recitations into {destination}")
+  ffmpeg_concat_audio(audio_file_names, durations, destination)
+  with open(manifest_filename, "w", encoding="utf-8") as file:
+    json.dump(manifest, file)
+  return destination
@@ -1,7 +1,23 @@
-import json, os, logging, time
-from random import randint
-from codebase.utils import download_file, request_json
+import json, os, logging, time, math, hashlib
+from random import randint, shuffle
+from codebase.utils import download_files, download_file_segmented, request_json, ConnectionBudget
 from codebase.exceptions import NamedError
+from codebase.video_catalog import get_catalog, video_tags, PEXELS_API_KEY, PEXELS_SEARCH_URL
+from codebase.cache import FileCache, link_file
+from codebase.ffmpeg_utils import CROP_ENCODER_SETTINGS
+
+MAX_FETCH_ATTEMPTS = 100
+VIDEO_DOWNLOAD_CONNECTIONS = 8
+CLIP_CACHE_MAX_BYTES = 10*1024**3
+clip_cache = FileCache("clips", CLIP_CACHE_MAX_BYTES)
+
+# Clip selection settings, costs are estimated in seconds of work
+SELECTION_POOL_SIZE = 40
+SELECTION_WINDOW = 120
+DOWNLOAD_BYTES_PER_SECOND = 10*1024**2
+ENCODE_PIXELS_PER_SECOND = 1920*1080*120
+DEFAULT_FPS = 30
+BITS_PER_PIXEL = 0.1
 
 def get_index_smallest_larger_size(of_width, of_height, sizes):
   """
@@ -67,8 +83,8 @@ def get_pexeles_video(keyword, width, height):
 
   # Get total number of videos associated with the keyword
   per_page = 1
-  api_key = "fpKSq3NBtPzsmv82jJ2ZTDG946ILieYMpYdJx5hwVJjnti7gPCcZSTa9"
-  base_query = "https://api.pexels.com/videos/search?query="
+  api_key = PEXELS_API_KEY
+  base_query = PEXELS_SEARCH_URL
   query = base_query + keyword
   data = request_json(query, headers= {'Authorization': api_key})
   if(not data):
@@ -94,9 +110,7 @@ def get_pexeles_video(keyword, width, height):
   logging.info(f"Fetched video descriptor: {video['url']}")
 
   # Generate tags
-  url = video['url'][:-1] if video['url'][-1]=="/" else video['url']
-  video_title = url.split("/")[-1]
-  tags = video_title.split("-")
+  tags = video_tags(video['url'])
 
   logging.info("\n" + json.dumps(video, indent=2) + "\n")
 
@@ -112,17 +126,92 @@ def get_pexeles_video(keyword, width, height):
             "width": video_file["width"], "height": video_file["height"],
             "tags": tags, "link": video_file["link"]}
 
-def get_videos_conditioned(keyword, required_duration, blacklist, size):
+def clip_cost(video):
   """
-  Keep on fetching unique videos from pexels.com until their collective duration surpasses a threshold or the required duration, adhering to certain conditions.
+  Estimate the cost of using a video in seconds: the time to download it plus the time to encode all its frames.
+  The download size is estimated from the rendition when pexels doesn't report it.
+  """
+  pixels = video["width"] * video["height"]
+  frames = (video.get("fps") or DEFAULT_FPS) * video["duration"]
+  size = video.get("size") or pixels * frames * BITS_PER_PIXEL / 8
+  return size / DOWNLOAD_BYTES_PER_SECOND + pixels * frames / ENCODE_PIXELS_PER_SECOND
+
+def min_cost_cover(videos, required_duration):
+  """
+  Find the subset of videos covering the required duration at the minimum total cost (a bounded subset-sum).
+
+  Returns:
+      A list of videos, or None if all the videos together are shorter than the required duration.
+  """
+  target = math.ceil(required_duration)
+  # best[t]: (cost, indexes) of the cheapest subset found reaching t seconds, capped at the target
+  best = {0: (0, ())}
+  for i, video in enumerate(videos):
+    duration = math.ceil(video["duration"])
+    cost = clip_cost(video)
+    for reached, (reached_cost, indexes) in list(best.items()):
+      if reached == target:
+        continue
+      new_reached = min(target, reached + duration)
+      new_cost = reached_cost + cost
+      if new_reached not in best or new_cost < best[new_reached][0]:
+        best[new_reached] = (new_cost, indexes + (i,))
+
+  if target not in best:
+    return None
+  return [videos[i] for i in best[target][1]]
+
+def select_clips(candidates, required_duration):
+  """
+  Select videos covering the required duration with minimal download and encode cost, so little footage
+  is wasted past the required duration. Random clips are picked while far from the target, for variety,
+  then the tail is solved exactly over a random sample of the remaining candidates.
+
+  Parameters:
+      candidates (list): Video dictionaries, see VideoCatalog.query.
+      required_duration (float): The required duration in seconds.
+
+  Returns:
+      A list of selected videos. Their total duration is short of the requirement only if all candidates are.
+
+  Example:
+      select_clips([{... 'duration': 60, ...}, {... 'duration': 12, ...}], 10)
+      Result: [{... 'duration': 12, ...}]
+  """
+  pool = list(candidates)
+  shuffle(pool)
+
+  selected = []
+  remaining = required_duration
+  while pool and remaining > SELECTION_WINDOW:
+    video = pool.pop()
+    selected += [video]
+    remaining -= video["duration"]
+
+  if remaining > 0:
+    sample = pool[:SELECTION_POOL_SIZE]
+    chosen = min_cost_cover(sample, remaining)
+    if chosen is None:
+      chosen = min_cost_cover(pool, remaining) if len(pool) > len(sample) else None
+    selected += chosen if chosen is not None else pool
+
+  logging.info(f"Selected {len(selected)} clips of {sum([v['duration'] for v in selected])} s "
+               f"for {required_duration:.2f} s, estimated cost {sum([clip_cost(v) for v in selected]):.2f} s")
+  return selected
+
+def get_videos_conditioned(keyword, required_duration, blacklist, size, exclude_ids=()):
+  """
+  Select unique videos until their collective duration surpasses the required duration, adhering to certain conditions.
+  Videos are selected from the local catalog of the keyword, with the blacklist and size filter applied
+  before anything is downloaded, and chosen to minimize the footage downloaded and encoded past the
+  required duration (see select_clips). Random pexels queries are only used when the catalog falls short.
 
   Parameters:
       keyword (str): The keyword associated with the required video. Ex. "nature", "river", "mountain".
       required_duration (int): The required duration.
       blacklist (list, optional): A list of words that shouldn't occur in the video URL.
       size (int, int): The required minimum width and height as a tuple (min_width, min_height).
-      debug (bool, optional): A parameter to debug the output. If True, provides more verbose output.
-                            If False (default), output is minimal.
+      exclude_ids (list, optional): Ids of videos that shouldn't be selected, e.g. already selected.
 
   Returns:
       An array of video dictionaries containing the following keys: ['id', 'duration', 'width', 'height', 'link'].
@@ -132,6 +221,9 @@ def get_videos_conditioned(keyword, required_duration, blacklist, size):
       - 'height': Height of the video.
       - 'link': HTTP link to the video resource.
 
+  Raises:
+      Exception: If not enough valid videos are found after MAX_FETCH_ATTEMPTS random queries.
+
   Example:
       get_videos_to_duration("mountain", 30)
       Result: [{... 'duration': 15, ...}, {... 'duration': 20, ...}]
@@ -139,8 +231,28 @@ def get_videos_conditioned(keyword, required_duration, blacklist, size):
 
   total_duration= 0
   videos = []
-  ids= []
+  ids= list(exclude_ids)
+
+  try:
+    candidates = get_catalog(keyword).query(size, blacklist= blacklist, exclude_ids= ids, min_duration= 1)
+  except Exception as e:
+    logging.error(f"Error: Unable to query {keyword} videos catalog. error: {e}")
+    candidates = []
+
+  for video in select_clips(candidates, required_duration):
+    logging.info(f"Selected catalog video link {video['link']}")
+    ids+= [video["id"]]
+    videos+= [video]
+    total_duration+= video["duration"]
+
+  attempts = 0
   while(total_duration < required_duration):
+    if attempts >= MAX_FETCH_ATTEMPTS:
+      error_message = f"Couldn't find enough valid videos after {attempts} attempts"
+      logging.error(error_message)
+      raise Exception(error_message)
+    attempts += 1
+
     video={}
     video = get_pexeles_video(keyword, width= size[0], height= size[1])
 
@@ -163,18 +275,33 @@ def get_videos_conditioned(keyword, required_duration, blacklist, size):
     total_duration+= video["duration"]
   return videos
 
-def download_videos(videos_links, destination, verbose=True):
+def clip_cache_key(video, size, encoder_settings=CROP_ENCODER_SETTINGS):
   """
-  Download videos to a certain destination using curl.
+  Get the cropped clips cache key of a video: (pexels id, rendition, target size, encoder settings).
+
+  Example:
+      clip_cache_key({'id': 6528623, 'width': 2160, 'height': 3840, ...}, (1080, 1920))
+      Result: ('6528623', '2160x3840', '1080x1920', '3f1d0c5a9b2e.mp4')
+  """
+  settings = hashlib.sha1(" ".join(encoder_settings).encode()).hexdigest()[:12]
+  return (str(video["id"]), f"{video['width']}x{video['height']}", f"{size[0]}x{size[1]}", f"{settings}.mp4")
+
+def download_videos(videos_links, destination, verbose=True, max_connections=VIDEO_DOWNLOAD_CONNECTIONS, clip_keys=None, cached=None):
+  """
+  Download videos concurrently to a certain destination. Large videos are split in parallel HTTP Range segments
+  when the server supports them.
 
   Parameters:
       videos_links (list): Array of links for download.
       destination (str): The designated destination.
-      debug (bool, optional): A parameter to debug the output. If True, provides more verbose output.
-                            If False (default), output is minimal.
+      verbose (bool, optional): If True (default), print the download time of each file.
+      max_connections (int, optional): The total number of simultaneous connections of all downloads and segments.
+      clip_keys (list, optional): The clips cache key of each video (see clip_cache_key). Videos already cropped
+                                  are then linked from the cache instead of being downloaded.
+      cached (list, optional): If given, extended with whether each video was linked already cropped from the cache.
 
   Returns:
-      An array of the downloaded filenames.
+      An array of the downloaded filenames, in the order of the links.
 
   Example:
       download_videos([link1, link2, ...], "./temp/mp4/")
@@ -183,18 +310,30 @@ def download_videos(videos_links, destination, verbose=True):
   if(not os.path.exists(destination)):
     os.mkdir(destination)
 
-  logging.info(f"Downloading videos {str(videos_links)}")
-  videos_files = []
-  for i, link in enumerate(videos_links):
-    file_path = os.path.join(destination, "video_"+str(i)+".mp4")
-    logging.info(f"Downloading video {link}")
-    if verbose: print(f"- File {os.path.basename(file_path)}", end=" ")
-    sttime = time.time()
-    succsess = download_file(link, file_path)
-    if verbose: print(f"{time.time()-sttime:.2f} s")
-    if not succsess:
-      error_message = "Problem downloading video"
-      logging.error(error_message)
-      raise Exception(error_message)
-    videos_files+= [file_path]
-  return videos_files
\ No newline at end of file
+  videos_files = [os.path.join(destination, "video_"+str(i)+".mp4") for i in range(len(videos_links))]
+  videos_cached = [False] * len(videos_links)
+  for i, key in enumerate(clip_keys or []):
+    path = clip_cache.get(key)
+    if path is None:
+      clip_cache.count(hit=False)
+      continue
+    clip_cache.count(hit=True)
+    link_file(path, videos_files[i])
+    videos_cached[i] = True
+    logging.info(f"Linked cropped video {videos_links[i]} from clips cache")
+    if verbose: print(f"- File {os.path.basename(videos_files[i])} cached")
+
+  missing = [i for i in range(len(videos_links)) if not videos_cached[i]]
+  logging.info(f"Downloading videos {str([videos_links[i] for i in missing])}")
+  budget = ConnectionBudget(max_connections)
+  succsess, _ = download_files([videos_links[i] for i in missing], [videos_files[i] for i in missing],
+                               max_connections, verbose,
+                               download=lambda link, filename: download_file_segmented(link, filename, budget))
+  if not succsess:
+    error_message = "Problem downloading video"
+    logging.error(error_message)
+    raise Exception(error_message)
+
+  if cached is not None:
+    cached.extend(videos_cached)
+  return videos_files
@@ -1,8 +1,103 @@
-import os, logging, re
+import os, logging, json
 import subprocess
+from codebase.subtitles import write_ass, ass_filter
 
-with open("logging.conf", "r") as log_config:
-    LOG_FILE = re.findall(r"args=\('([^']+\.[^']+)',", log_config.read(), re.MULTILINE)[0]
+# Where the FFmpeg output goes when logging has no file handler
+DEFAULT_LOG_FILE = "logs.txt"
+
+def log_file():
+    """ The file FFmpeg output is appended to: the file of the root logger file handler (see logging.conf). """
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.FileHandler):
+            return handler.baseFilename
+    return DEFAULT_LOG_FILE
+
+def progress_report(out_time, frame, fps, speed, duration, done):
+    """
+    Build a progress report of an encode.
+
+    Parameters:
+        out_time (float): Seconds of the output encoded so far.
+        frame (int): Frames encoded so far.
+        fps (float): Frames encoded per second.
+        speed (float): Seconds of output encoded per second, or None if unknown.
+        duration (float): The output duration, or None if unknown.
+        done (bool): True once the encode is over.
+
+    Returns:
+        dict: The arguments with 'ratio' (0 to 1, None if duration is unknown) and 'eta' (remaining seconds,
+              None if unknown).
+    """
+    ratio, eta = None, None
+    if duration:
+        ratio = 1.0 if done else min(1.0, out_time / duration)
+        if done:
+            eta = 0
+        elif speed:
+            eta = max(0, duration - out_time) / speed
+    return {"out_time": out_time, "frame": frame, "fps": fps, "speed": speed,
+            "ratio": ratio, "eta": eta, "done": done}
+
+def parse_progress(values, duration, done):
+    """ Build a progress report from the key=value block written by ffmpeg -progress. """
+    def number(key, default=None):
+        try:
+            return float(values.get(key, "").rstrip("x"))
+        except ValueError:
+            return default
+
+    # out_time_ms is in microseconds too, kept by ffmpeg for compatibility
+    out_time_us = number("out_time_us", number("out_time_ms", 0))
+    return progress_report(out_time= max(0, out_time_us) / 1000000,
+                           frame= int(number("frame", 0)),
+                           fps= number("fps", 0),
+                           speed= number("speed"),
+                           duration= duration,
+                           done= done)
+
+def run_ffmpeg(cmd, duration=None, progress_callback=None):
+    """
+    Run an FFmpeg command logging its output to log_file(), reporting its progress with -progress.
+
+    Parameters:
+        cmd (list): The FFmpeg command.
+        duration (float, optional): The output duration, used to compute the progress ratio and the ETA.
+        progress_callback (callable, optional): Called with each progress report (see progress_report),
+                                                about twice per second and once when the encode is over.
+
+    Returns:
+        dict: The last progress report, or None without progress_callback.
+
+    Raises:
+        subprocess.CalledProcessError: If the FFmpeg command fails.
+    """
+    if progress_callback is None:
+        subprocess.run(cmd, stdout=open(log_file(), 'a'), stderr=open(log_file(), 'a'), check=True)
+        return None
+
+    cmd = cmd[:1] + ['-progress', 'pipe:1', '-nostats'] + cmd[1:]
+    report = None
+    values = {}
+    with open(log_file(), 'a') as log:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=log, text=True)
+        for line in process.stdout:
+            key, _, value = line.strip().partition("=")
+            if key != "progress":
+                values[key] = value
+                continue
+            report = parse_progress(values, duration, value == "end")
+            try:
+                progress_callback(report)
+            except Exception as e:
+                logging.error(f"Error: Progress callback failed. error: {e}")
+        returncode = process.wait()
+
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd)
+    return report
+
+# Encoder settings of cropped clips, part of the clips cache key
+CROP_ENCODER_SETTINGS = ['-preset', 'ultrafast', '-an']
 
 def ffmpeg_crop(input_filename, output_filename, x, y, w, h):
     """
@@ -32,44 +127,135 @@ def ffmpeg_crop(input_filename, output_filename, x, y, w, h):
         'ffmpeg',
         '-hide_banner',
         '-loglevel', "error",
+        '-y',
         '-i', input_filename,
         '-vf', f'crop={w}:{h}:{x}:{y}',
-        '-preset', 'ultrafast',
-        '-an',
+        *CROP_ENCODER_SETTINGS,
         output_filename
     ]
 
     logging.info(f"Running crop command: {' '.join(cmd)}")
-    subprocess.run(cmd, stdout= open(LOG_FILE, 'a'), stderr=open(LOG_FILE, 'a'), check=True)
+    subprocess.run(cmd, stdout= open(log_file(), 'a'), stderr=open(log_file(), 'a'), check=True)
 
     return
 
-def crop_video(filename, width, height, expected_width, expected_height):
+# Canonical intermediate format of normalized clips, clips in this format at the same size
+# are joined by the concat demuxer without re-encoding
+NORMALIZED_FRAME_RATE = 30
+NORMALIZED_ENCODER_SETTINGS = ['-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p',
+                               '-video_track_timescale', str(NORMALIZED_FRAME_RATE * 512), '-an']
+
+def normalize_video(filename, width, height, expected_width, expected_height):
     """
-    Crop a video file to the specified dimensions.
+    Crop a video file to the specified dimensions and convert it to the canonical intermediate format:
+    H.264, yuv420p, NORMALIZED_FRAME_RATE fps, square pixels and no audio.
 
     Parameters:
-        filename (str): The path to the input video file.
+        filename (str): The path to the input video file, replaced by the normalized video.
         width (int): The original width of the video.
         height (int): The original height of the video.
         expected_width (int): The desired width after cropping.
         expected_height (int): The desired height after cropping.
 
+    Raises:
+        Exception: If the original video resolution is smaller than the expected resolution.
+        subprocess.CalledProcessError: If the FFmpeg command fails.
+
+    Example:
+        normalize_video("input_video.mp4", 3840, 2160, 1080, 1920)
+    """
+    x, y, w, h = center_crop(width, height, expected_width, expected_height)
+
+    backed_up_filename = filename+".bck"
+    os.rename(src=filename, dst=backed_up_filename)
+
+    cmd = [
+        'ffmpeg',
+        '-hide_banner',
+        '-loglevel', "error",
+        '-y',
+        '-i', backed_up_filename,
+        '-vf', f'crop={w}:{h}:{x}:{y},setsar=1,fps={NORMALIZED_FRAME_RATE},format=yuv420p',
+        *NORMALIZED_ENCODER_SETTINGS,
+        '-f', 'mp4',
+        filename
+    ]
+
+    logging.info(f"Running normalize command: {' '.join(cmd)}")
+    subprocess.run(cmd, stdout= open(log_file(), 'a'), stderr=open(log_file(), 'a'), check=True)
+    os.remove(backed_up_filename)
+
+def ffprobe(filename):
+    """
+    Inspect a media file with ffprobe.
+
+    Parameters:
+        filename (str): The media file path.
+
+    Returns:
+        dict: The ffprobe JSON output with the 'format' and 'streams' sections.
+
+    Raises:
+        subprocess.CalledProcessError: If the ffprobe command fails, e.g. the file isn't a media file.
+    """
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-print_format', 'json',
+        '-show_format',
+        '-show_streams',
+        filename
+    ]
+
+    logging.info(f"Running probe command: {' '.join(cmd)}")
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=open(log_file(), 'a'), check=True)
+    return json.loads(result.stdout)
+
+def center_crop(width, height, expected_width, expected_height):
+    """
+    Compute the centered crop area of a video to the specified dimensions.
+
     Raises:
         Exception: If the original video resolution is smaller than the expected resolution.
 
     Returns:
-        None
+        (int, int, int, int): The crop area (x, y, w, h).
 
     Example:
-        crop_video("input_video.mp4", 1920, 1080, 1280, 720)
+        center_crop(1920, 1080, 1280, 720)
+        Result: (320, 180, 1280, 720)
     """
-
     if (width<expected_width or height<expected_height):
        raise Exception(f"Video resolution should be greater than ({expected_width}, {expected_height}) passed resolution ({width}, {height})")
 
     x_offset = (width - expected_width) // 2
     y_offset = (height - expected_height) // 2
+    return x_offset, y_offset, expected_width, expected_height
+
+def crop_video(filename, width, height, expected_width, expected_height):
+    """
+    Crop a video file to the specified dimensions. Does nothing if the video is already at these dimensions.
+
+    Parameters:
+        filename (str): The path to the input video file.
+        width (int): The original width of the video.
+        height (int): The original height of the video.
+        expected_width (int): The desired width after cropping.
+        expected_height (int): The desired height after cropping.
+
+    Raises:
+        Exception: If the original video resolution is smaller than the expected resolution.
+
+    Returns:
+        None
+
+    Example:
+        crop_video("input_video.mp4", 1920, 1080, 1280, 720)
+    """
+
+    x_offset, y_offset, _, _ = center_crop(width, height, expected_width, expected_height)
+    if (width, height) == (expected_width, expected_height):
+        return
 
     backed_up_filename = filename+".bck"
     os.rename(src=filename, dst=backed_up_filename)
@@ -78,146 +264,306 @@ def crop_video(filename, width, height, expected_width, expected_height):
 
     os.remove(backed_up_filename)
 
-def ffmpeg_compose(video_files, width, height, audio_files, captions_with_time, title, subtitle, output_filename, hd):
+def write_concat_list(filenames, list_filename, durations=None):
+    """ Write a concat demuxer list of files, with the duration of each file if given. """
+    with open(list_filename, "w", encoding="utf-8") as list_file:
+        for i, filename in enumerate(filenames):
+            escaped_path = os.path.abspath(filename).replace("'", "'\\''")
+            list_file.write(f"file '{escaped_path}'\n")
+            if durations is not None:
+                list_file.write(f"duration {durations[i]}\n")
+    return list_filename
+
+def ffmpeg_concat_audio(audio_files, durations, output_filename, bitrate="192k"):
+    """
+    Concatenate audio files into a single AAC track using the concat demuxer, decoding each input once.
+
+    Parameters:
+        audio_files (list): List of input audio file paths, in order.
+        durations (list): Duration in seconds of each input. Used as the concat timestamps so that
+                          the track timeline matches the durations exactly.
+        output_filename (str): Output file path of the track (.m4a).
+        bitrate (str, optional): AAC bitrate. Default is "192k".
+
+    Raises:
+        subprocess.CalledProcessError: If the FFmpeg command fails.
+
+    Example:
+        ffmpeg_concat_audio(["recitation_0.mp3", "recitation_1.mp3"], [6.164, 4.022], "recitation.m4a")
+    """
+
+    list_filename = write_concat_list(audio_files, output_filename + ".txt", durations)
+
+    cmd = [
+        'ffmpeg',
+        '-hide_banner',
+        '-loglevel', "error",
+        '-y',
+        '-f', 'concat',
+        '-safe', '0',
+        '-i', list_filename,
+        '-vn',
+        '-c:a', 'aac',
+        '-b:a', bitrate,
+        output_filename
+    ]
+
+    logging.info(f"Running audio concat command: {' '.join(cmd)}")
+    subprocess.run(cmd, stdout=open(log_file(), 'a'), stderr=open(log_file(), 'a'), check=True)
+    os.remove(list_filename)
+
+    return output_filename
+
+# Opacity of the black layer dimming the background videos
+DIMMING_OPACITY = 0.3
+
+def ffmpeg_static_overlay(subtitles_file, width, height, output_filename, dimming=DIMMING_OPACITY):
+    """
+    Render the static layer of a video once: the black dimming layer and the texts of an ASS subtitle
+    file at time 0, to a single RGBA png image applied on every frame by one overlay filter.
+
+    libass doesn't write the alpha channel, so the texts are rendered white on black and their
+    coverage gives the alpha of the image, from the dimming opacity to fully opaque.
+
+    Parameters:
+        subtitles_file (str): An ASS subtitle file holding the static texts, see subtitles.write_ass.
+        width (int): Width of the image.
+        height (int): Height of the image.
+        output_filename (str): Output png file path.
+        dimming (float, optional): Opacity of the black layer. Default is DIMMING_OPACITY.
+
+    Raises:
+        subprocess.CalledProcessError: If the FFmpeg command fails.
+
+    Example:
+        ffmpeg_static_overlay("overlay.ass", 1080, 1920, "overlay.png")
+    """
+    dimming_alpha = 255 * dimming
+    texts = f"color=c=black:s={width}x{height}:d=1,{ass_filter(subtitles_file)},format=gray"
+    alpha = f"{dimming_alpha}+{1 - dimming}*lum(X,Y)"
+    cmd = [
+        'ffmpeg',
+        '-hide_banner',
+        '-loglevel', "error",
+        '-y',
+        '-f', 'lavfi',
+        '-i', f"{texts},split[c][a]; "
+              f"[c]geq=lum='255*lum(X,Y)/({alpha})',format=rgb24[color]; "
+              f"[a]geq=lum='{alpha}'[alpha]; "
+              f"[color][alpha]alphamerge,format=rgba",
+        '-frames:v', '1',
+        '-c:v', 'png',
+        '-f', 'image2',
+        '-update', '1',
+        output_filename
+    ]
+    logging.info(f"Running static overlay command: {' '.join(cmd)}")
+    subprocess.run(cmd, stdout=open(log_file(), 'a'), stderr=open(log_file(), 'a'), check=True)
+    return output_filename
+
+# Extra seconds decoded from the last clip used, in case its reported duration is slightly off
+TRIM_MARGIN = 1.0
+
+def used_durations(clip_durations, duration):
+    """
+    Compute the seconds each clip contributes to a video of the given duration when concatenated.
+    Clips that don't contribute are left out.
+
+    Example:
+        used_durations([10, 20, 30], 25)
+        Result: [10, 16.0]
+    """
+    used = []
+    remaining = duration
+    for clip_duration in clip_durations:
+        if remaining <= 0:
+            break
+        used += [min(clip_duration, remaining + TRIM_MARGIN)]
+        remaining -= clip_duration
+    return used
+
+def ffmpeg_compose(video_files, width, height, audio_file, captions_with_time, title, subtitle, output_filename, hd, crops=None,
+                   clip_durations=None, duration=None, overlay_file=None, clip_offsets=None, frame_rate=None,
+                   progress_callback=None, concat_demuxer=False):
     """
-    Composes a video by concatenating multiple video and audio files, adding captions,
-    title, and subtitle using FFmpeg.
+    Composes a video by concatenating multiple video files over an audio track, adding captions,
+    title, and subtitle using FFmpeg. The texts are burned in from an ASS subtitle file (see subtitles.write_ass).
 
     Parameters:
     - video_files (list): List of input video file paths to be concatenated.
     - width (int): Width of the output video.
     - height (int): Height of the output video.
-    - audio_files (list): List of input audio file paths to be concatenated.
-    - captions_with_time (list): List of dictionaries containing timed captions.
-      Each dictionary should have 'text', 'start_time', and 'end_time' keys.
+    - audio_file (str): Input audio track path, see ffmpeg_concat_audio. If None, the video has no audio.
+    - captions_with_time (list): List of timed captions (see timeline.TimedText).
     - Title: Title on top of the video
     - Subtitle: Under the top of the video
     - output_filename (str): Output file path for the composed video.
     - hd (bool): If True, use HD settings for font size. If False, use SD settings.
+    - crops (list, optional): The crop area (x, y, w, h) of each video file, or None for files already
+      at the output size (see center_crop). Cropping then happens inside the filter graph, so the
+      videos are decoded and encoded once with no intermediate cropped files.
+    - clip_durations (list, optional): The duration of each video file. With duration, each input is limited
+      to the seconds it contributes and unused inputs are left out, so decoders stop early.
+    - duration (float, optional): The output duration. Default is the end of the last caption.
+    - overlay_file (str, optional): A static RGBA image holding the dimming layer, title and subtitle
+      (see ffmpeg_static_overlay). Title and subtitle are then left out of the subtitle file.
+    - clip_offsets (list, optional): The second each video file starts being read from. Default is 0.
+    - frame_rate (int, optional): A constant output frame rate. The last frame is then repeated if the videos
+      end before duration, so the output lasts exactly duration (see compose_segments).
+    - progress_callback (callable, optional): Called with the encode progress reports (see run_ffmpeg),
+      the last one holds the average encode fps and speed.
+    - concat_demuxer (bool, optional): If True, the videos are read one after the other by the concat demuxer,
+      with a single decoder and no concat filter. They must share codec, size, frame rate and time base,
+      and have no crop area (see normalize_video and media_info.same_video_format).
 
     Returns:
     - output_filename (str): Output file path of the composed video.
 
     Example:
-        ffmpeg_compose(["video1.mp4", "video2.mp4"], ["audio1.mp3", "audio2.mp3"],
-                        [{"text": "Caption 1", "start_time": 10, "end_time": 15},
-                         {"text": "Caption 2", "start_time": 20, "end_time": 25}],
+        ffmpeg_compose(["video1.mp4", "video2.mp4"], 1080, 1920, "recitation.m4a",
+                        [TimedText(10, 15, "Caption 1"), TimedText(20, 25, "Caption 2")],
                         "output_video.mp4", hd=True)
     """
 
 
+    # outputs left by a failed render are overwritten when the job is resumed
     cmd = [
         'ffmpeg',
         '-hide_banner',
         '-loglevel', "info",
+        '-y',
     ]
 
-    # Add input video files to the command
-    for input_file in video_files:
-        cmd.extend(['-i', input_file])
-
-    # Add input audio files to the command
-    for input_file in audio_files:
-        cmd.extend(['-i', input_file])
+    if duration is None:
+        duration = captions_with_time[-1].end_time
+
+    # Limit each input video to the seconds it contributes
+    crops = crops or [None] * len(video_files)
+    if clip_durations:
+        inputs_durations = used_durations(clip_durations, duration)
+        video_files = video_files[:len(inputs_durations)]
+        crops = crops[:len(inputs_durations)]
+    else:
+        inputs_durations = [None] * len(video_files)
+
+    # Add input video files to the command, as one concat demuxer input if they share their format
+    base_filename = os.path.splitext(output_filename)[0]
+    list_filename = None
+    if concat_demuxer:
+        list_filename = write_concat_list(video_files, base_filename + ".concat.txt")
+        cmd.extend(['-f', 'concat', '-safe', '0', '-i', list_filename])
+        video_inputs = 1
+    else:
+        clip_offsets = clip_offsets or [0] * len(video_files)
+        for input_file, input_duration, offset in zip(video_files, inputs_durations, clip_offsets):
+            if offset:
+                cmd.extend(['-ss', str(offset)])
+            if input_duration is not None:
+                cmd.extend(['-t', str(input_duration)])
+            cmd.extend(['-i', input_file])
+        video_inputs = len(video_files)
+
+    # Add the input audio track to the command
+    if audio_file:
+        cmd.extend(['-i', audio_file])
+
+    # Add the static overlay image after the audio track
+    if overlay_file:
+        cmd.extend(['-i', overlay_file])
+
+    # Crop video streams
+    crop_filters = []
+    for i, crop in enumerate(crops[:video_inputs]):
+        if crop is None:
+            crop_filters += [f'[{i}:v]setsar=1[v{i}]']
+        else:
+            x, y, w, h = crop
+            crop_filters += [f'[{i}:v]crop={w}:{h}:{x}:{y},setsar=1[v{i}]']
 
     # Concatenate video streams
-    v_filter = ''.join([f'[{i}:v]' for i in range(len(video_files))]) + \
-               f'concat=n={len(video_files)}:v=1:a=0[outv]'
-
-    # Concatenate audio streams
-    a_filter = ''.join([f'[{i}:a]' for i in range(len(video_files), len(video_files) + len(audio_files))]) + \
-               f'concat=n={len(audio_files)}:v=0:a=1[outa]'
-
-    # Combine video and audio streams
-    av_filter = v_filter + ";" + a_filter
-
-    # Add black transparent overlay
-    overlay_filter = f"color=c=black@0.3:s={width}x{height}:r=1:d=1[outblacked]; [outv][outblacked] overlay [outbg]"
-
-    # Create drawtext filter for each timed caption
-    # Configure text overlay parameters
-    font_file = "../resources/font/amiri.ttf"
-    h1_fontsize = 100 if hd else 33
-    h2_fontsize = 30 if hd else 11
-    fontcolor = "white"
-    centered_x = "(w-text_w)/2"
-    caption_y = f"(h-text_h)/2+{100 if hd else 33}"
-    title_y = f"{100 if hd else 33}"
-    subtitle_y =  f"{300 if hd else 99}"
-
-    drawtexts = []
-    for timed_text in captions_with_time:
-        drawtexts += [(
-            f"drawtext=text='{timed_text['text']}':x={centered_x}:y={caption_y}:fontsize={str(h1_fontsize)}:"
-            f"fontfile={font_file}:fontcolor={fontcolor}:"
-            f"enable='between(t,{str(timed_text['start_time'])},{str(timed_text['end_time'])})'"
-        )]
-
-    # create drawtext filter for title and subtitle
-    duration = captions_with_time[-1]["end_time"]
-
-    drawtexts += [(
-            f"drawtext=text='{title}':x={centered_x}:y={title_y}:fontsize={str(h1_fontsize)}:"
-            f"fontfile={font_file}:fontcolor={fontcolor}:"
-            f"enable='between(t,{str(0)},{str(duration)})'"
-        )]
-    
-    drawtexts += [(
-            f"drawtext=text='{subtitle}':x={centered_x}:y={subtitle_y}:fontsize={str(h2_fontsize)}:"
-            f"fontfile={font_file}:fontcolor={fontcolor}:"
-            f"enable='between(t,{str(0)},{str(duration)})'"
-        )]
-
-
-    text_filter = f"[outbg]{','.join(drawtexts)}[outf]"
+    v_filter = '; '.join(crop_filters) + '; ' + \
+               ''.join([f'[v{i}]' for i in range(video_inputs)]) + \
+               (f'concat=n={video_inputs}:v=1:a=0' if video_inputs > 1 else 'null') + \
+               (f',fps={frame_rate},tpad=stop_mode=clone:stop=-1' if frame_rate else '') + '[outv]'
+
+    # Add the static layer: the pre-rendered image, or a black transparent overlay with the texts in the subtitle file
+    if overlay_file:
+        overlay_filter = f"[outv][{video_inputs + (1 if audio_file else 0)}:v]overlay[outbg]"
+        title, subtitle = None, None
+    else:
+        overlay_filter = f"color=c=black@{DIMMING_OPACITY}:s={width}x{height}:r=1:d=1[outblacked]; [outv][outblacked] overlay [outbg]"
+
+    # Burn the captions in from one subtitle file instead of a drawtext filter per caption
+    subtitles_file = write_ass(captions_with_time, width, height, hd, base_filename + ".ass",
+                               title=title, subtitle=subtitle, duration=duration)
+    text_filter = f"[outbg]{ass_filter(subtitles_file)}[outf]"
+
+    # Load the filter graph from a file to keep the command line short whatever the number of inputs
+    filter_script = base_filename + ".filtergraph"
+    with open(filter_script, "w", encoding="utf-8") as file:
+        file.write(f"{v_filter}; {overlay_filter}; {text_filter}")
 
     # Build the complete FFmpeg command
-    cmd += ['-filter_complex', f"{av_filter}; {overlay_filter}; {text_filter}",
-            '-map', '[outf]',
-            '-map', '[outa]',
+    cmd += ['-filter_complex_script', filter_script,
+            '-map', '[outf]']
+    cmd += ['-map', f'{video_inputs}:a', '-c:a', 'copy'] if audio_file else ['-an']
+    cmd += ['-t', str(duration),
             '-preset', 'ultrafast',
             output_filename
             ]
 
     # Run the FFmpeg command
     logging.info(f"Running compose command: {' '.join(cmd)}")
-    subprocess.run(cmd, stdout=open(LOG_FILE, 'a'), stderr=open(LOG_FILE, 'a'), check=True)
+    try:
+        run_ffmpeg(cmd, duration, progress_callback)
+    finally:
+        os.remove(filter_script)
+        os.remove(subtitles_file)
+        if list_filename:
+            os.remove(list_filename)
 
     return output_filename
 
 
-def ffmpeg_cut(input_filename, start_time, duration):
+def ffmpeg_concat_segments(segment_files, audio_file, duration, output_filename):
     """
-    Overwrites an input video file by cutting a section and saving it using FFmpeg.
+    Join video segments rendered with the same settings, without re-encoding, and mux the audio track.
 
     Parameters:
-    - input_filename (str): Input and output video file path.
-    - start_time (int or float): Start time in seconds.
-    - duration (int or float): Duration of the cut in seconds.
+        segment_files (list): List of video segment paths, in order.
+        audio_file (str): Input audio track path, see ffmpeg_concat_audio.
+        duration (float): The output duration.
+        output_filename (str): Output file path of the video.
 
-    Returns:
-    - input_filename (str): Output file path of the cut video (same as input_filename).
+    Raises:
+        subprocess.CalledProcessError: If the FFmpeg command fails.
+
+    Example:
+        ffmpeg_concat_segments(["segment_0.mp4", "segment_1.mp4"], "recitation.m4a", 62.4, "generated.mp4")
     """
 
-    temp_output_filename = "temp_cut_output.mp4"
+    list_filename = write_concat_list(segment_files, output_filename + ".txt")
 
     cmd = [
         'ffmpeg',
         '-hide_banner',
-        '-loglevel', "info",
-        '-i', input_filename,
-        '-ss', str(start_time),
-        '-t', str(duration),
+        '-loglevel', "error",
+        '-y',
+        '-f', 'concat',
+        '-safe', '0',
+        '-i', list_filename,
+        '-i', audio_file,
+        '-map', '0:v',
+        '-map', '1:a',
         '-c', 'copy',
-        '-preset', 'ultrafast',
-        temp_output_filename
+        '-t', str(duration),
+        output_filename
     ]
 
-    # Run the FFmpeg command
-    logging.info(f"Running cut command: {' '.join(cmd)}")
-    subprocess.run(cmd, stdout=open(LOG_FILE, 'a'), stderr=open(LOG_FILE, 'a'), check=True)
-
-    # Move the temporary output file to overwrite the original input file
-    os.replace(temp_output_filename, input_filename)
+    logging.info(f"Running segments concat command: {' '.join(cmd)}")
+    try:
+        subprocess.run(cmd, stdout=open(log_file(), 'a'), stderr=open(log_file(), 'a'), check=True)
+    finally:
+        os.remove(list_filename)
 
-    return input_filename
\ No newline at end of file
+    return output_filename
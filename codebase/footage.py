@@ -0,0 +1,196 @@
+import os, json, logging, time, shutil
+from abc import ABC, abstractmethod
+from codebase import fetch_video, ffmpeg_utils
+from codebase.cache import link_file
+
+DEFAULT_KEYWORD = "aerial landscape"
+DEFAULT_BLACKLIST = ["animal", "animals", "cow", "dog", "cat", "human", "person", "woman", "women", "couple", "man", "men", "cross", "church", "people", "mother", "daughter", "son", "sister", "brother", "father"]
+
+MANIFEST_FILENAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+class FootageSource(ABC):
+    """
+    Where the background clips of a video come from. The pipeline calls, in order:
+    get_clips (Fetching Video), download_clips (Downloading Video) and prepare_clips (Cropping Video).
+
+    Clips are dictionaries containing at least the following keys: ['id', 'duration', 'width', 'height'].
+    """
+
+    # True if the clips are already at the target size, so the pipeline skips the crop stage
+    pre_cropped = False
+
+    @abstractmethod
+    def get_clips(self, required_duration, size, exclude=()):
+        """
+        Select clips with a total duration of at least required_duration for the (width, height) size,
+        other than the clips with an id in exclude (e.g. to top up clips already selected).
+        """
+
+    @abstractmethod
+    def download_clips(self, clips, destination, size, verbose=True):
+        """
+        Make the clips available in destination and return their filenames, in order.
+        What prepare_clips and crop_areas need to know about a file is added to its clip, e.g. whether
+        it is already cropped. Clips are checkpointed with the files, so the values must be JSON values.
+        """
+
+    def prepare_clips(self, clips, files, size, verbose=True):
+        """ Bring the files to the (width, height) size. """
+        pass
+
+    def crop_areas(self, clips, size):
+        """ The crop area of each file to the (width, height) size, or None for files already at that size. """
+        return [None] * len(clips)
+
+class PexelsFootageSource(FootageSource):
+    """
+    Clips searched on pexels.com by keyword, downloaded, then cropped (see fetch_video).
+
+    Parameters:
+        keyword (str, optional): The keyword associated with the clips.
+        blacklist (list, optional): Words that shouldn't occur in the clips tags.
+        normalize (bool, optional): If True, clips are also converted to the canonical intermediate format
+                                    (see ffmpeg_utils.normalize_video), so they are joined without re-encoding.
+    """
+
+    def __init__(self, keyword=DEFAULT_KEYWORD, blacklist=DEFAULT_BLACKLIST, normalize=False):
+        self.keyword = keyword
+        self.blacklist = blacklist
+        self.normalize = normalize
+
+    def get_clips(self, required_duration, size, exclude=()):
+        return fetch_video.get_videos_conditioned(self.keyword, required_duration, self.blacklist, size,
+                                                  exclude_ids= exclude)
+
+    def download_clips(self, clips, destination, size, verbose=True):
+        encoder_settings = ffmpeg_utils.NORMALIZED_ENCODER_SETTINGS if self.normalize else ffmpeg_utils.CROP_ENCODER_SETTINGS
+        clip_keys = [fetch_video.clip_cache_key(clip, size, encoder_settings) for clip in clips]
+        cached = []
+        files = fetch_video.download_videos([clip["link"] for clip in clips], destination, verbose,
+                                            clip_keys= clip_keys, cached= cached)
+        # the key is computed from the reported size, before the clips are inspected
+        for clip, clip_key, clip_cached in zip(clips, clip_keys, cached):
+            clip["cache_key"] = list(clip_key)
+            clip["cached"] = clip_cached
+        return files
+
+    def prepare_clips(self, clips, files, size, verbose=True):
+        for i, video_file in enumerate(files):
+            if clips[i].get("cached"):
+                continue
+            sttime = time.time()
+            if(verbose): print(f"- File {os.path.basename(video_file)}", end=" ")
+            if self.normalize:
+                ffmpeg_utils.normalize_video(video_file, clips[i]["width"], clips[i]["height"], size[0], size[1])
+            else:
+                ffmpeg_utils.crop_video(video_file, clips[i]["width"], clips[i]["height"], size[0], size[1])
+            if "cache_key" in clips[i]:
+                fetch_video.clip_cache.put(tuple(clips[i]["cache_key"]), video_file)
+            if(verbose): print(f"{time.time() - sttime:.2f} s")
+
+    def crop_areas(self, clips, size):
+        return [None if clip.get("cached") or (clip["width"], clip["height"]) == tuple(size)
+                else ffmpeg_utils.center_crop(clip["width"], clip["height"], size[0], size[1])
+                for clip in clips]
+
+class LocalLibraryFootageSource(FootageSource):
+    """
+    Clips from a local directory of pre-normalized, pre-cropped clips described by a manifest,
+    so jobs need neither pexels nor any download or crop.
+
+    The manifest (manifest.json) lists the clips:
+        {"version": 1, "clips": [{"id": "clip_0", "file": "clip_0.mp4", "duration": 12.0,
+                                  "width": 1080, "height": 1920, "tags": ["aerial", "sea"]}, ...]}
+
+    Parameters:
+        directory (str): The library directory.
+        blacklist (list, optional): Words that shouldn't occur in the clips tags.
+
+    Example:
+        source = LocalLibraryFootageSource("./footage_library")
+        source.get_clips(30, (1080, 1920))
+        Result: [{'id': 'clip_3', 'file': 'clip_3.mp4', 'duration': 20.0, ...}, ...]
+    """
+
+    pre_cropped = True
+
+    def __init__(self, directory, blacklist=DEFAULT_BLACKLIST):
+        self.directory = directory
+        self.blacklist = set(blacklist)
+        manifest = read_manifest(directory)
+
+        # index clips by resolution, sorted by duration
+        self.clips_by_size = {}
+        for clip in sorted(manifest["clips"], key=lambda clip: clip["duration"]):
+            self.clips_by_size.setdefault((clip["width"], clip["height"]), []).append(clip)
+
+    def get_clips(self, required_duration, size, exclude=()):
+        candidates = [clip for clip in self.clips_by_size.get(tuple(size), [])
+                      if not self.blacklist.intersection(clip.get("tags", [])) and clip["id"] not in exclude]
+        clips = fetch_video.select_clips(candidates, required_duration)
+        if sum([clip["duration"] for clip in clips]) < required_duration:
+            error_message = f"Not enough footage of size {size} in library {self.directory} for {required_duration:.2f} s"
+            logging.error(error_message)
+            raise Exception(error_message)
+        # copies, the pipeline updates the clips of a job in place (see media_info.inspect_clips)
+        return [dict(clip) for clip in clips]
+
+    def download_clips(self, clips, destination, size, verbose=True):
+        if(not os.path.exists(destination)):
+            os.mkdir(destination)
+        files = []
+        for i, clip in enumerate(clips):
+            file_path = os.path.join(destination, "video_"+str(i)+".mp4")
+            link_file(os.path.join(self.directory, clip["file"]), file_path)
+            logging.info(f"Linked library clip {clip['file']}")
+            files += [file_path]
+        return files
+
+def read_manifest(directory):
+    manifest_path = os.path.join(directory, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return {"version": MANIFEST_VERSION, "clips": []}
+    with open(manifest_path, "r", encoding="utf-8") as file:
+        manifest = json.load(file)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise Exception(f"Unsupported footage library manifest version {manifest.get('version')}")
+    return manifest
+
+def add_to_library(directory, source, required_duration, size, verbose=True):
+    """
+    Fill a local footage library with clips from another footage source, cropped to size.
+
+    Parameters:
+        directory (str): The library directory, created if missing.
+        source (FootageSource): Where to get the clips from, e.g. PexelsFootageSource().
+        required_duration (float): The total duration of clips to add in seconds.
+        size (int, int): The (width, height) of the clips.
+
+    Returns:
+        The number of clips added.
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest = read_manifest(directory)
+    known_clips = set([(clip["id"], clip["width"], clip["height"]) for clip in manifest["clips"]])
+
+    temp_dir = os.path.join(directory, "library_temporary")
+    clips = [clip for clip in source.get_clips(required_duration, size)
+             if (str(clip["id"]), size[0], size[1]) not in known_clips]
+    files = source.download_clips(clips, temp_dir, size, verbose)
+    source.prepare_clips(clips, files, size, verbose)
+
+    for clip, file in zip(clips, files):
+        clip_id = str(clip["id"])
+        filename = f"{clip_id}_{size[0]}x{size[1]}.mp4"
+        shutil.move(file, os.path.join(directory, filename))
+        manifest["clips"] += [{"id": clip_id, "file": filename, "duration": clip["duration"],
+                               "width": size[0], "height": size[1], "tags": clip.get("tags", [])}]
+    shutil.rmtree(temp_dir, ignore_errors=True)
+
+    manifest_path = os.path.join(directory, MANIFEST_FILENAME)
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    logging.info(f"Added {len(clips)} clips to library {directory}")
+    return len(clips)
@@ -0,0 +1,175 @@
+import os, json, hashlib, logging, threading
+from fractions import Fraction
+from codebase.cache import CACHE_DIR
+from codebase.ffmpeg_utils import ffprobe
+
+PROBE_CACHE_DIR = os.path.join(CACHE_DIR, "probes")
+PROBE_CACHE_VERSION = 1
+
+# Bytes read from each end of a file to compute its hash
+HASH_SAMPLE_BYTES = 1024**2
+
+class StreamInfo:
+    """ A media stream as reported by ffprobe. Fields that don't apply to the stream type are None. """
+
+    __slots__ = ["index", "codec_type", "codec_name", "duration", "time_base",
+                 "width", "height", "fps", "pix_fmt", "sample_rate", "channels"]
+
+    def __init__(self, stream, format_duration=None):
+        self.index = stream["index"]
+        self.codec_type = stream.get("codec_type")
+        self.codec_name = stream.get("codec_name")
+        self.duration = parse_float(stream.get("duration")) or format_duration
+        self.time_base = stream.get("time_base")
+        self.width = stream.get("width")
+        self.height = stream.get("height")
+        self.fps = parse_rate(stream.get("avg_frame_rate")) or parse_rate(stream.get("r_frame_rate"))
+        self.pix_fmt = stream.get("pix_fmt")
+        self.sample_rate = int(stream["sample_rate"]) if stream.get("sample_rate") else None
+        self.channels = stream.get("channels")
+
+class MediaInfo:
+    """
+    A media file inspected with ffprobe.
+
+    Example:
+        info = probe("./temp/mp4/video_0.mp4")
+        info.video.codec_name, info.video.width, info.video.height, info.video.fps
+        Result: ('h264', 2160, 3840, 25.0)
+    """
+
+    __slots__ = ["filename", "format_name", "duration", "size", "streams"]
+
+    def __init__(self, filename, probe_result):
+        media_format = probe_result.get("format", {})
+        self.filename = filename
+        self.format_name = media_format.get("format_name")
+        self.duration = parse_float(media_format.get("duration"))
+        self.size = int(media_format["size"]) if media_format.get("size") else None
+        self.streams = [StreamInfo(stream, self.duration) for stream in probe_result.get("streams", [])]
+
+    def first_stream(self, codec_type):
+        for stream in self.streams:
+            if stream.codec_type == codec_type:
+                return stream
+        return None
+
+    @property
+    def video(self):
+        return self.first_stream("video")
+
+    @property
+    def audio(self):
+        return self.first_stream("audio")
+
+def parse_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def parse_rate(value):
+    """ Parse an ffprobe rate (e.g. '30000/1001'), None if unknown. """
+    try:
+        rate = Fraction(value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    return float(rate) if rate > 0 else None
+
+def file_hash(filename):
+    """ A fast content hash of a file: its size with its first and last HASH_SAMPLE_BYTES. """
+    size = os.path.getsize(filename)
+    digest = hashlib.sha1(str(size).encode())
+    with open(filename, "rb") as file:
+        digest.update(file.read(HASH_SAMPLE_BYTES))
+        if size > 2 * HASH_SAMPLE_BYTES:
+            file.seek(-HASH_SAMPLE_BYTES, os.SEEK_END)
+            digest.update(file.read(HASH_SAMPLE_BYTES))
+    return digest.hexdigest()
+
+_probes = {}
+_probes_lock = threading.Lock()
+
+def probe(filename):
+    """
+    Inspect a media file, running ffprobe once per file content. Results are cached in memory
+    and on disk under PROBE_CACHE_DIR, by file hash.
+
+    Returns:
+        MediaInfo: The media file information.
+
+    Raises:
+        subprocess.CalledProcessError: If ffprobe fails, e.g. the file isn't a media file.
+    """
+    key = file_hash(filename)
+    with _probes_lock:
+        result = _probes.get(key)
+
+    cache_path = os.path.join(PROBE_CACHE_DIR, key + ".json")
+    if result is None:
+        try:
+            with open(cache_path, "r", encoding="utf-8") as file:
+                entry = json.load(file)
+            if entry.get("version") == PROBE_CACHE_VERSION:
+                result = entry["data"]
+        except (OSError, ValueError):
+            pass
+
+    if result is None:
+        result = ffprobe(filename)
+        try:
+            os.makedirs(PROBE_CACHE_DIR, exist_ok=True)
+            temp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as file:
+                json.dump({"version": PROBE_CACHE_VERSION, "data": result}, file)
+            os.replace(temp_path, cache_path)
+        except OSError as e:
+            logging.error(f"Error: Unable to write probe cache of {filename}. error: {e}")
+
+    with _probes_lock:
+        _probes[key] = result
+    return MediaInfo(filename, result)
+
+def same_video_format(files):
+    """
+    Check if the video streams of files share codec, size, frame rate, time base and pixel format,
+    so they can be joined by the concat demuxer without re-encoding.
+    """
+    formats = set()
+    for filename in files:
+        video = probe(filename).video
+        if video is None:
+            return False
+        formats.add((video.codec_name, video.width, video.height, video.fps, video.time_base, video.pix_fmt))
+    return len(formats) == 1
+
+def inspect_clips(clips, files, size):
+    """
+    Probe downloaded clips and validate them, replacing their reported width, height and duration
+    by the real ones, and adding their 'fps'.
+
+    Parameters:
+        clips (list): Clip dictionaries with at least the keys ['id', 'duration', 'width', 'height'].
+        files (list): The file of each clip.
+        size (int, int): The (width, height) of the video the clips are composed into.
+
+    Raises:
+        Exception: If a file has no video stream or is smaller than size.
+    """
+    for clip, filename in zip(clips, files):
+        video = probe(filename).video
+        if video is None or not video.width or not video.height:
+            error_message = f"Clip {clip['id']} ({os.path.basename(filename)}) has no video stream"
+            logging.error(error_message)
+            raise Exception(error_message)
+        if video.width < size[0] or video.height < size[1]:
+            error_message = f"Clip {clip['id']} of size ({video.width}, {video.height}) is smaller than {tuple(size)}"
+            logging.error(error_message)
+            raise Exception(error_message)
+
+        if (video.width, video.height) != (clip["width"], clip["height"]):
+            logging.info(f"Clip {clip['id']} is {video.width}x{video.height}, reported {clip['width']}x{clip['height']}")
+        clip["width"], clip["height"] = video.width, video.height
+        if video.duration:
+            clip["duration"] = video.duration
+        clip["fps"] = video.fps
@@ -0,0 +1,251 @@
+import json, logging, threading, time, datetime, contextvars
+from contextlib import contextmanager
+
+# resource is only available on unix, CPU time then only covers this process and peak RSS is unknown
+try:
+    import resource
+except ImportError:
+    resource = None
+
+METRICS_LOG_FILE = "./metrics.jsonl"
+
+# Upper bounds of the duration histograms, in seconds
+DURATION_BUCKETS = [0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800]
+
+# Name, type and help of the exported metrics
+EXPORTED_METRICS = {
+    "auto_generator_stage_wall_seconds": ("histogram", "Wall time of the pipeline stages."),
+    "auto_generator_stage_cpu_seconds": ("histogram", "CPU time of the process and its ffmpeg children during the pipeline stages."),
+    "auto_generator_job_wall_seconds": ("histogram", "Wall time of the jobs."),
+    "auto_generator_jobs_total": ("counter", "Jobs finished, by status."),
+    "auto_generator_stages_resumed_total": ("counter", "Stages resumed from their checkpoint instead of run."),
+    "auto_generator_downloaded_bytes_total": ("counter", "Bytes downloaded by the pipeline stages."),
+    "auto_generator_cache_hits_total": ("counter", "Cache hits of the pipeline stages, by cache."),
+    "auto_generator_cache_misses_total": ("counter", "Cache misses of the pipeline stages, by cache."),
+    "auto_generator_peak_rss_bytes": ("gauge", "Peak resident memory of the process or of its largest ffmpeg child."),
+}
+
+def resource_usage():
+    """
+    The CPU time of the process and its waited for children (e.g. ffmpeg), and the peak RSS of the process
+    or its largest child. Both are process wide, so concurrent stages and jobs share them.
+
+    Returns:
+        (float, int): CPU seconds, and peak RSS in bytes or None if unknown.
+    """
+    if resource is None:
+        return time.process_time(), None
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in kilobytes on linux
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime, max(own.ru_maxrss, children.ru_maxrss) * 1024
+
+class Histogram:
+
+    __slots__ = ["counts", "sum", "count"]
+
+    def __init__(self):
+        self.counts = [0] * len(DURATION_BUCKETS)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+class Registry:
+    """ The metrics aggregated over the jobs of the process, exported in the Prometheus text format. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # by (name, labels)
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def observe(self, name, value, **labels):
+        with self.lock:
+            self.histograms.setdefault((name, tuple(sorted(labels.items()))), Histogram()).observe(value)
+
+    def increment(self, name, value=1, **labels):
+        with self.lock:
+            key = (name, tuple(sorted(labels.items())))
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_max(self, name, value, **labels):
+        with self.lock:
+            key = (name, tuple(sorted(labels.items())))
+            self.gauges[key] = max(self.gauges.get(key, value), value)
+
+    def prometheus_text(self):
+        """
+        Export the metrics in the Prometheus text format.
+
+        Example:
+            registry.prometheus_text()
+            Result: '# HELP auto_generator_stage_wall_seconds Wall time of the pipeline stages.\n# TYPE ...'
+        """
+        with self.lock:
+            samples = {}
+            for (name, labels), histogram in self.histograms.items():
+                lines = samples.setdefault(name, [])
+                for bound, count in zip(DURATION_BUCKETS, histogram.counts):
+                    lines += [f"{name}_bucket{format_labels(labels + (('le', bound),))} {count}"]
+                lines += [f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {histogram.count}",
+                          f"{name}_sum{format_labels(labels)} {histogram.sum}",
+                          f"{name}_count{format_labels(labels)} {histogram.count}"]
+            for (name, labels), value in list(self.counters.items()) + list(self.gauges.items()):
+                samples.setdefault(name, []).append(f"{name}{format_labels(labels)} {value}")
+
+        lines = []
+        for name, (metric_type, help_text) in EXPORTED_METRICS.items():
+            if name in samples:
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"] + samples[name]
+        return "\n".join(lines) + "\n"
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    values = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        values += [f'{name}="{value}"']
+    return "{" + ",".join(values) + "}"
+
+registry = Registry()
+
+class StageMetrics:
+    """ What a stage used: counters (e.g. bytes downloaded) and values (e.g. the encode speed). """
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.bytes_downloaded = 0
+        self.cache_hits = {}
+        self.cache_misses = {}
+        self.values = {}
+
+    def add_bytes(self, count):
+        with self.lock:
+            self.bytes_downloaded += count
+
+    def add_cache(self, cache, hit):
+        with self.lock:
+            counts = self.cache_hits if hit else self.cache_misses
+            counts[cache] = counts.get(cache, 0) + 1
+
+# The metrics of the stage running in the current thread. Download and cache code reports to it,
+# threads started by a stage must run in a copy of its context (see contextvars.copy_context)
+current_stage = contextvars.ContextVar("current_stage", default=None)
+
+def add_bytes(count):
+    """ Count downloaded bytes in the metrics of the running stage, if any. """
+    stage = current_stage.get()
+    if stage is not None:
+        stage.add_bytes(count)
+
+def add_cache(cache, hit):
+    """ Count a cache hit or miss in the metrics of the running stage, if any. """
+    stage = current_stage.get()
+    if stage is not None:
+        stage.add_cache(cache, hit)
+
+def set_value(name, value):
+    """ Record a value (e.g. the encode speed) in the metrics of the running stage, if any. """
+    stage = current_stage.get()
+    if stage is not None:
+        stage.values[name] = value
+
+class JobMetrics:
+    """
+    The metrics of a job: one record per stage with its wall time, CPU time, peak RSS, bytes downloaded,
+    cache hits and misses, and one record for the whole job. Records are aggregated in the registry and,
+    with a log file, appended to it as JSON lines.
+
+    Parameters:
+        job (str): The job id.
+        log_file (str, optional): The JSON lines file, e.g. METRICS_LOG_FILE.
+
+    Example:
+        job_metrics = JobMetrics("f3b1c2d4")
+        with job_metrics.measure("download_audio"):
+            download_recitations(links, "./temp/mp3/")
+        job_metrics.finish("completed")
+    """
+
+    # records of concurrent jobs are written one line at a time
+    log_lock = threading.Lock()
+
+    def __init__(self, job, log_file=None):
+        self.job = job
+        self.log_file = log_file
+        self.started = datetime.datetime.now().isoformat()
+        self.sttime = time.time()
+        self.cpu_time, _ = resource_usage()
+        self.stages = []
+
+    @contextmanager
+    def measure(self, name):
+        """ Record the metrics of a stage run inside the context. """
+        stage = StageMetrics(name)
+        token = current_stage.set(stage)
+        sttime = time.time()
+        cpu_time, _ = resource_usage()
+        try:
+            yield stage
+        finally:
+            current_stage.reset(token)
+            end_cpu_time, peak_rss = resource_usage()
+            self.record_stage(stage, time.time() - sttime, end_cpu_time - cpu_time, peak_rss)
+
+    def record_stage(self, stage, wall_time, cpu_time, peak_rss, resumed=False):
+        record = {"job": self.job, "started": self.started, "stage": stage.name, "resumed": resumed,
+                  "wall_time": wall_time, "cpu_time": cpu_time, "peak_rss": peak_rss,
+                  "bytes_downloaded": stage.bytes_downloaded,
+                  "cache_hits": stage.cache_hits, "cache_misses": stage.cache_misses}
+        record.update(stage.values)
+        self.stages += [record]
+
+        if resumed:
+            registry.increment("auto_generator_stages_resumed_total", stage=stage.name)
+        else:
+            registry.observe("auto_generator_stage_wall_seconds", wall_time, stage=stage.name)
+            registry.observe("auto_generator_stage_cpu_seconds", cpu_time, stage=stage.name)
+        if stage.bytes_downloaded:
+            registry.increment("auto_generator_downloaded_bytes_total", stage.bytes_downloaded, stage=stage.name)
+        for cache, count in stage.cache_hits.items():
+            registry.increment("auto_generator_cache_hits_total", count, stage=stage.name, cache=cache)
+        for cache, count in stage.cache_misses.items():
+            registry.increment("auto_generator_cache_misses_total", count, stage=stage.name, cache=cache)
+        if peak_rss is not None:
+            registry.set_max("auto_generator_peak_rss_bytes", peak_rss)
+        self.write(record)
+
+    def resumed(self, name):
+        """ Record a stage resumed from its checkpoint. """
+        self.record_stage(StageMetrics(name), 0, 0, None, resumed=True)
+
+    def finish(self, status):
+        """ Record the whole job, with its status (e.g. 'completed' or 'failed'). """
+        cpu_time, peak_rss = resource_usage()
+        record = {"job": self.job, "started": self.started, "stage": None, "status": status,
+                  "wall_time": time.time() - self.sttime, "cpu_time": cpu_time - self.cpu_time, "peak_rss": peak_rss,
+                  "bytes_downloaded": sum([s["bytes_downloaded"] for s in self.stages]),
+                  "cache_hits": sum([sum(s["cache_hits"].values()) for s in self.stages]),
+                  "cache_misses": sum([sum(s["cache_misses"].values()) for s in self.stages])}
+        registry.observe("auto_generator_job_wall_seconds", record["wall_time"])
+        registry.increment("auto_generator_jobs_total", status=status)
+        self.write(record)
+        return record
+
+    def write(self, record):
+        if not self.log_file:
+            return
+        try:
+            with JobMetrics.log_lock, open(self.log_file, "a", encoding="utf-8") as file:
+                file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logging.error(f"Error: Unable to write metrics to {self.log_file}. error: {e}")
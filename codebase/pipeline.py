@@ -1,22 +1,37 @@
-from codebase import fetch_audio, fetch_video, ffmpeg_utils
+from codebase import fetch_audio
+from codebase.footage import PexelsFootageSource
 from codebase.utils import remove_directory
-from codebase.status import StatusUpdater
+from codebase.status import StatusUpdater, Status
+from codebase.stages import Stage, Checkpoints, run_stages
 from codebase.exceptions import NamedError
 from codebase.composer import compose_video
-import os, time, datetime
+from codebase.media_info import inspect_clips, same_video_format
+from codebase.timeline import Timeline
+from codebase import metrics
+import os, logging
 from enum import Enum
 import json
 
-PERF_LOG_FILE = "./perf.txt"
 GENERATED_FILENAME = "generated.mp4"
+JOB_FILENAME = "job.json"
 
 class Resolution(Enum):
     HD = (1080, 1920)
     SD = (360, 640)
 
-def generate_video(reciter, surah, start, end, directory, hd=False, clean_resources=True, verbose=True, monitor_performance=False):
+class RenderMode(str, Enum):
+    # crop each clip to a file, then compose the cropped files
+    TWO_PASS = "two_pass"
+    # crop each clip inside the compose filter graph, the crop stage does nothing
+    FUSED = "fused"
+    # crop and normalize each clip to a file, then compose the clips joined without re-encoding
+    NORMALIZED = "normalized"
+
+def generate_video(reciter, surah, start, end, directory, hd=False, clean_resources=True, verbose=True, monitor_performance=False, footage_source=None, render_mode=RenderMode.TWO_PASS, render_workers=1, resume=False):
     """
     Generate a video by combining recitations with matching videos based on certain criteria.
+    The stages run as a graph (see stages.run_stages): the videos are selected from an estimate of the
+    recitations duration while the audio is downloaded, then topped up once the exact duration is known.
 
     Parameters:
         reciter (str): Name of the reciter.
@@ -26,7 +41,16 @@ def generate_video(reciter, surah, start, end, directory, hd=False, clean_resour
         hd (bool, optional): If True, generate the video in HD resolution. Default is False (SD resolution).
         clean_resources (bool, optional): If True, clean up temporary resources after video generation. Default is True.
         verbose (bool, optional): If True, print detailed progress information. Default is True.
-        monitor_performance (bool, optional): If True, log performance metrics to a file. Default is False.
+        monitor_performance (bool, optional): If True, append the job and stage metrics to metrics.METRICS_LOG_FILE
+                                              as JSON lines. They are always aggregated in metrics.registry. Default is False.
+        footage_source (FootageSource, optional): Where the background clips come from. Default is pexels.com.
+        render_mode (RenderMode, optional): Whether clips are cropped in their own pass or while composing,
+                                            and whether they are normalized in their own pass.
+                                            Default is RenderMode.TWO_PASS, which fills the clips cache.
+        render_workers (int, optional): If more than 1, compose the video in segments cut at ayat ends, rendering
+                                        this many at once. 0 for all CPU cores. Default is 1 (single pass).
+        resume (bool, optional): If True, and the directory holds a failed job with the same parameters, skip the
+                                 stages it completed (see stages.Checkpoints). Default is False (start over).
 
     Returns:
         None
@@ -38,167 +62,224 @@ def generate_video(reciter, surah, start, end, directory, hd=False, clean_resour
     status_updater = StatusUpdater(directory)
     status_updater.set_status_started()
 
+    # the job parameters, to resume or retry the job (see read_job)
+    job = {"reciter": reciter, "surah": surah, "start": start, "end": end, "hd": hd,
+           "render_mode": RenderMode(render_mode).value, "render_workers": render_workers}
+
     # video settings
-    video_keyword = "aerial landscape"
+    if footage_source is None:
+        footage_source = PexelsFootageSource(normalize= render_mode == RenderMode.NORMALIZED)
     size = Resolution.HD.value if hd else Resolution.SD.value
+    if render_workers == 0:
+        render_workers = os.cpu_count() or 1
 
-    # create a temp directory
+    # create a temp directory, kept to resume the same job
     temp_dir = os.path.join(directory, "generator_temporary")
-    if(os.path.exists(temp_dir)):
+    resume = resume and read_job(directory) == job and os.path.exists(temp_dir)
+    if(os.path.exists(temp_dir) and not resume):
         remove_directory(temp_dir)
     audio_dir = "mp3"
     video_dir = "mp4"
-    captions_filename = "captions.txt"
-    os.mkdir(temp_dir)
+    top_up_video_dir = "mp4_top_up"
+    timeline_filename = "timeline.json"
+    audio_track_filename = "recitation.m4a"
+    checkpoints_dir = "checkpoints"
+    os.makedirs(temp_dir, exist_ok=True)
+    write_job(directory, job)
+    if(verbose and resume): print("Resuming the job\n")
 
-    # create performance file
-    monitor_performance_file = None
-    if monitor_performance:
-        monitor_performance_file = open(PERF_LOG_FILE, "a")
-        monitor_performance_file.write(f"\n(time) {datetime.datetime.now()};")
+    # the metrics of each stage, identified by the job directory
+    job_metrics = metrics.JobMetrics(os.path.basename(os.path.abspath(directory)),
+                                     metrics.METRICS_LOG_FILE if monitor_performance else None)
 
-    # fetch recitations
-    sttime = time.time()
-    status_updater.set_status_fetch_audio()
-    if(verbose): print(status_updater.get_status().value)
+    # audio branch: fetch recitations
+    def fetch_recitations(results):
+        return fetch_audio.get_recitations(reciter, surah, start, end)
 
-    try:
-        audios = fetch_audio.get_recitations(reciter, surah, start, end)
-    except NamedError as e:
-        status_updater.set_status_named_failure(e.args[0])
-        exit(0)
-    except Exception as e:
-        status_updater.set_status_unnamed_failure(str(e))
-        exit(0)
+    # download recitations
+    def download_recitations(results):
+        recitations = results["fetch_audio"]["recitations"]
+        download_timings = []
+        recitations_files = fetch_audio.download_recitations([r["audio_link"] for r in recitations],\
+                                                          os.path.join(temp_dir, audio_dir), verbose,
+                                                          timings= download_timings)
+        metrics.set_value("download_times", {os.path.basename(recitation_file): file_duration
+                                             for recitation_file, file_duration in zip(recitations_files, download_timings)})
+        return recitations_files
 
-    surah_name = audios["surah"]
-    reciter_name = audios["reciter"]
-    recitations = audios["recitations"]
+    # recitations durations
+    def compute_durations(results):
+        recitations = results["fetch_audio"]["recitations"]
+        return fetch_audio.recitations_durations(results["download_audio"], [r["audio_link"] for r in recitations])
 
-    duration =  time.time() - sttime
-    if(verbose): print(f"Took {duration:.2f} s\n")
-    if(monitor_performance): monitor_performance_file.write(f"({status_updater.get_status().value}) {duration};")  
-     
+    # assemble recitations into a single audio track
+    def assemble_audio(results):
+        audio_track = os.path.join(temp_dir, audio_track_filename)
+        return fetch_audio.assemble_recitations(results["download_audio"], results["audio_duration"], audio_track)
 
-    # download recitations
-    sttime = time.time()
-    status_updater.set_status_download_audio()
-    if(verbose): print(status_updater.get_status().value)
-    try:
-        recitations_files = fetch_audio.download_recitations([r["audio_link"] for r in recitations],\
-                                                          os.path.join(temp_dir, audio_dir), verbose)
-    except NamedError as e:
-        status_updater.set_status_named_failure(e.args[0])
-        exit(0)
-    except Exception as e:
-        status_updater.set_status_unnamed_failure(str(e))
-        exit(0)
+    # time the ayat and their captions
+    def generate_captions(results):
+        timeline = Timeline.from_ayat([r["text"] for r in results["fetch_audio"]["recitations"]], results["audio_duration"])
+        # kept with the other resources to debug the caption timings
+        if(not clean_resources): timeline.write(os.path.join(temp_dir, timeline_filename))
+        return timeline
 
-    duration =  time.time() - sttime
-    if(verbose): print(f"Took {duration:.2f} s\n")
-    if(monitor_performance): monitor_performance_file.write(f"({status_updater.get_status().value}) {duration};")    
+    # video branch: fetch videos for an estimate of the recitations duration, the audio isn't downloaded yet
+    def fetch_videos(results):
+        estimated_duration = fetch_audio.estimate_recitations_duration(results["fetch_audio"]["recitations"])
+        metrics.set_value("estimated_duration", estimated_duration)
+        return footage_source.get_clips(estimated_duration, size)
 
-    # recitations captions
-    recitations_captions = [r["text"] for r in recitations]
+    # download videos, the clips are returned with the real size and duration of their files
+    # and the footage source state (e.g. clips already cropped), so they are checkpointed with them
+    def download_videos(results, videos=None, destination=video_dir):
+        videos = [dict(video) for video in (results["fetch_video"] if videos is None else videos)]
+        videos_files = footage_source.download_clips(videos, os.path.join(temp_dir, destination), size, verbose)
+        inspect_clips(videos, videos_files, size)
+        cached = [video["cached"] for video in videos if "cached" in video]
+        if(verbose and cached): print(f"Clips cache: {sum(cached)} hits {len(cached) - sum(cached)} misses")
+        return videos, videos_files
 
-    # recitations durations
-    sttime = time.time()
-    status_updater.set_status_compute_audio_duration()
-    if(verbose): print(status_updater.get_status().value)
-    try:
-        recitations_durations = fetch_audio.recitations_durations(recitations_files)
-    except Exception as e:
-        status_updater.set_status_unnamed_failure(str(e))
-        exit(0)
-    duration =  time.time() - sttime
-    if(verbose): print(f"Took {duration:.2f} s\n")
-    if(monitor_performance): monitor_performance_file.write(f"({status_updater.get_status().value}) {duration};")      
-
-    # generate captions file
-    sttime = time.time()
-    status_updater.set_status_generate_captions()
-    if(verbose): print(status_updater.get_status().value)
-    try:
-        fetch_audio.generate_ayat_caption_file(recitations_captions, recitations_durations, os.path.join(temp_dir, captions_filename))
-    except Exception as e:
-        status_updater.set_status_unnamed_failure(str(e))
-        exit(0)
-    duration =  time.time() - sttime
-    if(verbose): print(f"Took {duration:.2f} s\n")
-    if(monitor_performance): monitor_performance_file.write(f"({status_updater.get_status().value}) {duration};")   
-
-    # fetch videos
-    sttime = time.time()
-    status_updater.set_status_fetch_video()
-    if(verbose): print(status_updater.get_status().value)
-    min_duration = sum(recitations_durations)
-    blacklist = ["animal", "animals", "cow", "dog", "cat", "human", "person", "woman", "women", "couple", "man", "men", "cross", "church", "people", "mother", "daughter", "son", "sister", "brother", "father"]
-    try:
-        videos = fetch_video.get_videos_conditioned(video_keyword, min_duration, blacklist, size)
-    except Exception as e:
-        status_updater.set_status_unnamed_failure(str(e))
-        exit(0)
-    duration =  time.time() - sttime
-    if(verbose): print(f"Took {duration:.2f} s\n")
-    if(monitor_performance): monitor_performance_file.write(f"({status_updater.get_status().value}) {duration};")     
-    
-    # download videos
-    sttime = time.time()
-    status_updater.set_status_download_video()
-    if(verbose): print(status_updater.get_status().value)
-    videos_links = [v["link"] for v in videos]
-    try:
-        videos_files = fetch_video.download_videos(videos_links, os.path.join(temp_dir, video_dir), videos)
-    except Exception as e:
-        status_updater.set_status_unnamed_failure(str(e))
-        exit(0)
-    duration =  time.time() - sttime
-    if(verbose): print(f"Took {duration:.2f} s\n")
-    if(monitor_performance): monitor_performance_file.write(f"({status_updater.get_status().value}) {duration};")       
-
-    # crop videos
-    sttime = time.time()
-    status_updater.set_status_crop_video()
-    if(verbose): print(status_updater.get_status().value)
-    for i, video_file in enumerate(videos_files):
-        width = videos[i]["width"]
-        height = videos[i]["height"]
-        sttime_1 = time.time()
-        if(verbose): print(f"- File {os.path.basename(video_file)}", end=" ")  
-        try:
-            ffmpeg_utils.crop_video(video_file, width, height, size[0], size[1])
-        except Exception as e:
-            status_updater.set_status_unnamed_failure(str(e))
-            exit(0)
-        if(verbose): print(f"{time.time() - sttime_1:.2f} s")
-    duration =  time.time() - sttime
-    if(verbose): print(f"Took {duration:.2f} s\n")
-    if(monitor_performance): monitor_performance_file.write(f"({status_updater.get_status().value}) {duration};")      
+    # crop videos, in the compose filter graph for the fused render mode
+    def crop_videos(results, videos=None, videos_files=None):
+        if videos is None:
+            videos, videos_files = results["download_video"]
+        if(footage_source.pre_cropped):
+            return [None] * len(videos)
+        if(render_mode == RenderMode.FUSED):
+            return footage_source.crop_areas(videos, size)
+        footage_source.prepare_clips(videos, videos_files, size, verbose)
+        return [None] * len(videos)
+
+    # top up the videos when the recitations are longer than estimated
+    def top_up_videos(results):
+        (videos, videos_files), crops = results["download_video"], results["crop_video"]
+        missing_duration = results["generate_captions"].duration - sum([v["duration"] for v in videos])
+        if missing_duration <= 0:
+            return videos, videos_files, crops
+        logging.info(f"Topping up videos with {missing_duration:.2f} s")
+        extra_videos = footage_source.get_clips(missing_duration, size, exclude= [v["id"] for v in videos])
+        extra_videos, extra_files = download_videos(results, extra_videos, top_up_video_dir)
+        extra_crops = crop_videos(results, extra_videos, extra_files)
+        metrics.set_value("top_up_duration", missing_duration)
+        return videos + extra_videos, videos_files + extra_files, crops + extra_crops
 
     # compose video
-    sttime = time.time()
-    status_updater.set_status_compose_video()
-    if(verbose): print(status_updater.get_status().value)
-    try:
-        compose_video(video_dir= os.path.join(temp_dir, video_dir),
-                 audio_dir= os.path.join(temp_dir, audio_dir),
-                 text_file= os.path.join(temp_dir, captions_filename),
-                 title = surah_name,
-                 subtitle = reciter_name,
+    encode_report = {}
+    def compose_progress(report):
+        encode_report.update(report)
+        if report["ratio"] is not None:
+            status_updater.set_stage_progress(report["ratio"], report["eta"])
+
+    def compose(results):
+        audios = results["fetch_audio"]
+        videos, videos_files, crops = results["top_up_video"]
+        if(not any(crops)):
+            crops = None
+        # clips sharing their format (e.g. normalized) are read without the concat filter
+        concat_demuxer = crops is None and same_video_format(videos_files)
+        compose_video(video_files= videos_files,
+                 audio_file= results["assemble_audio"],
+                 timeline= results["generate_captions"],
+                 title = audios["surah"],
+                 subtitle = audios["reciter"],
                  output_file= os.path.join(directory, GENERATED_FILENAME),
                  width= size[0],
                  height= size[1],
-                 hd= hd)
+                 hd= hd,
+                 crops= crops,
+                 clip_durations= [v["duration"] for v in videos],
+                 workers= render_workers,
+                 progress_callback= compose_progress,
+                 concat_demuxer= concat_demuxer)
+        if(verbose): print(f"Encoded at {encode_report.get('fps', 0):.1f} fps, speed {encode_report.get('speed') or 0:.2f}x")
+        metrics.set_value("encode_fps", encode_report.get("fps"))
+        metrics.set_value("encode_speed", encode_report.get("speed"))
+
+    # the audio and video branches run at the same time, they join for the composition
+    stages = [
+        Stage("fetch_audio", fetch_recitations, status= Status.FETCH_AUDIO),
+        Stage("download_audio", download_recitations, after= ["fetch_audio"], status= Status.DOWNLOAD_AUDIO,
+              outputs= lambda results: results["download_audio"]),
+        Stage("audio_duration", compute_durations, after= ["download_audio"], status= Status.AUDIO_DURATION),
+        Stage("assemble_audio", assemble_audio, after= ["audio_duration"], status= Status.ASSEMBLE_AUDIO,
+              outputs= lambda results: [results["assemble_audio"]]),
+        Stage("generate_captions", generate_captions, after= ["audio_duration"], status= Status.GENERATE_CAPTIONS,
+              encode= Timeline.to_json, decode= Timeline.from_json),
+        Stage("fetch_video", fetch_videos, after= ["fetch_audio"], status= Status.FETCH_VIDEO),
+        Stage("download_video", download_videos, after= ["fetch_video"], status= Status.DOWNLOAD_VIDEO,
+              outputs= lambda results: results["download_video"][1]),
+        # clips are cropped in place
+        Stage("crop_video", crop_videos, after= ["download_video"], status= Status.CROP_VIDEOS,
+              outputs= lambda results: results["download_video"][1]),
+        Stage("top_up_video", top_up_videos, after= ["crop_video", "generate_captions"],
+              outputs= lambda results: results["top_up_video"][1]),
+        Stage("compose_video", compose, after= ["assemble_audio", "top_up_video"], status= Status.COMPOSE_VIDEO,
+              outputs= lambda results: [os.path.join(directory, GENERATED_FILENAME)]),
+    ]
+
+    # measured in the thread running the stage, so its downloads and cache hits are counted in its metrics
+    def measured(name, run):
+        def measured_run(results):
+            with job_metrics.measure(name):
+                return run(results)
+        return measured_run
+
+    for stage in stages:
+        stage.run = measured(stage.name, stage.run)
+
+    def stage_started(stage):
+        if(stage.status is None):
+            return
+        status_updater.set_status_stage(stage.status)
+        if(verbose): print(stage.status.value)
+
+    def stage_done(stage, duration):
+        name = stage.status.value if stage.status else stage.name
+        if(verbose): print(f"{name} took {duration:.2f} s\n")
+
+    def stage_resumed(stage):
+        if(stage.status is not None):
+            status_updater.set_status_stage(stage.status)
+        name = stage.status.value if stage.status else stage.name
+        if(verbose): print(f"{name} resumed\n")
+        job_metrics.resumed(stage.name)
+
+    try:
+        checkpoints = Checkpoints(os.path.join(temp_dir, checkpoints_dir), resume)
+        run_stages(stages, on_start= stage_started, on_end= stage_done, checkpoints= checkpoints, on_resume= stage_resumed)
+    except NamedError as e:
+        job_metrics.finish("failed")
+        status_updater.set_status_named_failure(e.args[0])
+        exit(0)
     except Exception as e:
+        job_metrics.finish("failed")
         status_updater.set_status_unnamed_failure(str(e))
         exit(0)
-    duration =  time.time() - sttime
-    if(verbose): print(f"Took {duration:.2f} s\n")
-    if(monitor_performance): monitor_performance_file.write(f"({status_updater.get_status().value}) {duration};")    
 
     if(clean_resources):
         remove_directory(temp_dir)
 
-    if(monitor_performance): monitor_performance_file.close()
-
+    job_metrics.finish("completed")
     status_updater.set_status_completed()
+
+def write_job(directory, job):
+    with open(os.path.join(directory, JOB_FILENAME), "w", encoding="utf-8") as file:
+        json.dump(job, file)
+
+def read_job(directory):
+    """
+    Read the parameters of the job generated in a directory, see generate_video.
+
+    Returns:
+        dict: The job parameters ['reciter', 'surah', 'start', 'end', 'hd', 'render_mode', 'render_workers'],
+              or None if no job was generated in the directory.
+
+    Example:
+        generate_video(**read_job(directory), directory=directory, resume=True)
+    """
+    try:
+        with open(os.path.join(directory, JOB_FILENAME), "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,160 @@
+import os, mmap, struct, logging, threading, time
+from codebase.utils import request_json
+from codebase.cache import CACHE_DIR
+
+# Index layout (little endian):
+#   header:  magic (4s), version (H), number of surahs (H), number of ayat (I)
+#   surahs:  number of surahs x (aya_base (I), n_aya (I))
+#   offsets: (number of ayat + 1) x (I), byte offsets of each ayah inside the text block
+#   text:    utf-8 text of all ayat, one after the other
+MAGIC = b"QIDX"
+VERSION = 1
+HEADER = struct.Struct("<4sHHI")
+SURAH = struct.Struct("<II")
+OFFSET = struct.Struct("<I")
+
+EDITION = "quran-uthmani"
+INDEX_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "resources", "quran", f"{EDITION}.idx")
+# Built on first use when the bundled index is missing or of another version
+CACHED_INDEX_FILE = os.path.join(CACHE_DIR, "quran", f"{EDITION}.idx")
+# Seconds before building the index is tried again after a failure
+BUILD_RETRY_INTERVAL = 10*60
+
+class QuranIndex:
+    """
+    A memory-mapped index of all ayat texts and surah offsets.
+
+    Parameters:
+        filename (str): Path to an index file written by write_index().
+
+    Example:
+        index = QuranIndex("resources/quran/quran-uthmani.idx")
+        index.ayah_text(1)
+        Result: 'بِسۡمِ ٱللَّهِ ٱلرَّحۡمَـٰنِ ٱلرَّحِیمِ'
+        index.surah(2)
+        Result: {'id': 2, 'aya_base': 7, 'n_aya': 286}
+    """
+
+    def __init__(self, filename):
+        with open(filename, "rb") as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.n_surahs, self.n_ayat = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            self.buffer.close()
+            raise Exception(f"Unsupported quran index file {filename}")
+
+        self.surahs_position = HEADER.size
+        self.offsets_position = self.surahs_position + self.n_surahs * SURAH.size
+        self.text_position = self.offsets_position + (self.n_ayat + 1) * OFFSET.size
+
+    def surah(self, surah_number):
+        """ Get the offsets of a surah given its id (1 based). """
+        if not 1 <= surah_number <= self.n_surahs:
+            raise IndexError(f"Surah id ({surah_number}) should be between (1, {self.n_surahs})")
+        aya_base, n_aya = SURAH.unpack_from(self.buffer, self.surahs_position + (surah_number-1) * SURAH.size)
+        return {"id": surah_number, "aya_base": aya_base, "n_aya": n_aya}
+
+    def ayah_text(self, aya_number):
+        """ Get the text of an ayah given its number out of all Quran verses (1 based). """
+        if not 1 <= aya_number <= self.n_ayat:
+            raise IndexError(f"Aya number ({aya_number}) should be between (1, {self.n_ayat})")
+        start, end = struct.unpack_from("<II", self.buffer, self.offsets_position + (aya_number-1) * OFFSET.size)
+        return self.buffer[self.text_position + start: self.text_position + end].decode("utf-8")
+
+    def close(self):
+        self.buffer.close()
+
+def write_index(surahs, ayat_texts, filename):
+    """
+    Write a quran index file.
+
+    Parameters:
+        surahs (list): A list of (aya_base, n_aya) tuples ordered by surah id.
+        ayat_texts (list): Texts of all ayat ordered by their number out of all Quran verses.
+        filename (str): Destination of the index file.
+    """
+    encoded = [text.encode("utf-8") for text in ayat_texts]
+    offsets = [0]
+    for text in encoded:
+        offsets += [offsets[-1] + len(text)]
+
+    temp_filename = filename + ".tmp"
+    with open(temp_filename, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(surahs), len(ayat_texts)))
+        for aya_base, n_aya in surahs:
+            file.write(SURAH.pack(aya_base, n_aya))
+        file.write(struct.pack(f"<{len(offsets)}I", *offsets))
+        for text in encoded:
+            file.write(text)
+    os.replace(temp_filename, filename)
+
+def build_index(filename=INDEX_FILE, edition=EDITION):
+    """
+    Rebuild the quran index from the Islamic Network API.
+
+    Parameters:
+        filename (str, optional): Destination of the index file. Default is the bundled index.
+        edition (str, optional): The text edition to index. Default is EDITION.
+
+    Raises:
+        Exception: If there is an issue fetching the quran text.
+    """
+    logging.info(f"Building quran index of edition {edition}")
+    content = request_json(f"https://api.alquran.cloud/v1/quran/{edition}")
+    if(not content):
+        raise Exception(f"Problem fetching quran edition {edition}")
+
+    surahs = []
+    ayat_texts = []
+    for surah in content["data"]["surahs"]:
+        surahs += [(len(ayat_texts), len(surah["ayahs"]))]
+        for ayah in surah["ayahs"]:
+            if ayah["number"] != len(ayat_texts) + 1:
+                raise Exception(f"Unexpected aya number {ayah['number']} in surah {surah['number']}")
+            ayat_texts += [ayah["text"]]
+
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    write_index(surahs, ayat_texts, filename)
+    logging.info(f"Quran index written to {filename}: {len(surahs)} surahs, {len(ayat_texts)} ayat")
+
+_index = None
+_index_failed_at = None
+_index_lock = threading.Lock()
+
+def open_index():
+    """
+    Open the bundled index, or the index in CACHED_INDEX_FILE when the bundled one is missing or unreadable
+    (e.g. of another version), building it there first with a single request of the whole edition.
+    """
+    if os.path.exists(INDEX_FILE):
+        try:
+            return QuranIndex(INDEX_FILE)
+        except Exception as e:
+            logging.error(f"Error: Unable to open the bundled quran index {INDEX_FILE}. error: {e}")
+    if os.path.exists(CACHED_INDEX_FILE):
+        try:
+            return QuranIndex(CACHED_INDEX_FILE)
+        except Exception as e:
+            logging.error(f"Error: Unable to open quran index {CACHED_INDEX_FILE}, rebuilding it. error: {e}")
+    build_index(CACHED_INDEX_FILE)
+    return QuranIndex(CACHED_INDEX_FILE)
+
+def get_index():
+    """
+    Get the quran index, opened once per process, see open_index.
+
+    Returns:
+        QuranIndex: The index or None if it can't be opened nor built, e.g. the API is unreachable.
+    """
+    global _index, _index_failed_at
+    if _index is None:
+        with _index_lock:
+            if _index is None and (_index_failed_at is None or time.time() - _index_failed_at > BUILD_RETRY_INTERVAL):
+                try:
+                    _index = open_index()
+                    _index_failed_at = None
+                except Exception as e:
+                    logging.error(f"Error: Unable to build quran index {CACHED_INDEX_FILE}. error: {e}")
+                    _index_failed_at = time.time()
+    return _index
@@ -0,0 +1,184 @@
+import os, json, hashlib, logging, time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+CHECKPOINT_VERSION = 3
+HASH_CHUNK_SIZE = 1024*1024
+
+def content_hash(filename):
+    """ The sha1 of the whole content of a file, read chunk by chunk. """
+    digest = hashlib.sha1()
+    with open(filename, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class Stage:
+    """
+    A step of a job, run once the stages it depends on are done.
+
+    Parameters:
+        name (str): The stage name, its result is stored under it.
+        run (callable): Called with the results of the stages done so far, returns the stage result.
+        after (list, optional): The names of the stages it depends on.
+        status (Status, optional): The job status while the stage runs.
+        outputs (callable, optional): Called with the results once the stage is done, returns the files
+                                      the stage wrote. Their content hashes are checked before the stage is resumed.
+        encode (callable, optional): Converts the stage result to JSON for its checkpoint.
+        decode (callable, optional): Converts the JSON of a checkpoint back to the stage result.
+    """
+
+    __slots__ = ["name", "run", "after", "status", "outputs", "encode", "decode"]
+
+    def __init__(self, name, run, after=(), status=None, outputs=None, encode=None, decode=None):
+        self.name = name
+        self.run = run
+        self.after = tuple(after)
+        self.status = status
+        self.outputs = outputs
+        self.encode = encode
+        self.decode = decode
+
+class Checkpoints:
+    """
+    The manifests of the stages done in a job directory: the stage result, the content hash of each file it wrote
+    and the checkpoints of the stages it depends on. A stage is resumed from its manifest only if the
+    stages it depends on were resumed from the same manifests and its files still hold the content it
+    left, or the content a later stage left (e.g. clips cropped in place).
+
+    Parameters:
+        directory (str): Where the manifests are written, created if missing.
+        resume (bool, optional): If False, previous manifests are ignored and removed.
+    """
+
+    def __init__(self, directory, resume=True):
+        self.directory = directory
+        self.manifests = {}
+        if not resume and os.path.exists(directory):
+            for filename in os.listdir(directory):
+                os.remove(os.path.join(directory, filename))
+        os.makedirs(directory, exist_ok=True)
+
+        for filename in os.listdir(directory):
+            if not filename.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(directory, filename), "r", encoding="utf-8") as file:
+                    manifest = json.load(file)
+            except (OSError, ValueError):
+                continue
+            if manifest.get("version") == CHECKPOINT_VERSION:
+                self.manifests[filename[:-len(".json")]] = manifest
+        self.sequence = max([m["sequence"] for m in self.manifests.values()], default=0)
+
+        # the hash of each file as left by the last stage that wrote it
+        self.file_hashes = {}
+        for manifest in sorted(self.manifests.values(), key=lambda m: m["sequence"]):
+            self.file_hashes.update(manifest["files"])
+
+    def load(self, stage, resumed):
+        """
+        Find if a stage can be resumed.
+
+        Parameters:
+            stage (Stage): The stage.
+            resumed (dict): The manifest sequence of each stage resumed so far, by name.
+
+        Returns:
+            (bool, object): Whether the stage can be resumed, and its result.
+        """
+        manifest = self.manifests.get(stage.name)
+        if manifest is None or manifest["after"] != {name: resumed.get(name) for name in stage.after}:
+            return False, None
+        for filename in manifest["files"]:
+            if not os.path.exists(filename) or content_hash(filename) != self.file_hashes[filename]:
+                logging.info(f"Stage {stage.name} output {filename} changed since its checkpoint")
+                return False, None
+        result = manifest["result"]
+        return True, stage.decode(result) if stage.decode else result
+
+    def save(self, stage, results, resumed):
+        """ Write the manifest of a stage that is done, see load. Returns its sequence. """
+        self.sequence += 1
+        files = {filename: content_hash(filename) for filename in (stage.outputs(results) if stage.outputs else [])}
+        result = results[stage.name]
+        manifest = {"version": CHECKPOINT_VERSION,
+                    "sequence": self.sequence,
+                    "after": {name: resumed.get(name) for name in stage.after},
+                    "files": files,
+                    "result": stage.encode(result) if stage.encode else result}
+
+        path = os.path.join(self.directory, stage.name + ".json")
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump(manifest, file, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+        self.manifests[stage.name] = manifest
+        self.file_hashes.update(files)
+        return self.sequence
+
+def run_stages(stages, on_start=None, on_end=None, checkpoints=None, on_resume=None):
+    """
+    Run stages as soon as their dependencies are done, independent stages running at the same time.
+    When a stage fails, no other stage is started and its exception is raised once the running stages end.
+
+    Parameters:
+        stages (list): The stages, see Stage.
+        on_start (callable, optional): Called with each stage when it starts.
+        on_end (callable, optional): Called with each stage and its duration in seconds when it is done.
+        checkpoints (Checkpoints, optional): Where the stages are saved when done, and resumed from.
+        on_resume (callable, optional): Called with each stage resumed from its checkpoint instead of run.
+
+    Returns:
+        dict: The result of each stage, by name.
+
+    Raises:
+        Exception: If a dependency is missing or circular, or any exception of a stage.
+
+    Example:
+        run_stages([Stage("audio", fetch_audio), Stage("video", fetch_video),
+                    Stage("compose", compose, after=["audio", "video"])])
+        Result: {'audio': ..., 'video': ..., 'compose': ...}
+    """
+    pending = list(stages)
+    results = {}
+    # the checkpoint sequence of each stage done, stages depending on it are resumed from the same checkpoint only
+    sequences = {}
+
+    def run(stage):
+        sttime = time.time()
+        result = stage.run(results)
+        return result, time.time() - sttime
+
+    with ThreadPoolExecutor(max_workers=len(pending) or 1) as executor:
+        running = {}
+        while pending or running:
+            ready = [stage for stage in pending if all([name in results for name in stage.after])]
+            for stage in ready:
+                pending.remove(stage)
+                resumable, result = checkpoints.load(stage, sequences) if checkpoints else (False, None)
+                if resumable:
+                    logging.info(f"Resuming stage {stage.name} from its checkpoint")
+                    results[stage.name] = result
+                    sequences[stage.name] = checkpoints.manifests[stage.name]["sequence"]
+                    if on_resume: on_resume(stage)
+                    continue
+                logging.info(f"Starting stage {stage.name}")
+                if on_start: on_start(stage)
+                running[executor.submit(run, stage)] = stage
+
+            if not running:
+                if ready:
+                    continue
+                error_message = f"Stages {[stage.name for stage in pending]} have missing or circular dependencies"
+                logging.error(error_message)
+                raise Exception(error_message)
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                result, duration = future.result()
+                logging.info(f"Stage {stage.name} took {duration:.2f} s")
+                results[stage.name] = result
+                if checkpoints:
+                    sequences[stage.name] = checkpoints.save(stage, results, sequences)
+                if on_end: on_end(stage, duration)
+    return results
@@ -12,6 +12,7 @@ class Status(Enum):
     FETCH_AUDIO = "Fetching Audio"
     DOWNLOAD_AUDIO = "Downloading Audio"
     AUDIO_DURATION = "Computing Audio Duration"
+    ASSEMBLE_AUDIO = "Assembling Audio"
     GENERATE_CAPTIONS = "Generating Captions"
     FETCH_VIDEO =  "Fetching Video"
     DOWNLOAD_VIDEO =  "Downloading Video"
@@ -26,6 +27,7 @@ status_progress_dict = {
    Status.FETCH_AUDIO: 10,
    Status.DOWNLOAD_AUDIO: 20,
    Status.AUDIO_DURATION: 30,
+   Status.ASSEMBLE_AUDIO: 35,
    Status.GENERATE_CAPTIONS: 40,
    Status.FETCH_VIDEO: 50,
    Status.DOWNLOAD_VIDEO: 60,
@@ -66,62 +68,28 @@ class StatusUpdater:
                   "progress": status_progress_dict[self.status],
                   "message": ""}, file)
     
-    def set_status_fetch_audio(self):
-       self.status = Status.FETCH_AUDIO
+    def set_status_stage(self, status):
+       """ Set the status of a starting stage, unless a later stage already started (e.g. audio and video stages overlap). """
+       if self.status is not None and status_progress_dict[status] <= status_progress_dict[self.status]:
+          return
+       self.status = status
        with open(self.status_file_path, "w") as file:
          json.dump({"status": self.status.value,
                   "progress": status_progress_dict[self.status],
                   "message": ""}, file)
 
-    def set_status_download_audio(self):
-       self.status = Status.FETCH_AUDIO
-       with open(self.status_file_path, "w") as file:
-         json.dump({"status": self.status.value,
-                  "progress": status_progress_dict[self.status],
-                  "message": ""}, file)
-    
-    def set_status_compute_audio_duration(self):
-       self.status = Status.AUDIO_DURATION
-       with open(self.status_file_path, "w") as file:
-         json.dump({"status": self.status.value,
-                  "progress": status_progress_dict[self.status],
-                  "message": ""}, file)
-       
-    def set_status_generate_captions(self):
-       self.status = Status.GENERATE_CAPTIONS
-       with open(self.status_file_path, "w") as file:
-         json.dump({"status": self.status.value,
-                  "progress": status_progress_dict[self.status],
-                  "message": ""}, file)  
-    
-    def set_status_fetch_video(self):
-       self.status = Status.FETCH_VIDEO
-       with open(self.status_file_path, "w") as file:
+    def set_stage_progress(self, ratio, eta=None):
+       """ Report the progress (0 to 1) of the current stage, interpolated up to the next stage, and its ETA in seconds. """
+       stage_progress = status_progress_dict[self.status]
+       next_progress = min([p for p in status_progress_dict.values() if p > stage_progress], default=stage_progress)
+       # written often while the status is being read, so replaced atomically
+       with open(self.status_file_path + ".tmp", "w") as file:
          json.dump({"status": self.status.value,
-                  "progress": status_progress_dict[self.status],
-                  "message": ""}, file)   
+                  "progress": round(stage_progress + ratio * (next_progress - stage_progress), 1),
+                  "message": "",
+                  "eta": None if eta is None else round(eta)}, file)
+       os.replace(self.status_file_path + ".tmp", self.status_file_path)
 
-    def set_status_download_video(self):
-       self.status = Status.DOWNLOAD_VIDEO
-       with open(self.status_file_path, "w") as file:
-         json.dump({"status": self.status.value,
-                  "progress": status_progress_dict[self.status],
-                  "message": ""}, file)   
-
-    def set_status_crop_video(self):
-       self.status = Status.CROP_VIDEOS
-       with open(self.status_file_path, "w") as file:
-         json.dump({"status": self.status.value,
-                  "progress": status_progress_dict[self.status],
-                  "message": ""}, file)
-       
-    def set_status_compose_video(self):
-       self.status = Status.COMPOSE_VIDEO
-       with open(self.status_file_path, "w") as file:
-         json.dump({"status": self.status.value,
-                  "progress": status_progress_dict[self.status],
-                  "message": ""}, file)
-         
     def set_status_completed(self):
        self.status = Status.COMPLETED
        with open(self.status_file_path, "w") as file:
@@ -0,0 +1,182 @@
+import os, struct, functools
+
+FONT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "resources", "font", "amiri.ttf")
+FONT_NAME = "Amiri"
+
+STYLE_FORMAT = ["Name", "Fontname", "Fontsize", "PrimaryColour", "SecondaryColour", "OutlineColour", "BackColour",
+                "Bold", "Italic", "Underline", "StrikeOut", "ScaleX", "ScaleY", "Spacing", "Angle", "BorderStyle",
+                "Outline", "Shadow", "Alignment", "MarginL", "MarginR", "MarginV", "Encoding"]
+EVENT_FORMAT = ["Layer", "Start", "End", "Style", "Name", "MarginL", "MarginR", "MarginV", "Effect", "Text"]
+
+# ASS numpad alignments
+ALIGN_TOP_CENTER = 8
+ALIGN_MIDDLE_CENTER = 5
+
+# Where drawtext puts Arabic text of the Amiri font relative to its baseline, in em: the top of
+# its tallest letters (alef, lam) and the middle of a vocalized ayah, to place the ASS texts alike
+TEXT_TOP = 0.7
+TEXT_MIDDLE = 0.3
+
+@functools.lru_cache(maxsize=None)
+def font_metrics(font_file=FONT_FILE):
+    """
+    The units per em and the win ascent and descent (OS/2 table) of a TrueType font.
+
+    Example:
+        font_metrics()
+        Result: (2048, 3814, 1810)
+    """
+    with open(font_file, "rb") as file:
+        data = file.read()
+    n_tables, = struct.unpack_from(">H", data, 4)
+    tables = {}
+    for i in range(n_tables):
+        tag, _, offset, _ = struct.unpack_from(">4sIII", data, 12 + 16 * i)
+        tables[tag] = offset
+    units_per_em, = struct.unpack_from(">H", data, tables[b"head"] + 18)
+    win_ascent, win_descent = struct.unpack_from(">HH", data, tables[b"OS/2"] + 74)
+    return units_per_em, win_ascent, win_descent
+
+def font_size_scale(font_file=FONT_FILE):
+    """
+    The ASS font size of a font per unit of drawtext font size. drawtext sets the em size of the font
+    to its font size, while libass fits the win ascent and descent of the font in it.
+
+    Example:
+        font_size_scale()
+        Result: 2.74609375
+    """
+    units_per_em, win_ascent, win_descent = font_metrics(font_file)
+    return (win_ascent + win_descent) / units_per_em
+
+def ass_position(text_style):
+    """
+    The ASS anchor point of a text laid out by text_layout. libass aligns the line box of the font,
+    from its win ascent to its win descent, where drawtext aligns the glyphs.
+    """
+    units_per_em, win_ascent, win_descent = font_metrics()
+    if text_style["alignment"] == ALIGN_TOP_CENTER:
+        offset = TEXT_TOP - win_ascent / units_per_em
+    else:
+        offset = TEXT_MIDDLE - (win_ascent - win_descent) / 2 / units_per_em
+    return text_style["x"], round(text_style["y"] + offset * text_style["fontsize"], 1)
+
+def text_layout(width, height, hd):
+    """
+    The font sizes and positions of the captions, title and subtitle, as drawtext font sizes and
+    positions: the top of the title and subtitle, and the middle of the captions, are at y.
+    See font_size_scale and ass_position for their ASS equivalent.
+
+    Returns:
+        dict: For each of 'caption', 'title' and 'subtitle', a dictionary with keys
+              ['fontsize', 'alignment', 'x', 'y'], where (x, y) is the anchor point of the text.
+    """
+    h1_fontsize = 100 if hd else 33
+    h2_fontsize = 30 if hd else 11
+    return {
+        "caption": {"fontsize": h1_fontsize, "alignment": ALIGN_MIDDLE_CENTER,
+                    "x": width // 2, "y": height // 2 + (100 if hd else 33)},
+        "title": {"fontsize": h1_fontsize, "alignment": ALIGN_TOP_CENTER,
+                  "x": width // 2, "y": 100 if hd else 33},
+        "subtitle": {"fontsize": h2_fontsize, "alignment": ALIGN_TOP_CENTER,
+                     "x": width // 2, "y": 300 if hd else 99},
+    }
+
+def ass_time(seconds):
+    """ Format seconds as an ASS timestamp (H:MM:SS.cc). """
+    centiseconds = int(round(max(0, seconds) * 100))
+    hours, centiseconds = divmod(centiseconds, 360000)
+    minutes, centiseconds = divmod(centiseconds, 6000)
+    seconds, centiseconds = divmod(centiseconds, 100)
+    return f"{hours}:{minutes:02d}:{seconds:02d}.{centiseconds:02d}"
+
+def ass_text(text):
+    """ Make a text safe for an ASS dialogue line: one line, no override blocks. """
+    text = " ".join(str(text).split())
+    return text.replace("{", "(").replace("}", ")")
+
+def ass_style(name, fontsize, alignment):
+    """ The style of a text with the drawtext font size fontsize. """
+    values = [name, FONT_NAME, round(fontsize * font_size_scale(), 2), "&H00FFFFFF", "&H00FFFFFF", "&H00000000", "&H00000000",
+              0, 0, 0, 0, 100, 100, 0, 0, 1, 0, 0, alignment, 0, 0, 0, 1]
+    return "Style: " + ",".join([str(value) for value in values])
+
+def ass_dialogue(style, start_time, end_time, x, y, text):
+    values = [0, ass_time(start_time), ass_time(end_time), style, "", 0, 0, 0, "", f"{{\\pos({x},{y})}}{ass_text(text)}"]
+    return "Dialogue: " + ",".join([str(value) for value in values])
+
+def write_ass(captions_with_time, width, height, hd, filename, title=None, subtitle=None, duration=None):
+    """
+    Write the captions, and optionally the title and subtitle, to an ASS subtitle file rendered
+    with the Amiri font at the same sizes and positions as the drawtext filters it replaces.
+
+    Parameters:
+        captions_with_time (list): List of timed captions (see timeline.TimedText).
+        width (int): Width of the video.
+        height (int): Height of the video.
+        hd (bool): If True, use HD settings for font size. If False, use SD settings.
+        filename (str): Destination of the subtitle file.
+        title (str, optional): Title on top of the video during the whole duration.
+        subtitle (str, optional): Text under the title during the whole duration.
+        duration (float, optional): Duration of the title and subtitle. Default is the end of the last caption.
+
+    Returns:
+        filename (str): The subtitle file path.
+
+    Example:
+        write_ass([TimedText(0, 5, "Caption 1")], 1080, 1920, True, "./temp/captions.ass",
+                  title="Surah Al-Fatihah", subtitle="Mishary Alafasy")
+    """
+    layout = text_layout(width, height, hd)
+    if duration is None:
+        duration = captions_with_time[-1].end_time if captions_with_time else 0
+
+    lines = ["[Script Info]",
+             "ScriptType: v4.00+",
+             f"PlayResX: {width}",
+             f"PlayResY: {height}",
+             "WrapStyle: 2",
+             "ScaledBorderAndShadow: yes",
+             "",
+             "[V4+ Styles]",
+             "Format: " + ", ".join(STYLE_FORMAT)]
+    for name in ["caption", "title", "subtitle"]:
+        lines += [ass_style(name.capitalize(), layout[name]["fontsize"], layout[name]["alignment"])]
+
+    lines += ["",
+              "[Events]",
+              "Format: " + ", ".join(EVENT_FORMAT)]
+    for name, text in [("title", title), ("subtitle", subtitle)]:
+        if text:
+            lines += [ass_dialogue(name.capitalize(), 0, duration, *ass_position(layout[name]), text)]
+    caption_x, caption_y = ass_position(layout["caption"])
+    for timed_text in captions_with_time:
+        lines += [ass_dialogue("Caption", timed_text.start_time, timed_text.end_time,
+                               caption_x, caption_y, timed_text.text)]
+
+    with open(filename, "w", encoding="utf-8") as file:
+        file.write("\n".join(lines) + "\n")
+    return filename
+
+def escape_characters(value, characters):
+    """ Prefix each of the characters in value with a backslash, backslashes first. """
+    for character in "\\" + characters.replace("\\", ""):
+        value = value.replace(character, "\\" + character)
+    return value
+
+def escape_filter_value(value):
+    """
+    Escape a value (e.g. a path) for a filter option inside a filter graph. ffmpeg unescapes it twice:
+    once when it splits the graph in filters, then when it splits the filter arguments in options.
+
+    Example:
+        escape_filter_value("it's a:b.ass")
+        Result: "it\\\\\\'s a\\\\:b.ass"
+    """
+    value = escape_characters(value.replace("\\", "/"), "':")
+    return escape_characters(value, "'[],;")
+
+def ass_filter(filename, font_file=FONT_FILE):
+    """ The filter burning an ASS subtitle file in, with fonts loaded from the directory of font_file. """
+    fonts_dir = os.path.dirname(font_file) or "."
+    return f"ass=filename={escape_filter_value(filename)}:fontsdir={escape_filter_value(fonts_dir)}"
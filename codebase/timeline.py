@@ -0,0 +1,129 @@
+import json
+
+# Words shown at once in a caption
+WORDS_PER_VIEW = 5
+
+class TimedText:
+    """ A text shown from start_time to end_time, in seconds. """
+
+    __slots__ = ["start_time", "end_time", "text"]
+
+    def __init__(self, start_time, end_time, text):
+        self.start_time = start_time
+        self.end_time = end_time
+        self.text = text
+
+    @property
+    def duration(self):
+        return self.end_time - self.start_time
+
+    def shifted(self, start, end):
+        """ The part of the text shown between start and end, timed from start, or None if it isn't shown. """
+        start_time, end_time = max(start, self.start_time), min(end, self.end_time)
+        if end_time - start_time <= 0.01:
+            return None
+        return TimedText(start_time - start, end_time - start, self.text)
+
+    def __repr__(self):
+        return f"TimedText({self.start_time!r}, {self.end_time!r}, {self.text!r})"
+
+def split_words(ayah, words_per_view=WORDS_PER_VIEW):
+    """
+    Split an ayah into captions of at most words_per_view words, sharing its duration
+    in proportion to the number of characters of their words.
+
+    Example:
+        split_words(TimedText(0, 4, "ab abc a ab"), 2)
+        Result: [TimedText(0, 2.5, 'ab abc'), TimedText(2.5, 4.0, 'a ab')]
+    """
+    words = ayah.text.split()
+    if not words:
+        return [TimedText(ayah.start_time, ayah.end_time, "")]
+
+    # a word with no characters still takes some time, e.g. a lone mark
+    weights = [max(len(word), 1) for word in words]
+    duration_per_weight = ayah.duration / sum(weights)
+    chunks = []
+    start_time = ayah.start_time
+    for i in range(0, len(words), words_per_view):
+        end_time = start_time + sum(weights[i:i + words_per_view]) * duration_per_weight
+        chunks += [TimedText(start_time, end_time, " ".join(words[i:i + words_per_view]))]
+        start_time = end_time
+    # the last caption ends with the ayah, without rounding errors
+    chunks[-1].end_time = ayah.end_time
+    return chunks
+
+class Timeline:
+    """
+    The ayat of a recitation timed on its audio track, and the captions they are shown as.
+    It is built once from the recitations and drives the captions, the segment boundaries
+    and the duration of the video.
+
+    Example:
+        timeline = Timeline.from_ayat(["بسم الله الرحمن الرحيم", ...], [3.44, ...])
+        timeline.duration, timeline.ayat_end_times()
+        Result: (10.186, [3.44, ...])
+    """
+
+    __slots__ = ["ayat", "chunks"]
+
+    def __init__(self, ayat, chunks=None, words_per_view=WORDS_PER_VIEW):
+        self.ayat = list(ayat)
+        if chunks is None:
+            chunks = [chunk for ayah in self.ayat for chunk in split_words(ayah, words_per_view)]
+        self.chunks = list(chunks)
+
+    @classmethod
+    def from_ayat(cls, ayat_texts, ayat_durations, words_per_view=WORDS_PER_VIEW):
+        """
+        Time the ayat one after the other.
+
+        Parameters:
+            ayat_texts (list): Array of ayat Arabic text.
+            ayat_durations (list): Array of ayat recitation durations, see fetch_audio.recitations_durations.
+            words_per_view (int, optional): Words shown at once in a caption.
+
+        Raises:
+            Exception: If the arrays are not of the same size.
+        """
+        if len(ayat_texts) != len(ayat_durations):
+            raise Exception("Both ayat texts and durations arrays should be of the same size")
+
+        ayat = []
+        start_time = 0
+        for text, duration in zip(ayat_texts, ayat_durations):
+            ayat += [TimedText(start_time, start_time + duration, text)]
+            start_time += duration
+        return cls(ayat, words_per_view=words_per_view)
+
+    @property
+    def duration(self):
+        return self.ayat[-1].end_time if self.ayat else 0
+
+    def ayat_end_times(self):
+        return [ayah.end_time for ayah in self.ayat]
+
+    def captions_between(self, start, end):
+        """ The captions shown between start and end, timed from start. """
+        shifted = [chunk.shifted(start, end) for chunk in self.chunks]
+        return [chunk for chunk in shifted if chunk is not None]
+
+    def to_json(self):
+        return {"ayat": [[a.start_time, a.end_time, a.text] for a in self.ayat],
+                "chunks": [[c.start_time, c.end_time, c.text] for c in self.chunks]}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls([TimedText(*a) for a in data["ayat"]], [TimedText(*c) for c in data["chunks"]])
+
+    def write(self, filename):
+        """ Write the timeline to a JSON file, e.g. to debug caption timings. """
+        with open(filename, "w", encoding="utf-8") as file:
+            json.dump(self.to_json(), file, ensure_ascii=False, indent=1)
+        return filename
+
+    @classmethod
+    def read(cls, filename):
+        """ Read a timeline written by write. """
+        with open(filename, "r", encoding="utf-8") as file:
+            return cls.from_json(json.load(file))
@@ -1,14 +1,20 @@
-import os, requests, json, logging
+import os, json, logging, time, math, threading, contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from codebase import metrics
 
 USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:106.0) Gecko/20100101 Firefox/106.0'
 
+# requests is imported on first use, it is the slowest import of the command line and the API start
+
 def request_json(url, headers= {}):
+    import requests
     headers["user_agent"] = USER_AGENT
     logging.info(f"Request: {url} Headers: {headers}")
     try:
         response = requests.get(url, headers= headers)
     except Exception as e:
-        logging.error(f"Error: Unable to download file. error: {e}")
+        logging.error(f"Error: Unable to fetch resource {url}. error: {e}")
+        return ""
 
     if response.status_code == 200:
         return json.loads(response.content)
@@ -18,28 +24,249 @@ def request_json(url, headers= {}):
         logging.info(f"Requested resource: {url}")
         return ""
 
-def download_file(url, filename, headers= {}):
+DOWNLOAD_CHUNK_SIZE = 1024*1024
+PARTIAL_SUFFIX = ".part"
+
+def download_file(url, filename, headers= {}, progress_callback=None):
+    """
+    Stream a file to disk chunk by chunk, so memory stays flat whatever the file size.
+
+    The file is written to filename + PARTIAL_SUFFIX and renamed once complete. A partial file
+    left by an interrupted download is resumed with an HTTP Range request.
+
+    Parameters:
+        url (str): The link of the file.
+        filename (str): The destination of the file.
+        headers (dict, optional): Additional request headers.
+        progress_callback (callable, optional): Called with (downloaded bytes, total bytes or None)
+                                                after each chunk.
+
+    Returns:
+        bool: True if the file was completely downloaded.
+    """
+    import requests
+    headers = dict(headers)
     headers["user_agent"] = USER_AGENT
+    partial_filename = filename + PARTIAL_SUFFIX
+    offset = os.path.getsize(partial_filename) if os.path.exists(partial_filename) else 0
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
     logging.info(f"Request: {url} Headers: {headers}")
 
     try:
-        response = requests.get(url, headers= headers)
+        response = requests.get(url, headers= headers, stream=True)
     except Exception as e:
         logging.error(f"Error: Unable to download file. error: {e}")
+        return False
 
-    if response.status_code == 200:
-        with open(filename, 'wb') as file:
-            file.write(response.content)
-        return True
-    elif response.status_code == 404: 
-        logging.error(f"Error: The requested resource doesn't exist. Status code: {response.status_code}")
-        logging.info(f"Requested resource: {url}")
+    with response:
+        if response.status_code == 416 and offset:
+            logging.info(f"Discarding partial file {partial_filename}, range not satisfiable")
+            os.remove(partial_filename)
+            return download_file(url, filename, headers= {k: v for k, v in headers.items() if k != "Range"},
+                                 progress_callback= progress_callback)
+        elif response.status_code == 206 and offset:
+            logging.info(f"Resuming download of {filename} from byte {offset}")
+            mode = "ab"
+        elif response.status_code == 200:
+            offset = 0
+            mode = "wb"
+        elif response.status_code == 404: 
+            logging.error(f"Error: The requested resource doesn't exist. Status code: {response.status_code}")
+            logging.info(f"Requested resource: {url}")
+            return False
+        else:
+            logging.error(f"Error: Unable to download file. Status code: {response.status_code}")
+            logging.info(f"Requested resource: {url}")
+            return False
+
+        content_length = response.headers.get("Content-Length")
+        checked_length = content_length is not None and "Content-Encoding" not in response.headers
+        total_size = offset + int(content_length) if checked_length else None
+
+        downloaded = offset
+        try:
+            with open(partial_filename, mode) as file:
+                for chunk in response.iter_content(chunk_size= DOWNLOAD_CHUNK_SIZE):
+                    file.write(chunk)
+                    downloaded += len(chunk)
+                    metrics.add_bytes(len(chunk))
+                    if progress_callback: progress_callback(downloaded, total_size)
+        except Exception as e:
+            logging.error(f"Error: Download of {url} interrupted at byte {downloaded}. error: {e}")
+            return False
+
+    if total_size is not None and downloaded != total_size:
+        logging.error(f"Error: Incomplete download of {url}, got {downloaded} of {total_size} bytes")
         return False
-    else:
-        logging.error(f"Error: Unable to download file. Status code: {response.status_code}")
-        logging.info(f"Requested resource: {url}")
+
+    os.replace(partial_filename, filename)
+    return True
+
+class ConnectionBudget:
+    """
+    A total number of simultaneous HTTP connections shared between concurrent downloads.
+
+    Example:
+        budget = ConnectionBudget(8)
+        with budget:
+            download_file(link, filename)
+    """
+
+    def __init__(self, connections):
+        self.connections = connections
+        self.semaphore = threading.BoundedSemaphore(connections)
+
+    def __enter__(self):
+        self.semaphore.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.semaphore.release()
+
+SEGMENT_MIN_SIZE = 8*1024*1024
+SEGMENTS_PER_FILE = 4
+
+def download_segment(url, filename, start, end, headers):
+    """ Download bytes start..end (inclusive) of a resource straight into their place in filename. """
+    import requests
+    headers = dict(headers)
+    headers["Range"] = f"bytes={start}-{end}"
+    try:
+        with requests.get(url, headers= headers, stream=True) as response:
+            if response.status_code != 206:
+                logging.error(f"Error: Unable to download segment {start}-{end}. Status code: {response.status_code}")
+                return False
+            position = start
+            with open(filename, "r+b") as file:
+                file.seek(start)
+                for chunk in response.iter_content(chunk_size= DOWNLOAD_CHUNK_SIZE):
+                    remaining = end + 1 - position
+                    if remaining <= 0:
+                        break
+                    file.write(chunk[:remaining])
+                    position += len(chunk)
+                    metrics.add_bytes(min(len(chunk), remaining))
+    except Exception as e:
+        logging.error(f"Error: Unable to download segment {start}-{end}. error: {e}")
         return False
 
+    if position < end + 1:
+        logging.error(f"Error: Incomplete segment {start}-{end} of {url}, stopped at byte {position}")
+        return False
+    return True
+
+def download_file_segmented(url, filename, budget, headers= {}, segments= SEGMENTS_PER_FILE, min_segment_size= SEGMENT_MIN_SIZE):
+    """
+    Download a file over several parallel HTTP Range requests when the server supports them, writing
+    each segment in place into a preallocated file. Falls back to download_file otherwise.
+
+    Parameters:
+        url (str): The link of the file.
+        filename (str): The destination of the file.
+        budget (ConnectionBudget): The connections shared with the other downloads. Each segment holds one.
+        headers (dict, optional): Additional request headers.
+        segments (int, optional): The maximum number of segments of a file.
+        min_segment_size (int, optional): Files are only split in segments of at least this size in bytes.
+
+    Returns:
+        bool: True if the file was completely downloaded.
+    """
+    import requests
+    headers = dict(headers)
+    headers["user_agent"] = USER_AGENT
+
+    try:
+        with budget:
+            response = requests.head(url, headers= headers, allow_redirects=True)
+    except Exception as e:
+        logging.error(f"Error: Unable to request file headers. error: {e}")
+        response = None
+
+    size = 0
+    if response is not None and response.status_code == 200 and \
+       response.headers.get("Accept-Ranges", "").lower() == "bytes" and \
+       "Content-Encoding" not in response.headers:
+        size = int(response.headers.get("Content-Length", 0))
+        url = response.url
+
+    n_segments = min(segments, size // min_segment_size)
+    if n_segments < 2:
+        with budget:
+            return download_file(url, filename, headers)
+
+    logging.info(f"Downloading {url} ({size} bytes) in {n_segments} segments")
+    partial_filename = filename + PARTIAL_SUFFIX
+    with open(partial_filename, "wb") as file:
+        file.truncate(size)
+
+    segment_size = math.ceil(size / n_segments)
+    ranges = [(start, min(size, start + segment_size) - 1) for start in range(0, size, segment_size)]
+
+    def budgeted_segment(start, end):
+        with budget:
+            return download_segment(url, partial_filename, start, end, headers)
+
+    # segments are counted in the metrics of the stage downloading the file
+    with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, budgeted_segment, *r) for r in ranges]
+        results = [future.result() for future in futures]
+
+    if not all(results):
+        os.remove(partial_filename)
+        return False
+
+    os.replace(partial_filename, filename)
+    return True
+
+def download_files(urls, filenames, max_workers=8, verbose=False, download=download_file):
+    """
+    Download several files concurrently, stopping at the first failure.
+
+    Parameters:
+        urls (list): Links of the files to download.
+        filenames (list): Destination of each link, in the same order.
+        max_workers (int, optional): The maximum number of simultaneous downloads. Default is 8.
+        verbose (bool, optional): If True, print the download time of each file as it completes.
+        download (callable, optional): Called with (url, filename) to download one file. Default is download_file.
+
+    Returns:
+        (bool, list): Whether all downloads succeeded, and the download time in seconds of each
+                      file in order (None for files that were not downloaded).
+
+    Example:
+        download_files([link1, link2], ["./temp/a.mp3", "./temp/b.mp3"], max_workers=4)
+        Result: (True, [0.41, 0.37])
+    """
+    def timed_download(url, filename):
+        sttime = time.time()
+        succsess = download(url, filename)
+        return succsess, time.time() - sttime
+
+    timings = [None] * len(urls)
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+    futures = {executor.submit(contextvars.copy_context().run, timed_download, url, filename): i
+               for i, (url, filename) in enumerate(zip(urls, filenames))}
+    for future in as_completed(futures):
+        i = futures[future]
+        try:
+            succsess, duration = future.result()
+        except Exception as e:
+            logging.error(f"Error: Unable to download file. error: {e}")
+            succsess, duration = False, None
+
+        if not succsess:
+            # return without waiting for the downloads in flight, the queued ones are cancelled
+            executor.shutdown(wait=False, cancel_futures=True)
+            return False, timings
+
+        timings[i] = duration
+        logging.info(f"Downloaded {filenames[i]} in {duration:.2f} s")
+        if verbose: print(f"- File {os.path.basename(filenames[i])} {duration:.2f} s")
+
+    executor.shutdown()
+    return True, timings
+
 def remove_directory(path):
     try:
         for file_or_dir in os.listdir(path):
@@ -0,0 +1,153 @@
+import logging, threading, re
+from bisect import bisect_left, bisect_right
+from codebase.utils import request_json
+from codebase.cache import MetadataCache
+
+PEXELS_API_KEY = "fpKSq3NBtPzsmv82jJ2ZTDG946ILieYMpYdJx5hwVJjnti7gPCcZSTa9"
+PEXELS_SEARCH_URL = "https://api.pexels.com/videos/search?query="
+CATALOG_PER_PAGE = 80
+CATALOG_MAX_PAGES = 10
+CATALOG_TTL = 7*24*3600
+
+def video_tags(url):
+  """
+    Generate tags from the words of a pexels video page link.
+
+    Example:
+        video_tags("https://www.pexels.com/video/aerial-view-of-mountains-1409899/")
+        Result: ['aerial', 'view', 'of', 'mountains', '1409899']
+  """
+  url = url[:-1] if url[-1]=="/" else url
+  video_title = url.split("/")[-1]
+  return video_title.split("-")
+
+def fetch_catalog(keyword):
+  """
+    Fetch the metadata of the videos associated with a keyword from pexels.com using large pages.
+
+    Returns:
+        A list of video dictionaries containing the following keys: ['id', 'duration', 'tags', 'renditions'].
+        - 'renditions': A list of dictionaries with keys ['width', 'height', 'fps', 'size', 'link'].
+          'fps' and 'size' (bytes) are None when pexels doesn't report them.
+
+    Raises:
+        Exception: If the first page can't be fetched.
+  """
+  videos = []
+  page = 1
+  total_results = None
+  while page <= CATALOG_MAX_PAGES:
+    query = PEXELS_SEARCH_URL + keyword + "&page=" + str(page) + "&per_page=" + str(CATALOG_PER_PAGE)
+    data = request_json(query, headers= {'Authorization': PEXELS_API_KEY})
+    if(not data):
+      if page == 1:
+        error_message = "Problem fetching videos catalog"
+        logging.error(error_message)
+        raise Exception(error_message)
+      logging.error(f"Error: Unable to fetch page {page} of {keyword} videos catalog")
+      break
+
+    total_results = data["total_results"]
+    for video in data["videos"]:
+      videos += [{"id": video["id"],
+                  "duration": video["duration"],
+                  "tags": video_tags(video["url"]),
+                  "renditions": [{"width": f["width"], "height": f["height"],
+                                  "fps": f.get("fps"), "size": f.get("size"), "link": f["link"]}
+                                 for f in video["video_files"] if f.get("width") and f.get("height")]}]
+
+    if page * CATALOG_PER_PAGE >= total_results or not data["videos"]:
+      break
+    page += 1
+
+  logging.info(f"Fetched {len(videos)} of {total_results} videos for keyword {keyword}")
+  return videos
+
+class VideoCatalog:
+  """
+    A locally persisted catalog of pexels videos metadata for one keyword, indexed by tags,
+    duration and renditions so videos can be selected without calling the API.
+
+    Parameters:
+        keyword (str): The keyword associated with the videos. Ex. "nature", "river", "mountain".
+
+    Example:
+        catalog = VideoCatalog("aerial landscape")
+        catalog.query((1080, 1920), blacklist=["people"], min_duration=5)
+        Result: [{'id': 6528623, 'duration': 44, 'width': 2160, 'height': 3840, 'tags': [...], 'link': '...',
+                  'fps': 25, 'size': 81233451}, ...]
+  """
+
+  def __init__(self, keyword):
+    self.keyword = keyword
+    name = "pexels_" + re.sub(r"[^a-z0-9]+", "_", keyword.lower())
+    self.cache = MetadataCache(name, lambda: fetch_catalog(keyword), version=1, ttl=CATALOG_TTL)
+    self.indexed_data = None
+    self.lock = threading.Lock()
+
+  def index(self):
+    """ Build the in-memory indexes over the cached videos, once per catalog refresh. """
+    videos = self.cache.get()
+    with self.lock:
+      if self.indexed_data is videos:
+        return
+      self.videos = {video["id"]: video for video in videos}
+      self.tags = {}
+      for video in videos:
+        for tag in video["tags"]:
+          self.tags.setdefault(tag.lower(), set()).add(video["id"])
+      by_duration = sorted(videos, key=lambda video: video["duration"])
+      self.durations = [video["duration"] for video in by_duration]
+      self.ids_by_duration = [video["id"] for video in by_duration]
+      self.indexed_data = videos
+
+  def query(self, size, blacklist=None, exclude_ids=None, min_duration=0, max_duration=None):
+    """
+      Select videos locally, applying the blacklist and the size filter before any download.
+
+      Parameters:
+          size (int, int): The required minimum width and height as a tuple (min_width, min_height).
+          blacklist (list, optional): Tags that shouldn't occur in the video.
+          exclude_ids (list, optional): Ids of videos already selected.
+          min_duration (int, optional): Minimum video duration in seconds.
+          max_duration (int, optional): Maximum video duration in seconds.
+
+      Returns:
+          A list of video dictionaries in the format of fetch_video.get_pexeles_video, with the
+          rendition nearest (but larger) to the required size, plus its 'fps' and 'size'.
+    """
+    from codebase.fetch_video import get_index_smallest_larger_size
+
+    self.index()
+    excluded = set(exclude_ids or ())
+    for word in set(blacklist or ()):
+      excluded |= self.tags.get(word.lower(), set())
+
+    low = bisect_left(self.durations, min_duration)
+    high = len(self.durations) if max_duration is None else bisect_right(self.durations, max_duration)
+
+    candidates = []
+    for video_id in self.ids_by_duration[low:high]:
+      if video_id in excluded:
+        continue
+      video = self.videos[video_id]
+      renditions = video["renditions"]
+      rendition_index = get_index_smallest_larger_size(size[0], size[1], [(r["width"], r["height"]) for r in renditions])
+      if rendition_index == -1:
+        continue
+      rendition = renditions[rendition_index]
+      candidates += [{"id": video["id"], "duration": video["duration"],
+                      "width": rendition["width"], "height": rendition["height"],
+                      "tags": video["tags"], "link": rendition["link"],
+                      "fps": rendition["fps"], "size": rendition["size"]}]
+    return candidates
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+def get_catalog(keyword):
+  """ Get the catalog of a keyword, created once per process. """
+  with _catalogs_lock:
+    if keyword not in _catalogs:
+      _catalogs[keyword] = VideoCatalog(keyword)
+    return _catalogs[keyword]
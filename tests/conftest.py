@@ -0,0 +1,5 @@
+import os, sys, tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+# the caches are created at import, keep them out of the user cache
+os.environ.setdefault("AUTO_GENERATOR_CACHE", tempfile.mkdtemp(prefix="auto_generator_cache_"))
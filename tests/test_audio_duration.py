@@ -0,0 +1,86 @@
+import shutil, struct, subprocess
+import pytest
+from codebase.audio_duration import parse_frame_header, read_vbr_tag, headers_duration, mp3_duration, decoded_duration
+
+# MPEG1 layer III, 128 kbps, 44100 Hz, stereo: 1152 samples and 417 bytes (418 with padding) per frame
+SAMPLES, SAMPLE_RATE = 1152, 44100
+
+def frame_header(bitrate_index=9, padding=0, mono=False, version_bits=3, sample_rate_index=0):
+    b1 = 0xE0 | (version_bits << 3) | (1 << 1) | 1
+    b2 = (bitrate_index << 4) | (sample_rate_index << 2) | (padding << 1)
+    b3 = 0xC0 if mono else 0x00
+    return bytes([0xFF, b1, b2, b3])
+
+def frame(padding=0, body=b""):
+    """ A 128 kbps frame, body written after its header. """
+    length = parse_frame_header(frame_header(padding=padding), 0).length
+    return (frame_header(padding=padding) + body).ljust(length, b"\0")
+
+def id3v2_tag(size):
+    synchsafe = bytes([(size >> 21) & 0x7F, (size >> 14) & 0x7F, (size >> 7) & 0x7F, size & 0x7F])
+    return b"ID3\x04\x00\x00" + synchsafe + b"\0" * size
+
+def xing_frame(frames, delay=0, padding=0, tag=b"Xing", lame=True):
+    """ A frame holding a Xing/Info tag with the frames, bytes, toc and quality fields, and a LAME extension. """
+    body = b"\0" * 32 + tag + struct.pack(">II", 0x0F, frames) + struct.pack(">I", 0) + b"\0" * 100 + struct.pack(">I", 0)
+    if lame:
+        extension = b"LAME3.100".ljust(21, b"\0")
+        extension += bytes([delay >> 4, ((delay & 0x0F) << 4) | (padding >> 8), padding & 0xFF])
+        body += extension
+    return frame(body=body)
+
+def vbri_frame(frames):
+    return frame(body=b"\0" * 32 + b"VBRI" + b"\0" * 10 + struct.pack(">I", frames))
+
+def test_frame_header_lengths():
+    header = parse_frame_header(frame_header(), 0)
+    assert (header.mpeg1, header.layer, header.bitrate, header.sample_rate) == (True, 3, 128, 44100)
+    assert (header.samples, header.length) == (1152, 417)
+    assert parse_frame_header(frame_header(padding=1), 0).length == 418
+
+    # MPEG2 layer III, 64 kbps, 22050 Hz: 576 samples of 72 * 64000 / 22050 bytes
+    header = parse_frame_header(frame_header(bitrate_index=8, version_bits=2), 0)
+    assert (header.mpeg1, header.bitrate, header.sample_rate, header.samples, header.length) == (False, 64, 22050, 576, 208)
+
+def test_invalid_frame_headers():
+    assert parse_frame_header(b"\xff\xfb\xf0\x00", 0) is None  # bad bitrate
+    assert parse_frame_header(b"\xff\xfb\x9c\x00", 0) is None  # reserved sample rate
+    assert parse_frame_header(b"\xff\xeb\x90\x00", 0) is None  # reserved version
+    assert parse_frame_header(b"\xff\xfb", 0) is None
+
+def test_cbr_duration_counts_frames():
+    data = b"".join([frame(padding=i % 2) for i in range(100)])
+    assert headers_duration(data) == pytest.approx(100 * SAMPLES / SAMPLE_RATE)
+    # skipping an ID3v2 tag and an ID3v1 tag at the end
+    assert headers_duration(id3v2_tag(300) + data + b"TAG" + b"\0" * 125) == pytest.approx(100 * SAMPLES / SAMPLE_RATE)
+
+def test_xing_tag_with_lame_delay_and_padding():
+    data = xing_frame(1000, delay=576, padding=1000) + frame() * 3
+    header = parse_frame_header(data, 0)
+    assert read_vbr_tag(data, 0, header) == (1000, 576, 1000)
+    # the frames of the tag, not the frames in the data
+    assert headers_duration(data) == pytest.approx((1000 * SAMPLES - 576 - 1000) / SAMPLE_RATE)
+
+def test_info_tag_without_lame_extension():
+    data = xing_frame(500, tag=b"Info", lame=False) + frame() * 3
+    assert read_vbr_tag(data, 0, parse_frame_header(data, 0)) == (500, 0, 0)
+    assert headers_duration(data) == pytest.approx(500 * SAMPLES / SAMPLE_RATE)
+
+def test_vbri_tag():
+    data = vbri_frame(250) + frame() * 3
+    assert read_vbr_tag(data, 0, parse_frame_header(data, 0)) == (250, 0, 0)
+    assert headers_duration(data) == pytest.approx(250 * SAMPLES / SAMPLE_RATE)
+
+def test_no_frames():
+    assert headers_duration(b"\0" * 2000) is None
+
+# pydub decodes with ffmpeg and reads the stream info with ffprobe
+@pytest.mark.skipif(shutil.which("ffmpeg") is None or shutil.which("ffprobe") is None, reason="ffmpeg not installed")
+@pytest.mark.parametrize("options", [["-b:a", "192k"], ["-q:a", "4"], ["-b:a", "64k", "-write_xing", "0"]],
+                         ids=["cbr", "vbr", "cbr without xing"])
+def test_headers_and_decoded_durations_agree(tmp_path, options):
+    pytest.importorskip("pydub")
+    filename = str(tmp_path / "recitation.mp3")
+    subprocess.run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-f", "lavfi", "-i", "sine=f=440:d=6.3",
+                    "-c:a", "libmp3lame", *options, filename], check=True)
+    assert mp3_duration(filename) == pytest.approx(decoded_duration(filename), abs=0.05)
@@ -0,0 +1,59 @@
+import os, time
+from codebase.utils import PARTIAL_SUFFIX
+from codebase.cache import FileCache
+
+def produce(size):
+    def producer(path):
+        with open(path, "wb") as file:
+            file.write(b"0" * size)
+        return True
+    return producer
+
+def test_evicts_least_recently_used_entries(tmp_path):
+    cache = FileCache("clips", 250, directory=str(tmp_path))
+    for name in ["a", "b", "c"]:
+        assert cache.fetch((name,), produce(100), str(tmp_path / f"{name}.out"))
+    # "a" was evicted when "c" was added, "b" is now used before "d" is added
+    assert cache.get(("a",)) is None
+    assert cache.get(("b",)) is not None
+    cache.fetch(("d",), produce(100), str(tmp_path / "d.out"))
+
+    assert cache.get(("b",)) is not None
+    assert cache.get(("c",)) is None
+    assert cache.total_size == 200
+
+def test_partial_downloads_are_not_entries(tmp_path):
+    root = tmp_path / "clips"
+    root.mkdir()
+    (root / "old").write_bytes(b"0" * 100)
+    partial = root / "new.tmp.part"
+    partial.write_bytes(b"0" * 1000)
+
+    cache = FileCache("clips", 150, directory=str(tmp_path))
+    cache.fetch(("new",), produce(100), str(tmp_path / "new.out"))
+
+    assert os.path.exists(partial)
+    assert cache.get(("old",)) is None
+    assert cache.get(("new",)) is not None
+
+def test_failed_producer_leaves_no_partial_file(tmp_path):
+    cache = FileCache("clips", 1000, directory=str(tmp_path))
+    def producer(path):
+        # a download interrupted midway keeps its partial file to resume it
+        (tmp_path / "clips" / (os.path.basename(path) + PARTIAL_SUFFIX)).write_bytes(b"0" * 10)
+        return False
+
+    assert not cache.fetch(("a",), producer, str(tmp_path / "a.out"))
+    assert os.listdir(tmp_path / "clips") == []
+
+def test_stale_partial_downloads_are_removed(tmp_path):
+    root = tmp_path / "clips"
+    root.mkdir()
+    stale = root / "old.1.2.tmp.part"
+    stale.write_bytes(b"0" * 1000)
+    os.utime(stale, (time.time() - FileCache.STALE_AGE - 1,) * 2)
+
+    cache = FileCache("clips", 1000, directory=str(tmp_path))
+    cache.fetch(("new",), produce(100), str(tmp_path / "new.out"))
+
+    assert not os.path.exists(stale)
@@ -0,0 +1,82 @@
+import pytest
+from codebase import quran_index, fetch_audio
+
+SURAHS = [{"id": 1, "name": "سورة الفاتحة", "aya_base": 0, "n_aya": 2},
+          {"id": 2, "name": "سورة البقرة", "aya_base": 2, "n_aya": 3}]
+RECITERS = [{"id": 1, "name": "عبد الباسط عبد الصمد", "code": "ar.abdulbasitmurattal"}]
+BISMILLAH = "بِسۡمِ ٱللَّهِ ٱلرَّحۡمَـٰنِ ٱلرَّحِیمِ"
+AYAT = [BISMILLAH, "ٱلۡحَمۡدُ لِلَّهِ رَبِّ ٱلۡعَـٰلَمِینَ", BISMILLAH + " الۤمۤ", "ذَ ٰ⁠لِكَ ٱلۡكِتَـٰبُ", "ٱلَّذِینَ یُؤۡمِنُونَ"]
+
+def edition():
+    """ The response of the full edition request, for SURAHS and AYAT. """
+    surahs = []
+    for surah in SURAHS:
+        ayahs = [{"number": surah["aya_base"] + n, "text": AYAT[surah["aya_base"] + n - 1]} for n in range(1, surah["n_aya"] + 1)]
+        surahs += [{"number": surah["id"], "ayahs": ayahs}]
+    return {"data": {"surahs": surahs}}
+
+@pytest.fixture
+def requests_made(tmp_path, monkeypatch):
+    """ No bundled index, an empty cache and the API answering the full edition request only. """
+    requests_made = []
+    def request_json(url, headers={}):
+        requests_made.append(url)
+        return edition() if url == f"https://api.alquran.cloud/v1/quran/{quran_index.EDITION}" else None
+
+    monkeypatch.setattr(quran_index, "INDEX_FILE", str(tmp_path / "bundled.idx"))
+    monkeypatch.setattr(quran_index, "CACHED_INDEX_FILE", str(tmp_path / "cache" / "quran.idx"))
+    monkeypatch.setattr(quran_index, "_index", None)
+    monkeypatch.setattr(quran_index, "_index_failed_at", None)
+    monkeypatch.setattr(quran_index, "request_json", request_json)
+    monkeypatch.setattr(fetch_audio, "request_json", request_json)
+    monkeypatch.setattr(fetch_audio, "get_surahs", lambda with_base=True: SURAHS)
+    monkeypatch.setattr(fetch_audio, "get_reciters", lambda with_code=True: RECITERS)
+    yield requests_made
+    if quran_index._index:
+        quran_index._index.close()
+
+def test_write_and_read_index(tmp_path):
+    filename = str(tmp_path / "quran.idx")
+    quran_index.write_index([(s["aya_base"], s["n_aya"]) for s in SURAHS], AYAT, filename)
+    index = quran_index.QuranIndex(filename)
+    try:
+        assert [index.ayah_text(n) for n in range(1, len(AYAT) + 1)] == AYAT
+        assert index.surah(2) == {"id": 2, "aya_base": 2, "n_aya": 3}
+        with pytest.raises(IndexError):
+            index.ayah_text(len(AYAT) + 1)
+    finally:
+        index.close()
+
+def test_recitations_use_the_index_built_on_first_use(requests_made):
+    recitations = fetch_audio.get_recitations(1, 2, 1, 3)
+
+    # one request of the whole edition, none per ayah
+    assert requests_made == [f"https://api.alquran.cloud/v1/quran/{quran_index.EDITION}"]
+    assert [r["text"] for r in recitations["recitations"]] == ["الۤمۤ", "ذَ ٰ⁠لِكَ ٱلۡكِتَـٰبُ", "ٱلَّذِینَ یُؤۡمِنُونَ"]
+    assert recitations["recitations"][0]["audio_link"].endswith("/ar.abdulbasitmurattal/3.mp3")
+
+    # later jobs reuse the index
+    fetch_audio.get_recitations(1, 1, 1, 2)
+    assert len(requests_made) == 1
+
+def test_recitations_fall_back_to_ayah_requests_without_index(requests_made, monkeypatch):
+    def build_index(filename):
+        raise Exception("API unreachable")
+    monkeypatch.setattr(quran_index, "build_index", build_index)
+    with pytest.raises(fetch_audio.NamedError):
+        fetch_audio.get_recitations(1, 1, 1, 2)
+    assert requests_made == ["https://api.alquran.cloud/v1/ayah/1"]
+
+def test_recitations_use_the_bundled_index(requests_made):
+    quran_index.write_index([(s["aya_base"], s["n_aya"]) for s in SURAHS], AYAT, quran_index.INDEX_FILE)
+    fetch_audio.get_recitations(1, 1, 1, 2)
+    assert requests_made == []
+
+def test_bundled_index_of_another_version_is_rebuilt_in_the_cache(requests_made):
+    quran_index.write_index([(s["aya_base"], s["n_aya"]) for s in SURAHS], AYAT, quran_index.INDEX_FILE)
+    with open(quran_index.INDEX_FILE, "r+b") as file:
+        file.write(quran_index.HEADER.pack(quran_index.MAGIC, quran_index.VERSION + 1, len(SURAHS), len(AYAT)))
+
+    recitations = fetch_audio.get_recitations(1, 1, 1, 2)
+    assert requests_made == [f"https://api.alquran.cloud/v1/quran/{quran_index.EDITION}"]
+    assert [r["text"] for r in recitations["recitations"]] == [AYAT[0], AYAT[1]]
@@ -0,0 +1,82 @@
+import shutil, struct, subprocess
+import pytest
+from codebase.subtitles import write_ass, ass_filter, text_layout, font_size_scale, FONT_FILE
+from codebase.timeline import TimedText
+
+WIDTH, HEIGHT = 360, 640
+
+def ffmpeg_filters():
+    if shutil.which("ffmpeg") is None:
+        return []
+    output = subprocess.run(["ffmpeg", "-hide_banner", "-filters"], capture_output=True, text=True).stdout
+    return [line.split()[1] for line in output.splitlines() if len(line.split()) > 2]
+
+FILTERS = ffmpeg_filters()
+
+def cap_height():
+    """ The height of the capital letters of the font, in em (OS/2 table). """
+    with open(FONT_FILE, "rb") as file:
+        data = file.read()
+    tables = {}
+    for i in range(struct.unpack_from(">H", data, 4)[0]):
+        tag, _, offset, _ = struct.unpack_from(">4sIII", data, 12 + 16 * i)
+        tables[tag] = offset
+    units_per_em, = struct.unpack_from(">H", data, tables[b"head"] + 18)
+    return struct.unpack_from(">h", data, tables[b"OS/2"] + 88)[0] / units_per_em
+
+def text_rows(video_filter):
+    """ The first and last rows of the white text drawn by video_filter on a black frame. """
+    frame = subprocess.run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-f", "lavfi",
+                            "-i", f"color=c=black:s={WIDTH}x{HEIGHT}:d=1", "-vf", video_filter,
+                            "-frames:v", "1", "-pix_fmt", "gray", "-f", "rawvideo", "-"],
+                           capture_output=True, check=True).stdout
+    rows = [y for y in range(HEIGHT) if max(frame[y * WIDTH:(y + 1) * WIDTH]) > 128]
+    return rows[0], rows[-1]
+
+def text_height(video_filter):
+    top, bottom = text_rows(video_filter)
+    return bottom - top + 1
+
+def test_font_size_scale():
+    # Amiri: win ascent 3814, win descent 1810, 2048 units per em
+    assert font_size_scale() == pytest.approx(5624 / 2048)
+
+@pytest.mark.skipif("ass" not in FILTERS, reason="ffmpeg without libass")
+@pytest.mark.parametrize("hd", [False, True])
+def test_ass_text_has_the_drawtext_em_size(tmp_path, hd):
+    title = text_layout(WIDTH, HEIGHT, hd)["title"]
+    subtitles_file = write_ass([], WIDTH, HEIGHT, hd, str(tmp_path / "title.ass"), title="HH", duration=1)
+    assert text_height(ass_filter(subtitles_file)) == pytest.approx(cap_height() * title["fontsize"], abs=2)
+
+@pytest.mark.skipif("ass" not in FILTERS or "drawtext" not in FILTERS, reason="ffmpeg without libass or drawtext")
+def test_ass_text_height_matches_drawtext(tmp_path):
+    title = text_layout(WIDTH, HEIGHT, False)["title"]
+    subtitles_file = write_ass([], WIDTH, HEIGHT, False, str(tmp_path / "title.ass"), title="بسم الله", duration=1)
+    drawtext = f"drawtext=text='بسم الله':x=(w-text_w)/2:y={title['y']}:fontsize={title['fontsize']}:fontfile={FONT_FILE}:fontcolor=white"
+    assert text_height(ass_filter(subtitles_file)) == pytest.approx(text_height(drawtext), rel=0.1)
+
+@pytest.mark.skipif("ass" not in FILTERS, reason="ffmpeg without libass")
+@pytest.mark.parametrize("hd", [False, True])
+def test_ass_text_has_the_drawtext_position(tmp_path, hd):
+    layout = text_layout(WIDTH, HEIGHT, hd)
+    # the top of the title and subtitle, the middle of the captions
+    title_file = write_ass([], WIDTH, HEIGHT, hd, str(tmp_path / "title.ass"), title="سورة الفاتحة", duration=1)
+    assert text_rows(ass_filter(title_file))[0] == pytest.approx(layout["title"]["y"], abs=0.1 * layout["title"]["fontsize"])
+
+    captions_file = write_ass([TimedText(0, 1, "مَـٰلِكِ یَوۡمِ ٱلدِّینِ")], WIDTH, HEIGHT, hd, str(tmp_path / "captions.ass"))
+    top, bottom = text_rows(ass_filter(captions_file))
+    assert (top + bottom) / 2 == pytest.approx(layout["caption"]["y"], abs=0.1 * layout["caption"]["fontsize"])
+
+@pytest.mark.skipif("ass" not in FILTERS, reason="ffmpeg without libass")
+def test_ass_filter_escapes_the_path(tmp_path):
+    directory = tmp_path / "it's [a], b; c=d:e"
+    directory.mkdir()
+    subtitles_file = write_ass([], WIDTH, HEIGHT, False, str(directory / "title.ass"), title="HH", duration=1)
+    plain_file = write_ass([], WIDTH, HEIGHT, False, str(tmp_path / "title.ass"), title="HH", duration=1)
+    assert text_rows(ass_filter(subtitles_file)) == text_rows(ass_filter(plain_file))
+    # in a filter complex too, as the compose filter script
+    frame = subprocess.run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-f", "lavfi",
+                            "-i", f"color=c=black:s={WIDTH}x{HEIGHT}:d=1", "-filter_complex", f"[0:v]{ass_filter(subtitles_file)}[out]",
+                            "-map", "[out]", "-frames:v", "1", "-pix_fmt", "gray", "-f", "rawvideo", "-"],
+                           capture_output=True, check=True).stdout
+    assert max(frame) > 128